@@ -0,0 +1,255 @@
+"""
+Control API: drive and inspect the running app over local HTTP
+
+For scripts, dashboards and benchmarks. With an ``api`` section the app
+serves, on the same event loop as the Telegram bots::
+
+    "api": {"port": 8766, "host": "127.0.0.1", "token": "change-me"}
+
+    GET  /health
+    GET  /status                                 workers, queues and pipeline latency
+    GET  /devices                                device states from the caches
+    GET  /rules                                  the rules /trigger accepts
+    POST /trigger {"rule": "raid"}               queues the rule like an alarm (202)
+    POST /action  {"action": "color", "color": "#ff0000"}
+                                                 runs now, answers with the result
+    POST /reload                                 re-reads config.json
+
+with the token in an ``Authorization: Bearer <token>`` (or ``X-API-Token``)
+header; a host other than loopback requires one. ``/trigger`` goes through the priority scheduler like any alarm;
+``/action`` puts its keys on top of the current settings and runs them
+right away, like the Test button. Reads never touch a device: ``/devices``
+reports circuit breakers, alarm counters and the discovery cache.
+
+The server is the one in ``local_http.py``; a request costs a dict lookup
+and a JSON encode on top of the kept-alive connection.
+"""
+
+import asyncio
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+
+from app_logging import get_logger, kv, throttle
+from discovery import device_cache
+from dispatch import ActionResult, action_plans
+from journal import UPDATE, journal
+from led_controllers import CircuitBreaker, breaker_states
+from local_http import LOOPBACK, JSONServer, check_secret, parse_object
+from metrics import AlarmTrace, pipeline_metrics
+from rules import AlarmEvent, Rule
+from rustplus import rustplus_settings
+from telegram_intake import bot_specs_from_config
+from webhook import webhook_settings
+from zones import zone_members
+
+log = get_logger("api")
+
+DEFAULT_PORT = 8766
+ACTION_TIMEOUT = 30.0  # seconds /action waits for the device
+
+
+class APISettings(NamedTuple):
+    host: str
+    port: int
+    token: str
+
+    @property
+    def connection(self) -> Tuple:
+        """What a restart of the server is needed for"""
+        return self.host, self.port
+
+
+def api_settings(config: Dict) -> Optional[APISettings]:
+    """Settings from the ``api`` section; None when it's missing or disabled"""
+    section = config.get("api")
+    if not section or not section.get("enabled", True):
+        return None
+    return APISettings(section.get("host", "127.0.0.1"), int(section.get("port", DEFAULT_PORT)),
+                       str(section.get("token", "")))
+
+
+def config_rules(config: Dict) -> Dict[str, Rule]:
+    """Every rule by name: Telegram chats first, then the webhook and Rust+"""
+    specs, _ = bot_specs_from_config(config)
+    groups = [route.rules for spec in specs for route in spec.chats.values()]
+    for settings in (webhook_settings(config), rustplus_settings(config)):
+        if settings:
+            groups.append(settings.rules)
+    rules: Dict[str, Rule] = {}
+    for group in groups:
+        for rule in group:
+            rules.setdefault(rule.name, rule)
+    return rules
+
+
+def device_states(config: Dict, rules: Iterable[Rule]) -> Dict[str, Dict]:
+    """Per device: the rules that target it, its circuit and alarm counters"""
+    devices: Dict[str, Dict] = {}
+
+    def entry(device_key: str) -> Dict:
+        return devices.setdefault(device_key, {"rules": [], "breaker": None, "alarms": None})
+
+    for rule in rules:
+        rule_config = rule.apply(config)
+        try:
+            members = zone_members(rule_config) if rule_config.get("zone") else [rule_config]
+        except ValueError:
+            continue  # the zone doesn't exist; the alarm reports it
+        for member in members:
+            controller = action_plans.get(member).controller
+            if controller:
+                entry(controller.device_key)["rules"].append(rule.name)
+    for device_key, breaker in breaker_states().items():
+        entry(device_key)["breaker"] = breaker
+    for device_key, alarms in pipeline_metrics.snapshot()["devices"].items():
+        entry(device_key)["alarms"] = alarms
+    return devices
+
+
+def pool_stats(pool: ThreadPoolExecutor) -> Dict:
+    """Workers and queued calls of a thread pool"""
+    # ThreadPoolExecutor has no public counters
+    return {"workers": pool._max_workers, "queued": pool._work_queue.qsize()}
+
+
+class ControlAPI(JSONServer):
+    """Serves the control API on the current event loop until ``stop()``
+
+    The host supplies what the API can't reach itself: ``run_action(config)``
+    returns a future of an ``ActionResult``, ``status()`` a dict of worker
+    and queue state, ``reload()`` re-reads the config file. Without them the
+    matching endpoints answer 503.
+    """
+
+    name = "Control API"
+    log = log
+
+    def __init__(self, config: Dict, on_event: Callable[[AlarmEvent], None],
+                 run_action: Optional[Callable[[Dict], "Future[ActionResult]"]] = None,
+                 status: Optional[Callable[[], Dict]] = None,
+                 reload: Optional[Callable[[], None]] = None,
+                 on_status: Optional[Callable[[str, str], None]] = None):
+        super().__init__()
+        self.config = config
+        self.on_event = on_event
+        self.run_action = run_action
+        self.status = status
+        self.reload = reload
+        self.on_status = on_status or (lambda message, color: None)
+        self.settings = api_settings(config)
+        self.rules = config_rules(config)
+        self._events = 0
+        self._requests = 0
+        self._started = time.monotonic()
+        self._routes = {
+            ("GET", "/health"): self._health,
+            ("GET", "/status"): self._status,
+            ("GET", "/devices"): self._devices,
+            ("GET", "/rules"): self._rules,
+            ("POST", "/trigger"): self._trigger,
+            ("POST", "/action"): self._action,
+            ("POST", "/reload"): self._reload,
+        }
+        self._paths = {path for _, path in self._routes}
+
+    async def run(self):
+        """Serve until ``stop()``; returns at once without an api section"""
+        self._attach()
+        if not self.running or self.settings is None:
+            return
+        settings = self.settings
+        if not settings.token and settings.host not in LOOPBACK:
+            log.error("Control API has no token; set one or use host 127.0.0.1", extra=kv(host=settings.host))
+            self.on_status("ERROR: Control API needs a token to listen on the network", "red")
+            return
+        if not await self.serve(settings.host, settings.port):
+            self.on_status(f"ERROR: API port {settings.port} unavailable", "red")
+
+    def apply_config(self, config: Dict) -> bool:
+        """Swap in a new token and rules (any thread); False when the server must restart"""
+        settings = api_settings(config)
+        current = self.settings
+        if (settings is None) != (current is None) or (settings and settings.connection != current.connection):
+            return False
+        self.rules = config_rules(config)
+        self.settings = settings
+        self.config = config
+        return True
+
+    async def _handle(self, method: str, path: str, headers: Dict[str, str], body: bytes,
+                      client: str) -> Tuple[int, Dict]:
+        route = self._routes.get((method, path))
+        if route is None:
+            if path in self._paths:
+                return 405, {"error": f"{method} not allowed"}
+            return 404, {"error": "not found"}
+        if route != self._health and not check_secret(headers, self.settings.token, "x-api-token"):
+            log.warning("API request with a wrong token", extra=throttle("api-auth", 30, client=client))
+            return 401, {"error": "wrong token"}
+        try:
+            request = parse_object(body) if method == "POST" else {}
+        except ValueError as e:
+            return 400, {"error": f"invalid JSON: {e}"}
+        self._requests += 1
+        return await route(request, client)
+
+    async def _health(self, request: Dict, client: str) -> Tuple[int, Dict]:
+        return 200, {"ok": True}
+
+    async def _status(self, request: Dict, client: str) -> Tuple[int, Dict]:
+        breakers = breaker_states()
+        status = {
+            "uptime_s": round(time.monotonic() - self._started, 1),
+            "api_requests": self._requests,
+            "pipeline": pipeline_metrics.snapshot()["stages"],
+            "devices": len(breakers),
+            "devices_unavailable": sum(1 for breaker in breakers.values() if breaker["state"] != CircuitBreaker.CLOSED),
+        }
+        if self.status:
+            status.update(self.status())
+        return 200, status
+
+    async def _devices(self, request: Dict, client: str) -> Tuple[int, Dict]:
+        return 200, {"devices": device_states(self.config, self.rules.values()),
+                     "discovered": device_cache.devices()}
+
+    async def _rules(self, request: Dict, client: str) -> Tuple[int, Dict]:
+        return 200, {"rules": [{"name": rule.name, "match": rule.pattern.pattern if rule.pattern else None,
+                                "overrides": rule.overrides} for rule in self.rules.values()]}
+
+    async def _trigger(self, request: Dict, client: str) -> Tuple[int, Dict]:
+        name = request.get("rule")
+        if not name:
+            return 400, {"error": "missing rule"}
+        rule = self.rules.get(str(name))
+        if rule is None:
+            return 404, {"error": f"no rule named {name!r}"}
+        trace = AlarmTrace()
+        text = str(request.get("text") or rule.name)
+        self._events += 1
+        journal.record(UPDATE, source="api", bot=client, chat_id="api", message_id=self._events,
+                       rule=rule.name, text=text)
+        trace.mark_matched()
+        log.info("✓ API trigger", extra=kv(client=client, rule=rule.name))
+        self.on_event(AlarmEvent("api", client, "api", self._events, text, rule, trace))
+        return 202, {"accepted": True, "rule": rule.name}
+
+    async def _action(self, request: Dict, client: str) -> Tuple[int, Dict]:
+        if self.run_action is None:
+            return 503, {"error": "actions are not available"}
+        config = dict(self.config)
+        config.update(request)
+        log.debug("API action", extra=kv(client=client, action=config.get("action", "on")))
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(self.run_action(config)), ACTION_TIMEOUT)
+        except asyncio.TimeoutError:
+            return 504, {"error": "no answer from the device"}
+        return 200, {"success": result.success, "message": result.message}
+
+    async def _reload(self, request: Dict, client: str) -> Tuple[int, Dict]:
+        if self.reload is None:
+            return 503, {"error": "reloading is not available"}
+        log.info("API reload", extra=kv(client=client))
+        self.reload()
+        return 202, {"reloading": True}
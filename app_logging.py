@@ -0,0 +1,152 @@
+"""
+Structured, leveled logging for RustPlusLED
+
+Every module gets a tagged logger (``get_logger("wled")`` prints as ``[WLED]``)
+built on the standard ``logging`` package, so formatting is lazy: arguments are
+only interpolated when a record is actually emitted, and ``log.debug(...)``
+costs a single level check when DEBUG is disabled.
+
+Records use a compact one-line format::
+
+    I [TELEGRAM] New message detected | chat=-100123 id=42
+
+Structured fields are passed with ``extra=kv(...)`` and repeated messages
+(polling errors, timeouts) can be throttled per key with ``extra=throttle(...)``.
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+ROOT_LOGGER = "rustplusled"
+LEVEL_ENV_VAR = "RUSTPLUSLED_LOG_LEVEL"
+DEFAULT_LEVEL = "INFO"
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def kv(**fields) -> Dict:
+    """Structured fields for a record: ``log.info("sent", extra=kv(device=ip))``"""
+    return {"fields": fields}
+
+
+def throttle(key: str, every: float, **fields) -> Dict:
+    """Emit a record at most once per ``every`` seconds for ``key``.
+
+    Suppressed repeats are counted and reported on the next emitted record.
+    """
+    return {"rate_key": key, "rate_every": every, "fields": fields}
+
+
+class RateLimitFilter(logging.Filter):
+    """Drop records sharing a rate key while inside their interval"""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._state: Dict[str, Tuple[float, int]] = {}  # key -> (last emit, suppressed)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "rate_key", None)
+        if key is None:
+            return True
+
+        now = time.monotonic()
+        every = getattr(record, "rate_every", 0.0)
+        with self._lock:
+            last, suppressed = self._state.get(key, (None, 0))
+            if last is not None and now - last < every:
+                self._state[key] = (last, suppressed + 1)
+                return False
+            self._state[key] = (now, 0)
+
+        record.suppressed = suppressed
+        return True
+
+
+class CompactFormatter(logging.Formatter):
+    """One-line ``L [TAG] message | k=v`` records"""
+
+    def __init__(self, with_time: bool = False):
+        super().__init__()
+        self.with_time = with_time
+
+    def format(self, record: logging.LogRecord) -> str:
+        tag = record.name.rsplit(".", 1)[-1].upper()
+        parts = [f"{record.levelname[0]} [{tag}] {record.getMessage()}"]
+
+        fields = getattr(record, "fields", None)
+        if fields:
+            parts.append(" | " + " ".join(f"{k}={v}" for k, v in fields.items()))
+
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            parts.append(f" (+{suppressed} suppressed)")
+
+        if record.exc_info:
+            parts.append("\n" + self.formatException(record.exc_info))
+
+        line = "".join(parts)
+        if self.with_time:
+            stamp = time.strftime("%H:%M:%S", time.localtime(record.created))
+            line = f"{stamp}.{int(record.msecs):03d} {line}"
+        return line
+
+
+class StdoutHandler(logging.Handler):
+    """Write records to whatever ``sys.stdout`` currently is.
+
+    The GUI swaps ``sys.stdout`` for its log stream after startup, so the
+    stream is looked up on every emit instead of being captured once.
+    """
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            stream = sys.stdout
+            if stream is not None:
+                stream.write(self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
+
+
+def parse_level(level) -> int:
+    """Accept ``"debug"``, ``"INFO"``, ``10``... and return a logging level"""
+    if isinstance(level, int):
+        return level
+    value = logging.getLevelName(str(level).strip().upper())
+    return value if isinstance(value, int) else logging.INFO
+
+
+def configure_logging(level: Optional[str] = None, with_time: bool = False):
+    """Install the compact stdout handler on the application root logger.
+
+    ``RUSTPLUSLED_LOG_LEVEL`` overrides ``level``; calling again only changes
+    the level, so it is safe to call after the config file has been loaded.
+    """
+    global _configured
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(parse_level(os.environ.get(LEVEL_ENV_VAR) or level or DEFAULT_LEVEL))
+
+    with _configure_lock:
+        if _configured:
+            return
+        handler = StdoutHandler()
+        handler.setFormatter(CompactFormatter(with_time=with_time))
+        handler.addFilter(RateLimitFilter())
+        root.addHandler(handler)
+        root.propagate = False
+        _configured = True
+
+
+def get_logger(tag: str) -> logging.Logger:
+    """Logger printed as ``[TAG]``"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{tag.lower()}")
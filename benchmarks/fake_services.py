@@ -0,0 +1,660 @@
+"""
+Local stand-ins for the services RustPlusLED talks to
+
+Each fake runs a threaded HTTP server on 127.0.0.1 (random port) and can be
+configured with artificial latency, a server error rate and a 429 rate so
+the trigger pipeline can be benchmarked without real hardware or cloud
+accounts:
+
+- ``FakeTelegram``: ``getMe`` and long-polling ``getUpdates`` of the Bot API
+- ``FakeWLED``: ``/json/state``, ``/json/info`` and ``/json/si``, plus a realtime UDP listener
+- ``FakeGovee``: the v1 developer API (``devices``, ``devices/control``, ``devices/state``)
+- ``FakeRustPlus``: the Rust+ companion WebSocket, replaying recorded frames
+  (needs the ``websockets`` package)
+- ``FakeMQTTBroker``: a minimal MQTT 3.1.1 broker (QoS 0 publish/subscribe)
+- ``FakeDMXReceiver``: a UDP node decoding sACN (E1.31) or Art-Net DMX packets
+"""
+
+import asyncio
+import json
+import random
+import socket
+import socketserver
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+class FaultProfile:
+    """Latency and failure injection for a fake service"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency  # seconds added to every response
+        self.jitter = jitter  # +/- uniform seconds on top of latency
+        self.error_rate = error_rate  # fraction of requests answered with 500
+        self.rate_limit_rate = rate_limit_rate  # fraction answered with 429
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def roll(self) -> Tuple[float, Optional[int]]:
+        """Pick this request's delay and forced status code (None = normal)"""
+        with self._lock:
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            draw = self._random.random()
+        if draw < self.rate_limit_rate:
+            return delay, 429
+        if draw < self.rate_limit_rate + self.error_rate:
+            return delay, 500
+        return delay, None
+
+
+class FakeService:
+    """Threaded HTTP server base; subclasses implement ``handle()``"""
+
+    def __init__(self, faults: Optional[FaultProfile] = None):
+        self.faults = faults or FaultProfile()
+        self.requests: Counter = Counter()  # "METHOD /path" -> count
+        self.statuses: Counter = Counter()
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    @property
+    def address(self) -> str:
+        return f"127.0.0.1:{self.port}"
+
+    def start(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+            def _dispatch(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                url = urlparse(self.path)
+                with service._lock:
+                    service.requests[f"{self.command} {url.path}"] += 1
+
+                delay, forced = service.faults.roll()
+                if delay:
+                    time.sleep(delay)
+                if forced is not None:
+                    status, payload = forced, {"ok": False, "message": "injected fault"}
+                else:
+                    status, payload = service.handle(self.command, url.path, parse_qs(url.query),
+                                                     body, self.headers)
+                with service._lock:
+                    service.statuses[status] += 1
+
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                if status == 429:
+                    self.send_header("Retry-After", "1")
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = _dispatch
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests.clear()
+            self.statuses.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"requests": dict(self.requests), "statuses": {str(k): v for k, v in self.statuses.items()}}
+
+    def handle(self, method: str, path: str, query: Dict, body: bytes, headers) -> Tuple[int, Dict]:
+        raise NotImplementedError
+
+
+class FakeWLED(FakeService):
+    """WLED JSON API: records every state write and counts realtime packets"""
+
+    def __init__(self, faults: Optional[FaultProfile] = None, led_count: int = 150,
+                 segments: Optional[List[Tuple[str, int, int]]] = None):
+        super().__init__(faults)
+        self.led_count = led_count
+        segments = segments or [("", 0, led_count)]  # (name, start, stop)
+        self.state = {"on": False, "bri": 128, "ps": -1, "mainseg": 0,
+                      "seg": [{"id": i, "n": name, "start": start, "stop": stop, "col": [[255, 160, 0]], "fx": 0}
+                              for i, (name, start, stop) in enumerate(segments)]}
+        self.writes: List[Tuple[float, Dict]] = []  # (monotonic time, payload)
+        self.realtime_packets = 0
+        self.realtime_leds = 0
+        self._udp = None
+
+    @property
+    def realtime_port(self) -> int:
+        return self._udp.getsockname()[1]
+
+    def start(self):
+        self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._udp.bind(("127.0.0.1", 0))
+        threading.Thread(target=self._receive_realtime, name="FakeWLED-udp", daemon=True).start()
+        return super().start()
+
+    def stop(self):
+        super().stop()
+        if self._udp:
+            self._udp.close()
+
+    def _receive_realtime(self):
+        while True:
+            try:
+                packet = self._udp.recv(2048)
+            except OSError:
+                return
+            with self._lock:
+                self.realtime_packets += 1
+                self.realtime_leds += (len(packet) - 4) // 3
+
+    def handle(self, method, path, query, body, headers):
+        info = {"ver": "0.14.0", "name": "FakeWLED", "mac": "aabbccddeeff",
+                "leds": {"count": self.led_count, "maxseg": 32}}
+        if path == "/json/info":
+            return 200, info
+        if path == "/json/si":
+            return 200, {"state": self.state, "info": info}
+        if path == "/json/state" and method == "GET":
+            return 200, self.state
+        if path == "/json/state" and method == "POST":
+            payload = json.loads(body or b"{}")
+            with self._lock:
+                self.writes.append((time.monotonic(), payload))
+                self.state.update({k: v for k, v in payload.items() if k != "seg"})
+            return 200, {"success": True}
+        return 404, {"error": "not found"}
+
+
+class FakeGovee(FakeService):
+    """Govee developer API v1 with a single controllable device"""
+
+    def __init__(self, faults: Optional[FaultProfile] = None, device_id: str = "AA:BB:CC:DD:EE:FF:00:11",
+                 model: str = "H6163", api_key: str = "bench-key"):
+        super().__init__(faults)
+        self.device_id = device_id
+        self.model = model
+        self.api_key = api_key
+        self.commands: List[Tuple[float, Dict]] = []
+
+    def handle(self, method, path, query, body, headers):
+        if headers.get("Govee-API-Key") != self.api_key:
+            return 401, {"code": 401, "message": "Invalid API Key"}
+        if path == "/v1/devices" and method == "GET":
+            return 200, {"code": 200, "data": {"devices": [{
+                "device": self.device_id, "model": self.model, "deviceName": "Fake Strip",
+                "controllable": True, "retrievable": True,
+                "supportCmds": ["turn", "brightness", "color", "colorTem"]}]}}
+        if path == "/v1/devices/control" and method == "PUT":
+            payload = json.loads(body or b"{}")
+            with self._lock:
+                self.commands.append((time.monotonic(), payload))
+            return 200, {"code": 200, "message": "Success", "data": {}}
+        if path == "/v1/devices/state" and method == "GET":
+            return 200, {"code": 200, "data": {"device": self.device_id, "model": self.model,
+                                               "properties": [{"online": True}, {"powerState": "on"}]}}
+        return 404, {"code": 404, "message": "not found"}
+
+    @property
+    def api_url(self) -> str:
+        return f"http://{self.address}/v1/devices"
+
+
+class FakeTelegram(FakeService):
+    """Bot API subset: ``getMe`` plus long-polling ``getUpdates``.
+
+    Tests push alarms with ``post()``; they are delivered as channel posts in
+    ``chat_id`` and ``injected`` keeps the wall/monotonic time of each one.
+    """
+
+    def __init__(self, faults: Optional[FaultProfile] = None, chat_id: int = -1001234567890):
+        super().__init__(faults)
+        self.chat_id = chat_id
+        self.updates: List[Dict] = []
+        self.injected: Dict[int, float] = {}  # message_id -> monotonic injection time
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._new_update = threading.Condition(self._lock)
+
+    @property
+    def api_url(self) -> str:
+        return f"http://{self.address}/bot"
+
+    def post(self, text: str, chat_id: Optional[int] = None, date: Optional[float] = None,
+             token: Optional[str] = None) -> int:
+        """Queue a channel post; returns its message_id. With ``token`` only that bot sees it."""
+        with self._new_update:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            self.updates.append({
+                "update_id": self._next_update_id,
+                "channel_post": {
+                    "message_id": message_id,
+                    "date": int(date if date is not None else time.time()),
+                    "chat": {"id": chat_id if chat_id is not None else self.chat_id,
+                             "type": "channel", "title": "Rust+ Alarms"},
+                    "text": text,
+                },
+                "token": token,
+            })
+            self._next_update_id += 1
+            self.injected[message_id] = time.monotonic()
+            self._new_update.notify_all()
+        return message_id
+
+    def handle(self, method, path, query, body, headers):
+        token, _, name = path.rpartition("/")
+        token = token[len("/bot"):]
+        params = self._params(query, body, headers)
+        if name == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Bench",
+                                                "username": "bench_bot"}}
+        if name == "getUpdates":
+            offset = int(params.get("offset") or 0)
+            limit = int(params.get("limit") or 100)
+            deadline = time.monotonic() + float(params.get("timeout") or 0)
+            with self._new_update:
+                while True:
+                    pending = [u for u in self.updates
+                               if u["update_id"] >= offset and u["token"] in (None, token)]
+                    remaining = deadline - time.monotonic()
+                    if pending or remaining <= 0:
+                        break
+                    self._new_update.wait(remaining)
+            return 200, {"ok": True, "result": [{k: v for k, v in u.items() if k != "token"}
+                                                for u in pending[:limit]]}
+        return 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+
+    @staticmethod
+    def _params(query, body, headers) -> Dict:
+        params = {k: v[0] for k, v in query.items()}
+        if not body:
+            return params
+        if "json" in (headers.get("Content-Type") or ""):
+            params.update(json.loads(body))
+        else:
+            params.update({k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()})
+        return params
+
+
+def load_frames(path: str) -> List[bytes]:
+    """Frames from a capture file: one hex-encoded frame per line, # comments"""
+    with open(path, "r") as f:
+        return [bytes.fromhex(line.strip()) for line in f if line.strip() and not line.startswith("#")]
+
+
+class FakeRustPlus:
+    """Rust+ companion WebSocket on 127.0.0.1.
+
+    Answers ``getEntityInfo`` for the given entities (id -> AppEntityType) and
+    sends every frame given to ``broadcast()`` or ``replay()`` to all
+    connected clients; ``injected`` keeps the monotonic time of each one.
+    """
+
+    def __init__(self, entities: Optional[Dict[int, int]] = None, player_token: Optional[int] = None):
+        self.entities = entities or {}
+        self.player_token = player_token  # None accepts any token
+        self.requests: List[Dict] = []
+        self.injected: List[float] = []
+        self.subscribed = threading.Event()  # set once every entity has been asked for
+        self._connections = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server = None
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    @property
+    def url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}"
+
+    def start(self):
+        import websockets
+        from rustplus import decode_request, encode_entity_info, encode_error
+
+        async def handler(connection, *_):
+            self._connections.add(connection)
+            try:
+                async for frame in connection:
+                    request = decode_request(frame)
+                    self.requests.append(request)
+                    if self.player_token is not None and request["player_token"] != self.player_token:
+                        await connection.send(encode_error(request["seq"], "not_found"))
+                    elif request["get_entity_info"] and request["entity_id"] in self.entities:
+                        await connection.send(encode_entity_info(request["seq"],
+                                                                 self.entities[request["entity_id"]], False))
+                        asked = {r["entity_id"] for r in self.requests if r["get_entity_info"]}
+                        if asked >= set(self.entities):
+                            self.subscribed.set()
+                    elif request["get_entity_info"]:
+                        await connection.send(encode_error(request["seq"], "not_found"))
+                    else:
+                        await connection.send(encode_error(request["seq"], "no_response"))
+            except websockets.ConnectionClosed:
+                pass
+            finally:
+                self._connections.discard(connection)
+
+        started = threading.Event()
+
+        async def listen():
+            return await websockets.serve(handler, "127.0.0.1", 0)
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._server = self._loop.run_until_complete(listen())
+            finally:
+                started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=serve, name="FakeRustPlus", daemon=True)
+        self._thread.start()
+        started.wait()
+        if self._server is None:
+            raise RuntimeError("FakeRustPlus failed to start")
+        return self
+
+    def broadcast(self, frame: bytes):
+        """Send one frame to every client"""
+        async def send():
+            for connection in list(self._connections):
+                await connection.send(frame)
+
+        self.injected.append(time.monotonic())
+        asyncio.run_coroutine_threadsafe(send(), self._loop).result()
+
+    def replay(self, frames: List[bytes], interval: float = 0.0):
+        for frame in frames:
+            self.broadcast(frame)
+            if interval:
+                time.sleep(interval)
+
+    def stop(self):
+        if self._server:
+            self._server.close()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _topic_matches(pattern: str, topic: str) -> bool:
+    """MQTT topic filter match with + and # wildcards"""
+    parts, names = pattern.split("/"), topic.split("/")
+    for i, part in enumerate(parts):
+        if part == "#":
+            return True
+        if i >= len(names) or (part != "+" and part != names[i]):
+            return False
+    return len(parts) == len(names)
+
+
+class FakeMQTTBroker:
+    """Just enough MQTT 3.1.1 for QoS 0: CONNECT, PUBLISH, SUBSCRIBE, PING.
+
+    Every publish is kept in ``messages`` as (monotonic time, topic, payload)
+    and forwarded to matching subscribers.
+    """
+
+    def __init__(self):
+        self.messages: List[Tuple[float, str, bytes]] = []
+        self.connections = 0
+        self._subscribers: List[Tuple[str, socket.socket]] = []
+        self._lock = threading.Lock()
+        self._new_message = threading.Condition(self._lock)
+        self._server = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self):
+        broker = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                with broker._lock:
+                    broker.connections += 1
+                reader = self.request.makefile("rb")
+                try:
+                    while True:
+                        header = reader.read(1)
+                        if not header:
+                            return
+                        length, shift = 0, 0
+                        while True:
+                            byte = reader.read(1)[0]
+                            length |= (byte & 0x7F) << shift
+                            shift += 7
+                            if not byte & 0x80:
+                                break
+                        body = reader.read(length)
+                        if not broker._packet(self.request, header[0], body):
+                            return
+                except (OSError, IndexError):
+                    pass
+                finally:
+                    with broker._lock:
+                        broker._subscribers = [(p, c) for p, c in broker._subscribers if c is not self.request]
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="FakeMQTTBroker", daemon=True).start()
+        return self
+
+    def _packet(self, connection: socket.socket, header: int, body: bytes) -> bool:
+        kind = header >> 4
+        if kind == 1:  # CONNECT
+            connection.sendall(b"\x20\x02\x00\x00")
+        elif kind == 3:  # PUBLISH
+            topic_length = int.from_bytes(body[:2], "big")
+            topic = body[2:2 + topic_length].decode("utf-8")
+            offset = 2 + topic_length + (2 if header & 0x06 else 0)  # packet id for QoS > 0
+            payload = body[offset:]
+            with self._new_message:
+                self.messages.append((time.monotonic(), topic, payload))
+                targets = [c for pattern, c in self._subscribers if _topic_matches(pattern, topic)]
+                self._new_message.notify_all()
+            packet = bytes([0x30]) + self._length(len(body[:2 + topic_length]) + len(payload)) + \
+                body[:2 + topic_length] + payload
+            for target in targets:
+                try:
+                    target.sendall(packet)
+                except OSError:
+                    pass
+        elif kind == 8:  # SUBSCRIBE
+            packet_id, position, granted = body[:2], 2, b""
+            while position < len(body):
+                length = int.from_bytes(body[position:position + 2], "big")
+                pattern = body[position + 2:position + 2 + length].decode("utf-8")
+                position += 3 + length
+                with self._lock:
+                    self._subscribers.append((pattern, connection))
+                granted += b"\x00"
+            connection.sendall(bytes([0x90]) + self._length(2 + len(granted)) + packet_id + granted)
+        elif kind == 12:  # PINGREQ
+            connection.sendall(b"\xd0\x00")
+        elif kind == 14:  # DISCONNECT
+            return False
+        return True
+
+    @staticmethod
+    def _length(value: int) -> bytes:
+        out = bytearray()
+        while True:
+            byte, value = value & 0x7F, value >> 7
+            out.append(byte | (0x80 if value else 0))
+            if not value:
+                return bytes(out)
+
+    def reset_counters(self):
+        with self._lock:
+            self.messages.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            topics = Counter(topic for _, topic, _ in self.messages)
+        return {"connections": self.connections, "messages": dict(topics)}
+
+    def wait_for(self, count: int, prefix: str = "", timeout: float = 5.0) -> List[Tuple[float, str, bytes]]:
+        """Wait until ``count`` messages under ``prefix`` arrived; returns them"""
+        deadline = time.monotonic() + timeout
+        with self._new_message:
+            while True:
+                found = [m for m in self.messages if m[1].startswith(prefix)]
+                remaining = deadline - time.monotonic()
+                if len(found) >= count or remaining <= 0:
+                    return found
+                self._new_message.wait(remaining)
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FakeDMXReceiver:
+    """A DMX node on 127.0.0.1 that decodes sACN (E1.31) and Art-Net data packets.
+
+    Every packet is kept in ``packets`` as (monotonic time, universe,
+    sequence, channels); sequence numbers that go backwards are counted in
+    ``out_of_order``.
+    """
+
+    def __init__(self, protocol: str = "sacn"):
+        self.protocol = protocol
+        self.packets: List[Tuple[float, int, int, bytes]] = []
+        self.terminated = 0  # sACN packets with the stream-terminated option
+        self.out_of_order = 0
+        self._last_sequence: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._new_packet = threading.Condition(self._lock)
+        self._socket = None
+
+    @property
+    def port(self) -> int:
+        return self._socket.getsockname()[1]
+
+    def start(self):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(("127.0.0.1", 0))
+        threading.Thread(target=self._receive, name="FakeDMXReceiver", daemon=True).start()
+        return self
+
+    def _decode(self, packet: bytes) -> Optional[Tuple[int, int, bytes, bool]]:
+        """(universe, sequence, channels, terminated), None for anything but DMX data"""
+        if self.protocol == "sacn":
+            if packet[4:16] != b"ASC-E1.17\0\0\0" or len(packet) < 126:
+                return None
+            count = int.from_bytes(packet[123:125], "big") - 1  # property count includes the start code
+            return (int.from_bytes(packet[113:115], "big"), packet[111], packet[126:126 + count],
+                    bool(packet[112] & 0x40))
+        if packet[:8] != b"Art-Net\0" or int.from_bytes(packet[8:10], "little") != 0x5000:
+            return None
+        length = int.from_bytes(packet[16:18], "big")
+        return packet[14] | (packet[15] << 8), packet[12], packet[18:18 + length], False
+
+    def _receive(self):
+        while True:
+            try:
+                packet = self._socket.recv(2048)
+            except OSError:
+                return
+            decoded = self._decode(packet)
+            if decoded is None:
+                continue
+            universe, sequence, channels, terminated = decoded
+            with self._new_packet:
+                previous = self._last_sequence.get(universe)
+                # Sequence numbers wrap; a step back of up to 20 means reordering
+                if previous is not None and -20 < (sequence - previous + 128) % 256 - 128 <= 0:
+                    self.out_of_order += 1
+                self._last_sequence[universe] = sequence
+                if terminated:
+                    self.terminated += 1
+                self.packets.append((time.monotonic(), universe, sequence, channels))
+                self._new_packet.notify_all()
+
+    def channels(self, universe: int) -> bytes:
+        """The last channel data received for a universe"""
+        with self._lock:
+            return next((p[3] for p in reversed(self.packets) if p[1] == universe), b"")
+
+    def reset_counters(self):
+        with self._lock:
+            self.packets.clear()
+            self.out_of_order = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            universes = Counter(str(p[1]) for p in self.packets)
+        return {"packets": dict(universes), "out_of_order": self.out_of_order}
+
+    def wait_for(self, count: int, timeout: float = 5.0,
+                 universe: Optional[int] = None) -> List[Tuple[float, int, int, bytes]]:
+        """Wait until ``count`` packets (for ``universe``, if given) arrived; returns them"""
+        deadline = time.monotonic() + timeout
+        with self._new_packet:
+            while True:
+                found = [p for p in self.packets if universe is None or p[1] == universe]
+                remaining = deadline - time.monotonic()
+                if len(found) >= count or remaining <= 0:
+                    return found
+                self._new_packet.wait(remaining)
+
+    def stop(self):
+        if self._socket:
+            self._socket.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
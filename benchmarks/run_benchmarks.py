@@ -0,0 +1,513 @@
+"""
+Trigger pipeline benchmarks against local fake services
+
+Run from the repository root:
+
+    python -m benchmarks.run_benchmarks                      # all scenarios, JSON to stdout
+    python -m benchmarks.run_benchmarks --output bench.json  # save results
+    python -m benchmarks.run_benchmarks --baseline bench.json --max-regression 20
+
+Every scenario reports throughput, latency percentiles (ms), success rate and
+the request counts each fake service saw. With ``--baseline``, p50/p95 and
+throughput are compared to an earlier run and the exit status is 1 when any
+of them regress by more than ``--max-regression`` percent, or when a
+scenario completes fewer alarms, succeeds less often or times out.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from app_logging import configure_logging
+from benchmarks.fake_services import (FakeDMXReceiver, FakeGovee, FakeMQTTBroker, FakeRustPlus, FakeTelegram,
+                                      FakeWLED, FaultProfile, load_frames)
+from dispatch import action_plans, claim_device, execute_action
+from metrics import pipeline_metrics
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Exact nearest-rank percentiles in milliseconds"""
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(samples)
+
+    def rank(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {"p50": rank(0.50), "p95": rank(0.95), "p99": rank(0.99), "max": ordered[-1] * 1000}
+
+
+def alarm_burst(count: int, spacing: float) -> List[float]:
+    """Offsets (seconds) for a raid-style burst: alarms in quick succession"""
+    return [i * spacing for i in range(count)]
+
+
+def run_dispatch(config: Dict, offsets: List[float], services: List) -> Dict:
+    """Fire execute_action at the given offsets (serially, like the worker does)"""
+    for service in services:
+        service.reset_counters()
+    latencies, successes = [], 0
+    start = time.monotonic()
+    for offset in offsets:
+        delay = start + offset - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        scheduled = start + offset
+        result = execute_action(config)
+        latencies.append(time.monotonic() - scheduled)  # includes queueing behind earlier alarms
+        successes += result.success
+    elapsed = time.monotonic() - start
+    return {
+        "alarms": len(offsets),
+        "elapsed_s": elapsed,
+        "throughput_per_s": len(offsets) / elapsed if elapsed else None,
+        "success_rate": successes / len(offsets) if offsets else None,
+        "latency_ms": percentiles(latencies),
+        "services": {type(s).__name__: s.stats() for s in services},
+    }
+
+
+def scenario_dispatch_wled(args) -> Dict:
+    with FakeWLED(FaultProfile(latency=0.004, jitter=0.002, seed=1)) as wled:
+        config = {"led_type": "wled", "wled_ip": wled.address, "action": "color", "color": "#ff0000"}
+        return run_dispatch(config, alarm_burst(args.alarms, args.spacing), [wled])
+
+
+def scenario_dispatch_wled_mqtt(args) -> Dict:
+    """WLED over MQTT: QoS 0 publishes on one shared broker connection"""
+    try:
+        import paho.mqtt.client  # noqa: F401
+        from mqtt_transport import close_links
+    except ImportError as e:
+        return {"skipped": f"paho-mqtt not installed ({e.name})"}
+
+    with FakeMQTTBroker() as broker:
+        config = {"led_type": "wled_mqtt", "wled_mqtt_topic": "wled/bench", "action": "color", "color": "#ff0000",
+                  "mqtt": {"host": "127.0.0.1", "port": broker.port}}
+        action_plans.get(config).controller.test_connection()  # connect outside the measurement
+        try:
+            result = run_dispatch(config, alarm_burst(args.alarms, args.spacing), [broker])
+            result["delivered"] = len(broker.wait_for(args.alarms, "wled/"))
+        finally:
+            close_links()
+            action_plans.invalidate()
+        return result
+
+
+def scenario_dispatch_wled_dead(args) -> Dict:
+    """A strip that only returns errors: the circuit breaker should make alarms nearly free"""
+    with FakeWLED(FaultProfile(latency=0.05, error_rate=1.0, seed=5)) as wled:
+        config = {"led_type": "wled", "wled_ip": wled.address, "action": "color", "color": "#ff0000"}
+        return run_dispatch(config, alarm_burst(args.alarms, args.spacing), [wled])
+
+
+def scenario_dispatch_wled_segments(args) -> Dict:
+    """Simultaneous alarms for three segments of one strip: updates should merge"""
+    segments = [("Left", 0, 100), ("Middle", 100, 200), ("Right", 200, 300)]
+    with FakeWLED(FaultProfile(latency=0.004, jitter=0.002, seed=6), led_count=300, segments=segments) as wled, \
+            ThreadPoolExecutor(max_workers=len(segments)) as pool:
+        configs = [{"led_type": "wled", "wled_ip": wled.address, "wled_segment": name, "action": "color",
+                    "color": color} for (name, _, _), color in zip(segments, ("#ff0000", "#00ff00", "#0000ff"))]
+        execute_action(configs[0])  # read the segment layout outside the measurement
+        wled.reset_counters()
+        latencies, successes = [], 0
+        start = time.monotonic()
+        for offset in alarm_burst(args.alarms, args.spacing):
+            delay = start + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            scheduled = start + offset
+            futures = [pool.submit(execute_action, config, None, claim_device(config)) for config in configs]
+            successes += sum(future.result().success for future in futures)
+            latencies.append(time.monotonic() - scheduled)
+        elapsed = time.monotonic() - start
+        alarms = len(latencies) * len(configs)
+        return {
+            "alarms": alarms,
+            "elapsed_s": elapsed,
+            "throughput_per_s": alarms / elapsed if elapsed else None,
+            "success_rate": successes / alarms if alarms else None,
+            "latency_ms": percentiles(latencies),
+            "requests_per_alarm": wled.stats()["requests"].get("POST /json/state", 0) / alarms if alarms else None,
+            "services": {"FakeWLED": wled.stats()},
+        }
+
+
+def scenario_dispatch_govee(args) -> Dict:
+    faults = FaultProfile(latency=0.08, jitter=0.04, error_rate=0.02, rate_limit_rate=0.05, seed=2)
+    with FakeGovee(faults) as govee:
+        config = {"led_type": "govee", "govee_api_key": govee.api_key, "govee_device_id": govee.device_id,
+                  "govee_model": govee.model, "govee_api_url": govee.api_url,
+                  "action": "color", "color": "#ff0000"}
+        return run_dispatch(config, alarm_burst(args.alarms, args.spacing), [govee])
+
+
+def scenario_dispatch_sacn(args) -> Dict:
+    """170 RGB pixels per universe over four universes of unicast sACN"""
+    from dmx import close_senders
+    with FakeDMXReceiver("sacn") as node:
+        config = {"led_type": "sacn", "dmx_host": "127.0.0.1", "dmx_port": node.port, "dmx_universe": 1,
+                  "dmx_fixtures": 680, "action": "color", "color": "#ff0000"}
+        try:
+            result = run_dispatch(config, alarm_burst(args.alarms, args.spacing), [node])
+        finally:
+            close_senders()
+            action_plans.invalidate()
+        return result
+
+
+def scenario_effects_render(args) -> Dict:
+    """Render + realtime packet encoding for every host-side animation on a 1200 LED strip"""
+    from effects import EFFECTS, EffectRenderer, dnrgb_packets, np
+    if np is None:
+        return {"skipped": "numpy not installed"}
+
+    frame_times = []
+    start = time.monotonic()
+    for name in EFFECTS:
+        renderer = EffectRenderer(1200, name, max_milliamps=5000)
+        for i in range(300):
+            began = time.perf_counter()
+            dnrgb_packets(renderer.render(i / 60))
+            frame_times.append(time.perf_counter() - began)
+    elapsed = time.monotonic() - start
+    return {
+        "frames": len(frame_times),
+        "leds": 1200,
+        "elapsed_s": elapsed,
+        "throughput_per_s": len(frame_times) / sum(frame_times),
+        "latency_ms": percentiles(frame_times),
+    }
+
+
+def scenario_telegram_burst(args) -> Dict:
+    """TelegramWorker polling a fake Bot API and driving a fake WLED"""
+    try:
+        import main
+    except ImportError as e:
+        return {"skipped": f"GUI dependencies not installed ({e.name})"}
+
+    with FakeTelegram(FaultProfile(latency=0.01, seed=3)) as telegram, \
+            FakeWLED(FaultProfile(latency=0.004, jitter=0.002, seed=4)) as wled, \
+            tempfile.TemporaryDirectory() as workdir:
+        # The worker persists last_message_id; keep that out of the real config
+        main.CONFIG_FILE = os.path.join(workdir, "config.json")
+        config = {
+            "led_type": "wled", "wled_ip": wled.address, "action": "color", "color": "#ff0000",
+            "telegram_bot_token": "123456:BENCHMARKTOKEN", "telegram_chat_id": str(telegram.chat_id),
+            "telegram_api_url": telegram.api_url, "polling_rate": 1, "last_message_id": 0,
+            "catchup_policy": "skip",  # the burst starts while the worker connects: it is not backlog
+        }
+
+        acked: List[float] = []
+        done = threading.Event()
+
+        def on_trigger(event):
+            execute_action(event.rule.apply(config), event.trace)
+            acked.append(time.monotonic())
+            if len(acked) >= args.alarms:
+                done.set()
+
+        worker = main.TelegramWorker(config)
+        worker.trigger_callback = on_trigger
+        thread = threading.Thread(target=worker.run, name="bench-telegram", daemon=True)
+        pipeline_metrics.reset()
+        thread.start()
+
+        start = time.monotonic()
+        for offset in alarm_burst(args.alarms, args.spacing):
+            delay = start + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            telegram.post("Smart Alarm: Base is being raided!")
+        finished = done.wait(timeout=60)
+        elapsed = time.monotonic() - start
+        worker.stop()
+        thread.join(timeout=15)
+
+        # Alarms are handled in order, so the n-th ack belongs to the n-th post
+        injected = [telegram.injected[mid] for mid in sorted(telegram.injected)]
+        latencies = [ack - sent for sent, ack in zip(injected, acked)]
+        return {
+            "alarms": args.alarms,
+            "completed": len(acked),
+            "timed_out": not finished,
+            "elapsed_s": elapsed,
+            "throughput_per_s": len(acked) / elapsed if elapsed else None,
+            "latency_ms": percentiles(latencies),
+            "stages": pipeline_metrics.snapshot()["stages"],
+            "services": {"FakeTelegram": telegram.stats(), "FakeWLED": wled.stats()},
+        }
+
+
+def scenario_rustplus_burst(args) -> Dict:
+    """RustPlusIntake listening to a fake Rust+ server replaying alarm frames"""
+    try:
+        import websockets  # noqa: F401
+        from rustplus import RustPlusIntake, encode_entity_changed
+    except ImportError as e:
+        return {"skipped": f"websockets not installed ({e.name})"}
+
+    with FakeRustPlus({1234567: 2, 2345678: 2}) as server, \
+            FakeWLED(FaultProfile(latency=0.004, jitter=0.002, seed=5)) as wled:
+        config = {
+            "led_type": "wled", "wled_ip": wled.address, "action": "color", "color": "#ff0000",
+            "rustplus": {"server": "127.0.0.1", "url": server.url, "player_id": "76561198000000000",
+                         "player_token": -1, "entities": {"1234567": "Raid alarm", "2345678": "Raid alarm 2"}},
+        }
+        frames = load_frames(os.path.join(os.path.dirname(__file__), "rustplus_session.hex"))
+
+        acked: List[float] = []
+        done = threading.Event()
+
+        def on_event(event):
+            execute_action(event.rule.apply(config), event.trace)
+            acked.append(time.monotonic())
+            if len(acked) >= args.alarms:
+                done.set()
+
+        intake = RustPlusIntake(config, on_event)
+        thread = threading.Thread(target=lambda: asyncio.run(intake.run()), name="bench-rustplus", daemon=True)
+        pipeline_metrics.reset()
+        thread.start()
+        server.subscribed.wait(10)
+        # The recorded session once, then the alarm toggling
+        server.replay(frames[:2])
+        time.sleep(0.2)
+        acked.clear()
+        server.injected.clear()
+
+        start = time.monotonic()
+        for offset in alarm_burst(args.alarms, args.spacing):
+            delay = start + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            server.broadcast(encode_entity_changed(1234567, True))
+            server.broadcast(encode_entity_changed(1234567, False))
+        finished = done.wait(timeout=60)
+        elapsed = time.monotonic() - start
+        intake.stop()
+        thread.join(timeout=15)
+
+        # Every alarm is an on/off pair; the "on" frame is the injection
+        latencies = [ack - sent for sent, ack in zip(server.injected[::2], acked)]
+        return {
+            "alarms": args.alarms,
+            "completed": len(acked),
+            "timed_out": not finished,
+            "elapsed_s": elapsed,
+            "throughput_per_s": len(acked) / elapsed if elapsed else None,
+            "latency_ms": percentiles(latencies),
+            "stages": pipeline_metrics.snapshot()["stages"],
+            "services": {"FakeRustPlus": {"requests": len(server.requests)}, "FakeWLED": wled.stats()},
+        }
+
+
+def scenario_service_tenants(args) -> Dict:
+    """100 tenants in one service process, each with its own bot and sACN universe"""
+    import service
+    from dmx import close_senders
+
+    tenants = 100
+    with FakeTelegram() as telegram, FakeDMXReceiver("sacn") as node, \
+            tempfile.TemporaryDirectory() as root:
+        for i in range(tenants):
+            os.makedirs(os.path.join(root, f"t{i}"))
+            with open(os.path.join(root, f"t{i}", "config.json"), "w") as f:
+                json.dump({"telegram_bot_token": f"{1000 + i}:BENCHMARKTOKEN", "telegram_chat_id": str(-1000 - i),
+                           "telegram_api_url": telegram.api_url, "led_type": "sacn", "dmx_host": "127.0.0.1",
+                           "dmx_port": node.port, "dmx_universe": i + 1, "action": "color",
+                           "color": "#ff0000", "alarms_per_minute": 0}, f)
+        runner = service.Service(root)
+        thread = threading.Thread(target=lambda: asyncio.run(runner.run()), name="bench-service", daemon=True)
+        thread.start()
+        started = time.monotonic()
+        while time.monotonic() - started < 60:  # every bot long-polling
+            polls = telegram.stats()["requests"]
+            if sum(count for request, count in polls.items() if request.endswith("getUpdates")) >= 2 * tenants:
+                break
+            time.sleep(0.05)
+        startup = time.monotonic() - started
+
+        latencies = []
+        start = time.monotonic()
+        for n, offset in enumerate(alarm_burst(args.alarms, args.spacing)):
+            delay = start + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            i = n * 37 % tenants  # spread over the tenants
+            node.reset_counters()
+            sent = time.monotonic()
+            telegram.post("Smart Alarm: Base is being raided!", chat_id=-1000 - i, token=f"{1000 + i}:BENCHMARKTOKEN")
+            packets = node.wait_for(1, 5.0, universe=i + 1)
+            latencies.append((packets[0][0] if packets else time.monotonic()) - sent)
+        elapsed = time.monotonic() - start
+        runner.stop()
+        thread.join(15)
+        close_senders()
+        action_plans.invalidate()
+        return {
+            "tenants": tenants,
+            "startup_s": startup,
+            "alarms": len(latencies),
+            "elapsed_s": elapsed,
+            "throughput_per_s": len(latencies) / elapsed if elapsed else None,
+            "latency_ms": percentiles(latencies),
+        }
+
+
+def scenario_api_requests(args) -> Dict:
+    """Control API over one kept-alive connection: /status reads and /action round trips"""
+    import http.client
+    import socket
+    from api import ControlAPI
+
+    with FakeWLED(FaultProfile(latency=0.004, jitter=0.002, seed=8)) as wled, \
+            ThreadPoolExecutor(max_workers=4) as pool:
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        config = {"led_type": "wled", "wled_ip": wled.address, "action": "on", "api": {"port": port}}
+        api = ControlAPI(config, lambda event: None,
+                         run_action=lambda action_config: pool.submit(execute_action, action_config))
+        thread = threading.Thread(target=lambda: asyncio.run(api.run()), name="bench-api", daemon=True)
+        thread.start()
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        started = time.monotonic()
+        while time.monotonic() - started < 5:
+            try:
+                connection.connect()
+                break
+            except ConnectionRefusedError:
+                time.sleep(0.01)
+
+        def request(method, path, body=None):
+            sent = time.monotonic()
+            connection.request(method, path, body=body)
+            response = connection.getresponse()
+            answer = json.loads(response.read())
+            return time.monotonic() - sent, answer
+
+        reads = [request("GET", "/status")[0] for _ in range(10 * args.alarms)]
+        wled.reset_counters()
+        latencies, successes = [], 0
+        start = time.monotonic()
+        for offset in alarm_burst(args.alarms, args.spacing):
+            delay = start + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            latency, answer = request("POST", "/action", b'{"action": "color", "color": "#ff0000"}')
+            latencies.append(latency)
+            successes += answer["success"]
+        elapsed = time.monotonic() - start
+        connection.close()
+        api.stop()
+        thread.join(5)
+        return {
+            "alarms": len(latencies),
+            "elapsed_s": elapsed,
+            "throughput_per_s": len(latencies) / elapsed if elapsed else None,
+            "success_rate": successes / len(latencies) if latencies else None,
+            "latency_ms": percentiles(latencies),
+            "status_latency_ms": percentiles(reads),
+            "services": {"FakeWLED": wled.stats()},
+        }
+
+
+SCENARIOS: Dict[str, Callable[[argparse.Namespace], Dict]] = {
+    "api_requests": scenario_api_requests,
+    "dispatch_wled": scenario_dispatch_wled,
+    "dispatch_wled_dead": scenario_dispatch_wled_dead,
+    "dispatch_wled_mqtt": scenario_dispatch_wled_mqtt,
+    "dispatch_wled_segments": scenario_dispatch_wled_segments,
+    "dispatch_govee": scenario_dispatch_govee,
+    "dispatch_sacn": scenario_dispatch_sacn,
+    "effects_render": scenario_effects_render,
+    "telegram_burst": scenario_telegram_burst,
+    "rustplus_burst": scenario_rustplus_burst,
+    "service_tenants": scenario_service_tenants,
+}
+
+
+def compare(results: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    """Describe metrics that got worse than the baseline by more than max_regression %"""
+    regressions = []
+    for name, current in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before or "skipped" in current or "skipped" in before:
+            continue
+        checks = [("latency_ms.p50", current["latency_ms"]["p50"], before["latency_ms"]["p50"], True),
+                  ("latency_ms.p95", current["latency_ms"]["p95"], before["latency_ms"]["p95"], True),
+                  ("throughput_per_s", current["throughput_per_s"], before["throughput_per_s"], False)]
+        for metric, now, then, lower_is_better in checks:
+            if not now or not then:
+                continue
+            change = (now - then) / then * 100
+            if (change if lower_is_better else -change) > max_regression:
+                regressions.append(f"{name}.{metric}: {then:.2f} -> {now:.2f} ({change:+.1f}%)")
+        # Lost alarms are regressions whatever the latency says
+        if current.get("timed_out"):
+            regressions.append(f"{name}.timed_out: {before.get('timed_out', False)} -> True")
+        for metric in ("completed", "success_rate"):
+            now, then = current.get(metric), before.get(metric)
+            if now is not None and then is not None and now < then:
+                regressions.append(f"{name}.{metric}: {then:g} -> {now:g}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="RustPlusLED trigger pipeline benchmarks")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable, default: all)")
+    parser.add_argument("--alarms", type=int, default=30, help="alarms per burst (default 30)")
+    parser.add_argument("--spacing", type=float, default=0.05,
+                        help="seconds between alarms in a burst (default 0.05)")
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON results to compare against")
+    parser.add_argument("--max-regression", type=float, default=20.0,
+                        help="allowed regression in percent before failing (default 20)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    configure_logging("WARNING")
+
+    results = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {"alarms": args.alarms, "spacing": args.spacing},
+        "scenarios": {},
+    }
+    for name in args.scenario or list(SCENARIOS):
+        print(f"[BENCH] Running {name}...", file=sys.stderr)
+        results["scenarios"][name] = SCENARIOS[name](args)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"[BENCH] Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        for line in regressions:
+            print(f"[BENCH] REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
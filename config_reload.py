@@ -0,0 +1,57 @@
+"""
+Applying config.json changes while the app runs
+
+``diff_config`` compares the running config with the file's new contents
+and says what has to happen:
+
+- LED, action, rule and timing settings are read per alarm, so swapping the
+  config dict (one reference assignment) is enough
+- new chats or rules for a connected bot are swapped into its ``BotSpec``
+  without touching the connection (``TelegramIntake.apply_config``)
+- only a different set of bot tokens or another API URL reconnects
+- a few settings (metrics port, journal) only take effect on restart
+
+Progress markers the app writes itself (``last_message_id(s)``) are never
+taken backwards by a reload, see ``merge_progress``.
+"""
+
+from typing import Dict, FrozenSet, NamedTuple, Tuple
+
+from telegram_intake import TELEGRAM_API_URL, bot_specs_from_config
+
+PROGRESS_KEYS = ("last_message_id", "last_message_ids")
+RESTART_KEYS = ("metrics_port", "journal_path", "journal_max_mb")
+
+
+class ConfigChange(NamedTuple):
+    """What a config edit touches"""
+    keys: FrozenSet[str]  # top-level keys that differ, progress markers excluded
+    reconnect: bool  # bot tokens or API URL changed
+    restart_keys: Tuple[str, ...]  # changed settings that need an app restart
+
+
+def telegram_credentials(config: Dict) -> Tuple[str, FrozenSet[str]]:
+    """API URL and the tokens of every usable bot"""
+    specs, _ = bot_specs_from_config(config)
+    return config.get("telegram_api_url") or TELEGRAM_API_URL, frozenset(spec.token for spec in specs)
+
+
+def diff_config(old: Dict, new: Dict) -> ConfigChange:
+    keys = frozenset(key for key in old.keys() | new.keys()
+                     if key not in PROGRESS_KEYS and old.get(key) != new.get(key))
+    reconnect = bool(keys) and telegram_credentials(old) != telegram_credentials(new)
+    return ConfigChange(keys, reconnect, tuple(key for key in RESTART_KEYS if key in keys))
+
+
+def merge_progress(current: Dict, new: Dict) -> Dict:
+    """new, with each chat's last handled message id kept at its newest value"""
+    merged = dict(new)
+    ids = {str(k): int(v) for k, v in new.get("last_message_ids", {}).items()}
+    for chat_id, message_id in current.get("last_message_ids", {}).items():
+        ids[str(chat_id)] = max(ids.get(str(chat_id), 0), int(message_id))
+    if ids:
+        merged["last_message_ids"] = ids
+    if str(current.get("telegram_chat_id", "")) == str(new.get("telegram_chat_id", "")):
+        merged["last_message_id"] = max(int(new.get("last_message_id") or 0),
+                                        int(current.get("last_message_id") or 0))
+    return merged
@@ -0,0 +1,237 @@
+"""
+WLED discovery on the local network
+
+Two searches run side by side:
+
+- mDNS: WLED announces itself as ``_wled._tcp``; browsing needs the optional
+  ``zeroconf`` package (``pip install zeroconf``) and is skipped without it
+- a sweep of the local /24: ``GET /json/info`` on every address, at most
+  ``concurrency`` at a time with a short timeout, so the whole subnet takes
+  a second or two
+
+Every device found is stored in ``wled_devices.json`` keyed by its MAC
+address. A config with ``wled_mac`` set sends to the address last seen for
+that MAC, and when the device stops answering it is looked for again
+(``rediscover``), so a new DHCP lease is followed without touching the
+config.
+"""
+
+import asyncio
+import ipaddress
+import json
+import socket
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+import httpx
+
+try:
+    from zeroconf import ServiceBrowser, Zeroconf
+except ImportError:  # mDNS is optional, the sweep finds devices too
+    Zeroconf = None
+
+from app_logging import get_logger, kv
+
+log = get_logger("discovery")
+
+DEVICE_CACHE_FILE = "wled_devices.json"
+MDNS_SERVICE = "_wled._tcp.local."
+MDNS_SECONDS = 1.5  # how long to listen for announcements
+SWEEP_CONCURRENCY = 128
+PROBE_TIMEOUT = 0.8  # seconds per address; LAN devices answer in a few ms
+REDISCOVER_INTERVAL = 60.0  # seconds between searches for the same missing device
+
+
+class WLEDDevice(NamedTuple):
+    """A WLED controller found on the network"""
+    mac: str
+    ip: str  # host or host:port
+    name: str
+    led_count: int
+    version: str
+    source: str  # "mdns" or "sweep"
+
+
+def parse_info(ip: str, info: Dict, source: str) -> Optional[WLEDDevice]:
+    """A device from a /json/info response, or None if it isn't WLED"""
+    if not isinstance(info, dict) or "mac" not in info or "leds" not in info:
+        return None
+    return WLEDDevice(info["mac"].lower(), ip, info.get("name", "WLED"),
+                      int(info["leds"].get("count", 0)), str(info.get("ver", "")), source)
+
+
+def local_network(prefix: int = 24) -> ipaddress.IPv4Network:
+    """The subnet of the interface that routes to the LAN"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.connect(("10.255.255.255", 1))  # UDP connect sends nothing, it only picks a route
+        address = s.getsockname()[0]
+    return ipaddress.ip_network(f"{address}/{prefix}", strict=False)
+
+
+async def probe(client: httpx.AsyncClient, ip: str, source: str = "sweep") -> Optional[WLEDDevice]:
+    try:
+        response = await client.get(f"http://{ip}/json/info")
+        if response.status_code == 200:
+            return parse_info(ip, response.json(), source)
+    except (httpx.HTTPError, ValueError):
+        pass
+    return None
+
+
+async def sweep(hosts: Iterable[str], concurrency: int = SWEEP_CONCURRENCY,
+                timeout: float = PROBE_TIMEOUT, source: str = "sweep") -> List[WLEDDevice]:
+    """Probe every host, at most ``concurrency`` at a time"""
+    limit = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=0)
+    async with httpx.AsyncClient(timeout=httpx.Timeout(timeout), limits=limits) as client:
+        async def bounded(host):
+            async with limit:
+                return await probe(client, host, source)
+
+        results = await asyncio.gather(*(bounded(host) for host in hosts))
+    return [device for device in results if device]
+
+
+def browse_mdns(seconds: float = MDNS_SECONDS) -> List[str]:
+    """Addresses of devices announcing ``_wled._tcp`` (blocking, needs zeroconf)"""
+    if Zeroconf is None:
+        return []
+    found: Dict[str, str] = {}
+
+    class Listener:
+        def add_service(self, zc, service_type, name):
+            info = zc.get_service_info(service_type, name, timeout=1000)
+            for address in (info.parsed_addresses() if info else []):
+                if ":" not in address:  # IPv4 only, like the rest of the app
+                    found[name] = address if info.port in (None, 80) else f"{address}:{info.port}"
+
+        update_service = add_service
+
+        def remove_service(self, zc, service_type, name):
+            pass
+
+    zc = Zeroconf()
+    try:
+        ServiceBrowser(zc, MDNS_SERVICE, Listener())
+        time.sleep(seconds)
+    finally:
+        zc.close()
+    return list(found.values())
+
+
+async def discover(network: Optional[str] = None, mdns: bool = True, subnet_sweep: bool = True,
+                   concurrency: int = SWEEP_CONCURRENCY, timeout: float = PROBE_TIMEOUT) -> List[WLEDDevice]:
+    """Find WLED devices by mDNS and a subnet sweep at once; one entry per MAC"""
+    searches = []
+    if mdns and Zeroconf is not None:
+        async def from_mdns():
+            addresses = await asyncio.to_thread(browse_mdns)
+            return await sweep(addresses, concurrency, timeout, source="mdns")
+
+        searches.append(from_mdns())
+    if subnet_sweep:
+        net = ipaddress.ip_network(network, strict=False) if network else local_network()
+        searches.append(sweep((str(host) for host in net.hosts()), concurrency, timeout))
+
+    started = time.monotonic()
+    devices: Dict[str, WLEDDevice] = {}
+    for found in await asyncio.gather(*searches):
+        for device in found:
+            devices.setdefault(device.mac, device)  # mDNS first
+    log.info("Found %d WLED devices", len(devices),
+             extra=kv(mdns=mdns and Zeroconf is not None, seconds=f"{time.monotonic() - started:.1f}"))
+    return sorted(devices.values(), key=lambda device: device.name.lower())
+
+
+class DeviceCache:
+    """Last known address, name and size of every WLED device, by MAC"""
+
+    def __init__(self, path: str = DEVICE_CACHE_FILE):
+        self.path = path
+        self._devices: Optional[Dict[str, Dict]] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Dict]:
+        if self._devices is None:
+            try:
+                with open(self.path, "r") as f:
+                    self._devices = json.load(f)
+            except (OSError, ValueError):
+                self._devices = {}
+        return self._devices
+
+    def ip_for(self, mac: Optional[str]) -> Optional[str]:
+        if not mac:
+            return None
+        with self._lock:
+            entry = self._load().get(mac.lower())
+        return entry["ip"] if entry else None
+
+    def devices(self) -> Dict[str, Dict]:
+        with self._lock:
+            return dict(self._load())
+
+    def update(self, devices: Iterable[WLEDDevice]) -> List[str]:
+        """Store found devices; returns the MACs whose address changed"""
+        moved = []
+        with self._lock:
+            cache = self._load()
+            for device in devices:
+                previous = cache.get(device.mac)
+                if previous and previous["ip"] != device.ip:
+                    log.info("%s moved from %s to %s", device.name, previous["ip"], device.ip,
+                             extra=kv(mac=device.mac))
+                    moved.append(device.mac)
+                cache[device.mac] = {"ip": device.ip, "name": device.name, "leds": device.led_count,
+                                     "version": device.version, "seen": time.time()}
+            try:
+                with open(self.path, "w") as f:
+                    json.dump(cache, f, indent=4)
+            except OSError as e:
+                log.error("Could not save %s: %s", self.path, e)
+        return moved
+
+
+device_cache = DeviceCache()
+
+
+def discover_devices(**options) -> List[WLEDDevice]:
+    """Blocking ``discover()`` that also updates the device cache (for worker threads)"""
+    devices = asyncio.run(discover(**options))
+    device_cache.update(devices)
+    return devices
+
+
+_searching: Dict[str, float] = {}  # MAC -> time of the last search
+_searching_lock = threading.Lock()
+
+
+def rediscover(mac: str, on_found: Callable[[str, str], None]):
+    """Look for a device that stopped answering, in the background.
+
+    At most once per ``REDISCOVER_INTERVAL`` per MAC. When the device turns
+    up, the cache is updated and ``on_found(mac, ip)`` is called so compiled
+    actions can pick up its address.
+    """
+    mac = mac.lower()
+    now = time.monotonic()
+    with _searching_lock:
+        if now - _searching.get(mac, -REDISCOVER_INTERVAL) < REDISCOVER_INTERVAL:
+            return
+        _searching[mac] = now
+
+    def search():
+        try:
+            devices = discover_devices()
+        except Exception as e:
+            log.error("Discovery failed: %s", e)
+            return
+        ip = next((device.ip for device in devices if device.mac == mac), None)
+        if ip is None:
+            log.warning("Device not found on the network", extra=kv(mac=mac))
+        else:
+            on_found(mac, ip)
+
+    log.info("Device not answering, searching the network for it", extra=kv(mac=mac))
+    threading.Thread(target=search, name="wled-rediscover", daemon=True).start()
@@ -0,0 +1,319 @@
+"""
+Action dispatch: run the configured LED action for an alarm
+
+Shared by the GUI, headless mode and the benchmarks so every entry point
+goes through the same controller calls and metrics bookkeeping.
+
+Every action runs as a ``Command`` whose deadline is ``alarm_max_age``
+seconds (default 5, 0 = none) after the alarm was posted, give or take
+``alarm_clock_skew`` seconds of clock difference with Telegram (default 2).
+Late commands are dropped instead of sent, and a newer alarm for the same
+device supersedes an older one that is still queued or waiting on the
+device.
+
+Actions are compiled once per distinct config (see ``ActionPlans``): the
+controller is built, the action resolved and its request pre-encoded, so an
+alarm only has to send bytes. Actions that can't be compiled fall back to
+the controller methods.
+
+A config with ``zone`` runs the action on every device of that zone at
+once (see ``zones.py``).
+
+A WLED config with ``wled_mac`` sends to the address discovery last saw for
+that MAC and starts a search when the device stops answering (see
+``discovery.py``).
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Union
+
+from app_logging import get_logger, kv
+from discovery import device_cache, rediscover
+from effects import stop_effect
+from journal import COMMAND, RESULT, journal
+from led_controllers import (ActionPlan, Command, CommandCancelled, LEDController, begin_command,
+                             clear_layouts, create_led_controller)
+from metrics import AlarmTrace, pipeline_metrics
+
+log = get_logger("led")
+
+DEFAULT_MAX_AGE = 5.0
+DEFAULT_CLOCK_SKEW = 2.0  # seconds the host clock may be ahead of Telegram's
+
+
+class ActionResult(NamedTuple):
+    """Outcome of one dispatched action, with a status line for the UI"""
+    success: bool
+    message: str
+
+
+class CompiledAction(NamedTuple):
+    """The configured action, resolved for one device"""
+    controller: Optional[LEDController]  # None: not configured
+    plan: Optional[ActionPlan]  # None: run through the controller methods
+    error: Optional[str]  # status line when the action can't run at all
+
+
+# Every config key a compiled action depends on
+PLAN_KEYS = ("led_type", "action", "color", "effect", "preset", "scene", "brightness",
+             "wled_ip", "wled_mac", "wled_segment", "wled_leds", "wled_mqtt_topic",
+             "govee_api_key", "govee_device_id", "govee_model", "govee_api_url",
+             "hue_bridge_ip", "hue_username",
+             "dmx_host", "dmx_port", "dmx_universe", "dmx_start", "dmx_fixtures", "dmx_channels", "dmx_priority",
+             "dmx_fps")
+
+
+def compile_action(config: Dict) -> CompiledAction:
+    led_type = config.get("led_type", "wled")
+    action = config.get("action", "on")
+    if led_type == "wled":
+        # Follow the device to its current address (DHCP)
+        ip = device_cache.ip_for(config.get("wled_mac"))
+        if ip and ip != config.get("wled_ip"):
+            config = dict(config, wled_ip=ip)
+    try:
+        controller = create_led_controller(led_type, config)
+        if not controller:
+            return CompiledAction(None, None, "❌ Error: LED controller not configured properly")
+        if action not in ("on", "off", "color") and not hasattr(controller, f"set_{action}"):
+            return CompiledAction(controller, None,
+                                  f"❌ Error: Action '{action}' not supported for {led_type.upper()}")
+        return CompiledAction(controller, controller.compile_action(action, config), None)
+    except ValueError as e:
+        return CompiledAction(None, None, f"❌ Error: {str(e)[:60]}")
+
+
+class ActionPlans:
+    """Compiled actions keyed by the config values they depend on.
+
+    Rule overrides give each rule its own entry. ``invalidate()`` drops them
+    all, with the cached WLED segment layouts, when the config is saved or a
+    device is found at a new address.
+    """
+
+    MAX_PLANS = 64  # the Test button can produce a new config per click
+
+    def __init__(self):
+        self._plans: Dict[tuple, CompiledAction] = {}
+        self._lock = threading.Lock()
+
+    def get(self, config: Dict) -> CompiledAction:
+        key = tuple(config.get(name) for name in PLAN_KEYS)
+        compiled = self._plans.get(key)
+        if compiled is None:
+            compiled = compile_action(config)
+            with self._lock:
+                if len(self._plans) >= self.MAX_PLANS:
+                    self._plans.clear()
+                compiled = self._plans.setdefault(key, compiled)
+        return compiled
+
+    def invalidate(self):
+        with self._lock:
+            self._plans.clear()
+        clear_layouts()  # segments may have moved too
+
+
+action_plans = ActionPlans()
+
+
+def alarm_deadline(trace: Optional[AlarmTrace], max_age: float,
+                   clock_skew: float = DEFAULT_CLOCK_SKEW) -> Optional[float]:
+    """Monotonic deadline for an alarm's command, or None when max_age <= 0.
+
+    The age counts from the message date when there is one. That date comes
+    from Telegram's clock (truncated to whole seconds) and is compared with
+    ours, so the first ``clock_skew`` seconds of the difference are not
+    counted: a host clock running a little fast must not drop every alarm.
+    """
+    if max_age <= 0:
+        return None
+    if trace is None:
+        return time.monotonic() + max_age
+    posted = trace.received
+    if trace.message_ts is not None:
+        posted -= max(0.0, trace.received_wall - trace.message_ts - clock_skew)
+    return posted + max_age
+
+
+def target_of(config: Dict) -> Optional[str]:
+    """The device (or part of it) an action writes to; None if not configured"""
+    if config.get("zone"):
+        return f"zone:{config['zone']}"
+    controller = action_plans.get(config).controller
+    return controller.target_key if controller else None
+
+
+def claim_device(config: Dict, trace: Optional[AlarmTrace] = None) -> Union[Command, List, None]:
+    """Start the command for an alarm's device, superseding older ones.
+
+    Does no I/O; call it when the action is queued so that an alarm arriving
+    behind a slow one cancels it right away. A zone claims every member and
+    returns their commands as a list.
+    """
+    if config.get("zone"):
+        from zones import claim_zone  # zones builds on this module
+        return claim_zone(config, trace)
+    controller = action_plans.get(config).controller
+    if not controller:
+        return None
+    max_age = float(config.get("alarm_max_age", DEFAULT_MAX_AGE))
+    clock_skew = float(config.get("alarm_clock_skew", DEFAULT_CLOCK_SKEW))
+    return begin_command(controller.target_key, alarm_deadline(trace, max_age, clock_skew))
+
+
+def execute_action(config: Dict, trace: Optional[AlarmTrace] = None,
+                   command: Optional[Command] = None,
+                   release: Optional[Callable[[], None]] = None) -> ActionResult:
+    """Run ``config["action"]`` on the configured LED device.
+
+    When a trace is given, the sent/ack stages are stamped and the finished
+    trace is recorded in ``pipeline_metrics``. Without a command from
+    ``claim_device`` one is started here. ``release`` is called right before
+    the request goes out; zones hold their members there to send together.
+    """
+    if config.get("zone"):
+        from zones import execute_zone
+        return execute_zone(config, trace, command)
+
+    led_type = config.get("led_type", "wled")
+    action = config.get("action", "on")
+
+    log.info("Triggering %s action: %s", led_type.upper(), action)
+    device = led_type  # until the controller is known
+
+    try:
+        compiled = action_plans.get(config)
+        controller = compiled.controller
+        if controller:
+            device = controller.device_key
+        if compiled.error:
+            log.warning(compiled.error)
+            _finish(trace, device, action, False)
+            return ActionResult(False, compiled.error)
+
+        # Fail fast while the device's circuit breaker is open
+        if not controller.available():
+            _follow_device(config)
+            _finish(trace, controller.device_key, action, False)
+            retry_in = controller.breaker.retry_in()
+            log.debug("Skipping %s, circuit open", controller.device_key, extra=kv(retry_in=f"{retry_in:.1f}s"))
+            return ActionResult(False, f"⛔ {led_type.upper()} unavailable, retrying in {retry_in:.0f}s")
+
+        with command or claim_device(config, trace):
+            # A new action replaces whatever animation is playing
+            stop_effect(controller.effect_key)
+            if compiled.plan is None:
+                return _run_action(controller, config, led_type, action, trace, release)
+            if release:
+                release()
+            _mark_sent(trace, controller.device_key, action)
+            success = controller.send(compiled.plan)
+            if not success:
+                _follow_device(config)
+            _finish(trace, controller.device_key, action, success)
+            return _result(led_type, action, success)
+
+    except CommandCancelled as e:
+        _finish(trace, e.device_key, action, None)
+        log.info("⏭ Dropped %s action: %s", led_type.upper(), e.reason, extra=kv(device=e.device_key))
+        return ActionResult(False, f"⏭ {led_type.upper()} {action.title()} dropped: {e.reason}")
+
+    except Exception as e:
+        log.error("LED control failed: %s", e)
+        _finish(trace, device, action, False)
+        return ActionResult(False, f"❌ Error: {str(e)[:50]}")
+
+
+def _run_action(controller: LEDController, config: Dict, led_type: str, action: str,
+                trace: Optional[AlarmTrace], release: Optional[Callable[[], None]] = None) -> ActionResult:
+    """Uncompiled actions: test the connection, then call the controller method"""
+    # Test connection first
+    if not controller.test_connection():
+        _follow_device(config)
+        _finish(trace, controller.device_key, action, False)
+        return ActionResult(False, "❌ Error: Cannot connect to LED device")
+    if release:
+        release()
+
+    _mark_sent(trace, controller.device_key, action)
+
+    # Execute the action
+    success = False
+    if action == "on":
+        success = controller.turn_on()
+        log.debug("Turn ON result: %s", success)
+    elif action == "off":
+        success = controller.turn_off()
+        log.debug("Turn OFF result: %s", success)
+    elif action == "color":
+        color = config.get("color", "#ffffff")
+        success = controller.set_color(color)
+        log.debug("Set color %s result: %s", color, success)
+    elif action == "brightness" and hasattr(controller, 'set_brightness'):
+        brightness = int(config.get("brightness", 100))
+        success = controller.set_brightness(brightness)
+        log.debug("Set brightness %d%% result: %s", brightness, success)
+    elif action == "effect" and hasattr(controller, 'set_effect'):
+        effect = int(config.get("effect", 0))
+        success = controller.set_effect(effect)
+        log.debug("Set effect #%d result: %s", effect, success)
+    elif action == "preset" and hasattr(controller, 'set_preset'):
+        preset = int(config.get("preset", 0))
+        success = controller.set_preset(preset)
+        log.debug("Set preset #%d result: %s", preset, success)
+    elif action == "scene" and hasattr(controller, 'set_scene'):
+        scene = int(config.get("scene", 0))
+        success = controller.set_scene(scene)
+        log.debug("Set scene #%d result: %s", scene, success)
+    elif action == "animation" and hasattr(controller, 'set_animation'):
+        animation = config.get("animation", "siren")
+        success = controller.set_animation(
+            animation,
+            seconds=float(config.get("animation_seconds", 10)),
+            fps=float(config.get("animation_fps", 60)),
+            transport=config.get("animation_transport", "udp"),
+            realtime_port=int(config.get("wled_realtime_port", 21324)),
+            colors=config.get("animation_colors"),
+            speed=float(config.get("animation_speed", 1)),
+            brightness=int(config.get("animation_brightness", 255)),
+            max_milliamps=int(config.get("animation_max_milliamps", 0)))
+        log.debug("Play animation %s result: %s", animation, success)
+    else:
+        log.warning("Action '%s' not supported for %s", action, led_type)
+        return ActionResult(False, f"❌ Error: Action '{action}' not supported for {led_type.upper()}")
+
+    _finish(trace, controller.device_key, action, success)
+    return _result(led_type, action, success)
+
+
+def _result(led_type: str, action: str, success: bool) -> ActionResult:
+    if success:
+        log.info("✓ %s action successful!", led_type.upper())
+        return ActionResult(True, f"✓ {led_type.upper()} {action.title()} Successful!")
+    log.warning("❌ %s action failed!", led_type.upper())
+    return ActionResult(False, f"❌ {led_type.upper()} {action.title()} Failed!")
+
+
+def _follow_device(config: Dict):
+    """A WLED device with a known MAC failed: look for it at another address"""
+    if config.get("led_type", "wled") == "wled" and config.get("wled_mac"):
+        rediscover(config["wled_mac"], lambda mac, ip: action_plans.invalidate())
+
+
+def _mark_sent(trace: Optional[AlarmTrace], device: str, action: str):
+    if trace:
+        trace.mark_sent()
+    journal.record(COMMAND, trace, device=device, action=action)
+
+
+def _finish(trace: Optional[AlarmTrace], device: str, action: str, success: Optional[bool]):
+    """Stamp the device ack and record the trace (success=None: dropped)"""
+    latency_ms = None
+    if trace:
+        trace.mark_acked(device, success)
+        pipeline_metrics.record(trace)
+        latency_ms = (trace.acked - trace.received) * 1000
+    journal.record(RESULT, trace, device=device, action=action, latency_ms=latency_ms,
+                   result="dropped" if success is None else "ok" if success else "failed")
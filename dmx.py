@@ -0,0 +1,444 @@
+"""
+DMX output: sACN (E1.31) and Art-Net for pixel controllers and stage fixtures
+
+``"led_type": "sacn"`` or ``"artnet"`` sends the action as DMX512 channel
+data over UDP::
+
+    "led_type": "sacn", "dmx_host": "", "dmx_universe": 1, "dmx_start": 1,
+    "dmx_fixtures": 170, "dmx_channels": "rgb"
+
+``dmx_fixtures`` fixtures (or pixels) of ``dmx_channels`` channels each start
+at channel ``dmx_start`` of ``dmx_universe``. Channel letters are ``r``,
+``g``, ``b``, ``w`` (white, taken out of the colour), ``d`` (dimmer) and
+``-`` (unused, sent as 0), so a par with a dimmer is ``"drgb"``. Fixtures that
+don't fit continue in the next universe at channel 1, the way pixel
+controllers map 170 RGB pixels per universe. Without ``dmx_host`` sACN goes
+to the universe's multicast group and Art-Net is broadcast; set it to the
+node's address for unicast. ``dmx_port`` overrides the protocol's port,
+``dmx_priority`` the sACN priority (default 100) and ``dmx_fps`` the frame
+rate (default 44, the DMX512 refresh rate).
+
+Each universe keeps its packet in a preallocated buffer and actions write
+their channels into it in place. Only universes that changed are sent,
+paced to the frame rate with a sequence number per universe; a streaming
+thread sends what a paced write deferred and repeats every universe once a
+second so receivers don't time out. The ``animation`` action renders with
+``effects.py`` straight into the universes.
+"""
+
+import socket
+import struct
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from app_logging import get_logger, kv, throttle
+from led_controllers import NO_HEADERS, ActionPlan, LEDController, parse_hex_color
+
+log = get_logger("dmx")
+
+CHANNELS = 512  # per universe
+DEFAULT_FPS = 44  # DMX512's refresh rate at full universe size
+KEEPALIVE = 1.0  # seconds between repeats of an unchanged universe (sACN receivers give up after 2.5)
+LAYOUT_CHANNELS = "rgbwd-"
+SOURCE_NAME = b"RustPlusLED"
+
+
+class Universe:
+    """One universe's packet, allocated once; channel data is written in place"""
+
+    def __init__(self, number: int, header: bytes):
+        self.number = number
+        self.packet = bytearray(header) + bytearray(CHANNELS)
+        self.data = memoryview(self.packet)[len(header):]
+        self.sequence = 0
+        self.dirty = False
+        self.sent = 0.0  # time.monotonic() of the last packet
+
+
+class DMXSender(ABC):
+    """Streams the universes of one receiver (or multicast group) from a single socket"""
+
+    protocol = ""
+    PORT = 0
+    SEQUENCE_AT = 0  # offset of the sequence number in the packet
+
+    def __init__(self, host: str, port: int = 0, fps: float = DEFAULT_FPS):
+        self.host = host
+        self.port = port or self.PORT
+        self.fps = fps
+        self.universes: Dict[int, Universe] = {}
+        self.healthy = True  # False after a failed send
+        self.packets = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._last_frame = 0.0
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def label(self) -> str:
+        return self.host or "broadcast"
+
+    @abstractmethod
+    def header(self, universe: int) -> bytes:
+        """The packet bytes in front of a universe's DMX data"""
+        pass
+
+    def address(self, universe: int) -> Tuple[str, int]:
+        return self.host, self.port
+
+    def next_sequence(self, sequence: int) -> int:
+        return (sequence + 1) & 0xFF
+
+    def universe(self, number: int) -> Universe:
+        universe = self.universes.get(number)
+        if universe is None:
+            with self._lock:
+                universe = self.universes.setdefault(number, Universe(number, self.header(number)))
+        return universe
+
+    def write(self, number: int, offset: int, values: bytes):
+        """Set channels ``offset``.. (0-based) of a universe; sent with the next frame if they changed"""
+        universe = self.universe(number)
+        end = offset + len(values)
+        with self._lock:
+            if universe.data[offset:end] != values:
+                universe.data[offset:end] = values
+                universe.dirty = True
+
+    def read(self, number: int, offset: int, length: int) -> bytes:
+        universe = self.universe(number)
+        with self._lock:
+            return universe.data[offset:offset + length].tobytes()
+
+    def flush(self) -> bool:
+        """Send the changed universes now, or with the next frame when one just went out"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"{self.protocol}-stream", daemon=True)
+                self._thread.start()
+            now = time.monotonic()
+            if now - self._last_frame < 1.0 / self.fps:
+                self._wake.set()
+                return self.healthy
+            return self._send_frame(now)
+
+    def close(self):
+        with self._lock:
+            self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+        self._socket.close()
+
+    def _send_frame(self, now: float) -> bool:
+        """Send dirty universes and those due a repeat (lock held)"""
+        ok = True
+        for universe in self.universes.values():
+            if universe.dirty or now - universe.sent >= KEEPALIVE:
+                ok = self._send(universe, now) and ok
+        self._last_frame = now
+        self.healthy = ok
+        return ok
+
+    def _send(self, universe: Universe, now: float) -> bool:
+        universe.sequence = self.next_sequence(universe.sequence)
+        universe.packet[self.SEQUENCE_AT] = universe.sequence
+        universe.dirty = False
+        universe.sent = now
+        try:
+            self._socket.sendto(universe.packet, self.address(universe.number))
+        except OSError as e:
+            log.error("%s send failed: %s", self.protocol, e,
+                      extra=throttle(f"dmx-send-{self.protocol}-{self.host}", 30, universe=universe.number))
+            return False
+        self.packets += 1
+        return True
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._stopping:
+                    return
+                now = time.monotonic()
+                if any(universe.dirty for universe in self.universes.values()):
+                    wait = self._last_frame + 1.0 / self.fps - now
+                else:
+                    wait = min((universe.sent + KEEPALIVE for universe in self.universes.values()),
+                               default=now + KEEPALIVE) - now
+                if wait <= 0:
+                    self._send_frame(now)
+                    continue
+                self._wake.clear()
+            self._wake.wait(wait)
+
+
+class SACNSender(DMXSender):
+    """ANSI E1.31 data packets, multicast to 239.255.<universe> unless a host is given"""
+
+    protocol = "sacn"
+    PORT = 5568
+    SEQUENCE_AT = 111
+    PRIORITY_AT = 108
+    OPTIONS_AT = 112
+    STREAM_TERMINATED = 0x40
+    CID = uuid.uuid5(uuid.NAMESPACE_DNS, f"rustplusled.{socket.gethostname()}").bytes  # stable per machine
+
+    def __init__(self, host: str, port: int = 0, fps: float = DEFAULT_FPS, priority: int = 100):
+        self.priority = priority
+        super().__init__(host, port, fps)
+
+    @property
+    def label(self) -> str:
+        return self.host or "multicast"
+
+    def header(self, universe: int) -> bytes:
+        size = 126 + CHANNELS
+        root = struct.pack(">HH12sHI16s", 0x0010, 0, b"ASC-E1.17\0\0\0", 0x7000 | (size - 16), 0x4, self.CID)
+        framing = struct.pack(">HI64sBHBBH", 0x7000 | (size - 38), 0x2, SOURCE_NAME, self.priority, 0, 0, 0,
+                              universe)
+        dmp = struct.pack(">HBBHHHB", 0x7000 | (size - 115), 0x2, 0xA1, 0, 1, CHANNELS + 1, 0)
+        return root + framing + dmp
+
+    def address(self, universe: int) -> Tuple[str, int]:
+        return self.host or f"239.255.{universe >> 8}.{universe & 0xFF}", self.port
+
+    def set_priority(self, priority: int):
+        with self._lock:
+            self.priority = priority
+            for universe in self.universes.values():
+                universe.packet[self.PRIORITY_AT] = priority
+
+    def close(self):
+        # Tell receivers the source is gone instead of letting them time out
+        with self._lock:
+            for universe in self.universes.values():
+                universe.packet[self.OPTIONS_AT] = self.STREAM_TERMINATED
+                for _ in range(3):
+                    self._send(universe, time.monotonic())
+        super().close()
+
+
+class ArtNetSender(DMXSender):
+    """Art-Net ArtDmx packets, broadcast unless a host is given"""
+
+    protocol = "artnet"
+    PORT = 6454
+    SEQUENCE_AT = 12
+
+    def __init__(self, host: str, port: int = 0, fps: float = DEFAULT_FPS):
+        super().__init__(host, port, fps)
+        if not host:
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+    def header(self, universe: int) -> bytes:
+        return struct.pack("<8sH", b"Art-Net\0", 0x5000) + struct.pack(
+            ">HBBBBH", 14, 0, 0, universe & 0xFF, universe >> 8 & 0x7F, CHANNELS)
+
+    def address(self, universe: int) -> Tuple[str, int]:
+        return self.host or "255.255.255.255", self.port
+
+    def next_sequence(self, sequence: int) -> int:
+        return sequence % 255 + 1  # 0 would switch off reordering at the node
+
+
+PROTOCOLS = {"sacn": (SACNSender, 1, 63999), "artnet": (ArtNetSender, 0, 32767)}  # class, universe range
+
+_senders: Dict[Tuple, DMXSender] = {}
+_senders_lock = threading.Lock()
+
+
+def sender_for(protocol: str, host: str = "", port: int = 0, fps: float = DEFAULT_FPS,
+               priority: int = 100) -> DMXSender:
+    """The shared sender for a receiver; one per target so sequence numbers stay in order"""
+    key = (protocol, host, port)
+    with _senders_lock:
+        sender = _senders.get(key)
+        if sender is None:
+            sender = _senders[key] = PROTOCOLS[protocol][0](host, port, fps)
+    sender.fps = fps
+    if isinstance(sender, SACNSender) and sender.priority != priority:
+        sender.set_priority(priority)
+    return sender
+
+
+def close_senders():
+    """Stop streaming (on exit); sACN receivers are told the streams ended"""
+    with _senders_lock:
+        senders = list(_senders.values())
+        _senders.clear()
+    for sender in senders:
+        sender.close()
+
+
+class DMXController(LEDController):
+    """A row of identical fixtures (or pixels) on consecutive DMX channels"""
+
+    log = log
+
+    def __init__(self, sender: DMXSender, universe: int, start: int = 1, fixtures: int = 1, layout: str = "rgb"):
+        _, lowest, highest = PROTOCOLS[sender.protocol]
+        if not lowest <= universe <= highest:
+            raise ValueError(f"{sender.protocol} universes are {lowest}-{highest}")
+        if not 1 <= start <= CHANNELS:
+            raise ValueError("DMX start channel must be 1-512")
+        if not layout or set(layout) - set(LAYOUT_CHANNELS) or len(layout) > CHANNELS:
+            raise ValueError(f"DMX channels must be letters of {LAYOUT_CHANNELS!r}")
+        if fixtures < 1:
+            raise ValueError("DMX needs at least one fixture")
+        self.sender = sender
+        self.universe = universe
+        self.start = start
+        self.fixtures = fixtures
+        self.layout = layout
+        self.spans = self._map_channels()
+        if self.spans[-1][0] > highest:
+            raise ValueError(f"{fixtures} fixtures run past the last {sender.protocol} universe")
+
+    def _map_channels(self) -> List[Tuple[int, int, int, int]]:
+        """(universe, first channel, body start, body end) for each universe the fixtures cover"""
+        width = len(self.layout)
+        spans, universe, offset, placed = [], self.universe, self.start - 1, 0
+        while placed < self.fixtures:
+            count = min((CHANNELS - offset) // width, self.fixtures - placed)
+            if count == 0:
+                universe, offset = universe + 1, 0
+                continue
+            spans.append((universe, offset, placed * width, (placed + count) * width))
+            placed += count
+            universe, offset = universe + 1, 0
+        return spans
+
+    @property
+    def device_key(self) -> str:
+        return f"{self.sender.protocol}:{self.sender.label}"
+
+    @property
+    def target_key(self) -> str:
+        return f"{self.device_key}/u{self.universe}:{self.start}"
+
+    @property
+    def effect_key(self) -> str:
+        # Fixture groups sharing a sender animate independently
+        return self.target_key
+
+    def fixture(self, r: int, g: int, b: int, brightness: int = 255) -> bytes:
+        """One fixture's channels for a colour"""
+        white = min(r, g, b) if "w" in self.layout else 0
+        if "d" not in self.layout:
+            r, g, b, white = (value * brightness // 255 for value in (r, g, b, white))
+        values = {"r": r - white, "g": g - white, "b": b - white, "w": white, "d": brightness, "-": 0}
+        return bytes(values[channel] for channel in self.layout)
+
+    def _plan(self, description: str, fixture: bytes) -> ActionPlan:
+        return ActionPlan(self.device_key, "DMX", f"{self.sender.protocol}://{self.sender.label}/{self.universe}",
+                          NO_HEADERS, fixture * self.fixtures, 0, description)
+
+    def compile_action(self, action: str, config: Dict) -> Optional[ActionPlan]:
+        r, g, b = parse_hex_color(config.get("color", "#ffffff"))
+        if action == "on":
+            return self._plan("turn on", self.fixture(r, g, b))
+        if action == "off":
+            return self._plan("turn off", self.fixture(0, 0, 0, 0))
+        if action == "color":
+            return self._plan(f"set color RGB({r},{g},{b})", self.fixture(r, g, b))
+        if action == "brightness":
+            brightness = max(0, min(100, int(config.get("brightness", 100))))
+            return self._plan(f"set brightness {brightness}%",
+                              self.fixture(r, g, b, round(brightness * 2.55)))
+        return None
+
+    def write(self, body: bytes):
+        for universe, offset, start, end in self.spans:
+            self.sender.write(universe, offset, body[start:end])
+
+    def read(self) -> bytes:
+        return b"".join(self.sender.read(universe, offset, end - start)
+                        for universe, offset, start, end in self.spans)
+
+    def send(self, plan: ActionPlan) -> bool:
+        _, breaker = self._admit()  # a UDP send never blocks, so one check is enough
+        self.write(plan.body)
+        if self.sender.flush():
+            breaker.record_success()
+            self.log.debug("%s -> %s", plan.description, plan.url)
+            return True
+        breaker.record_failure()
+        self.log.error("Failed to %s", plan.description, extra=kv(device=self.device_key))
+        return False
+
+    def turn_on(self) -> bool:
+        return self.send(self.compile_action("on", {}))
+
+    def turn_off(self) -> bool:
+        return self.send(self.compile_action("off", {}))
+
+    def set_color(self, color: str) -> bool:
+        return self.send(self.compile_action("color", {"color": color}))
+
+    def set_brightness(self, brightness: int) -> bool:
+        return self.send(self.compile_action("brightness", {"brightness": brightness}))
+
+    def set_animation(self, animation: str, seconds: float = 10.0, fps: float = 60,
+                      transport: str = "udp", realtime_port: Optional[int] = None, **options) -> bool:
+        """Play a host-rendered animation across the fixtures (see effects.py, needs numpy)"""
+        from effects import play_effect
+        try:
+            player = play_effect(self, animation, self.fixtures, seconds, fps, self.sender.protocol,
+                                 output=DMXFrameOutput(self), **options)
+            return player.wait_first_frame(2.0)
+        except (RuntimeError, ValueError) as e:
+            self.log.error("Failed to play animation: %s", e, extra=kv(device=self.target_key))
+            return False
+
+    def test_connection(self) -> bool:
+        return self.sender.healthy
+
+    def get_status(self) -> Dict:
+        return {"protocol": self.sender.protocol, "host": self.sender.label, "universe": self.universe,
+                "start": self.start, "fixtures": self.fixtures, "packets": self.sender.packets}
+
+
+class DMXFrameOutput:
+    """Animation frames into the fixtures' channels; the previous look comes back afterwards"""
+
+    def __init__(self, controller: DMXController):
+        from effects import np
+        if np is None:
+            raise RuntimeError("animations need numpy (pip install numpy)")
+        self.controller = controller
+        self.max_fps = controller.sender.fps
+        self._before = controller.read()
+        self._channels = np.zeros((controller.fixtures, len(controller.layout)), dtype=np.uint8)
+        self._columns = {channel: i for i, channel in enumerate(controller.layout)}
+        if "d" in self._columns:
+            self._channels[:, self._columns["d"]] = 255
+
+    def send(self, frame) -> bool:
+        columns, channels = self._columns, self._channels
+        if "w" in columns:
+            white = frame.min(axis=1)
+            channels[:, columns["w"]] = white
+            frame = frame - white[:, None]
+        for i, channel in enumerate("rgb"):
+            if channel in columns:
+                channels[:, columns[channel]] = frame[:, i]
+        self.controller.write(channels.tobytes())
+        return self.controller.sender.flush()
+
+    def close(self):
+        self.controller.write(self._before)
+        self.controller.sender.flush()
+
+
+def dmx_controller(led_type: str, config: Dict) -> DMXController:
+    """``create_led_controller`` for ``sacn`` and ``artnet``; raises ValueError for bad settings"""
+    sender = sender_for(led_type, config.get("dmx_host", ""), int(config.get("dmx_port") or 0),
+                        float(config.get("dmx_fps") or DEFAULT_FPS), int(config.get("dmx_priority", 100)))
+    return DMXController(sender, int(config.get("dmx_universe", PROTOCOLS[led_type][1])),
+                         int(config.get("dmx_start", 1)), int(config.get("dmx_fixtures", 1)),
+                         str(config.get("dmx_channels", "rgb")).lower())
@@ -0,0 +1,269 @@
+"""
+Host-side LED animations rendered with NumPy
+
+Effects are computed per frame on this machine and streamed to a WLED
+strip, so alarms can show animations the firmware doesn't have (a rotating
+raid siren, a chase in the team colours, ...). Every frame is rendered with
+array operations only: an effect maps LED positions and time to a 0-1 mix
+between two colours, which then goes through a gamma/brightness lookup table
+and an optional current limit.
+
+Two outputs are available:
+
+- ``"udp"``: WLED realtime UDP (DNRGB, port 21324), for smooth 60 fps playback
+- ``"json"``: per-LED ``seg.i`` writes over the JSON API, slow but works
+  everywhere the JSON API does
+
+NumPy is optional; without it ``EffectRenderer`` raises RuntimeError and the
+``animation`` action reports that numpy is missing.
+"""
+
+import math
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # animations are optional
+    np = None
+
+from app_logging import get_logger, kv
+from led_controllers import JSON_HEADERS, ActionPlan, encode_json, parse_hex_color
+
+log = get_logger("effects")
+
+REALTIME_PORT = 21324
+DNRGB = 4  # realtime protocol: RGB with a 16 bit start index
+DNRGB_MAX_LEDS = 489  # per packet
+SEG_I_CHUNK = 256  # LEDs per JSON request, keeps WLED's JSON buffer happy
+MILLIAMPS_PER_CHANNEL = 20  # typical WS2812 current at full brightness
+
+
+# Effect functions: (positions 0-1, phase in cycles) -> mix 0-1 per LED
+def _chase(x, phase):
+    # Four comets with fading tails
+    head = (x * 4 - phase) % 1.0
+    return np.clip(1.0 - head * 4, 0.0, 1.0)
+
+
+def _pulse(x, phase):
+    return np.full_like(x, 0.5 - 0.5 * math.cos(2 * math.pi * phase))
+
+
+def _strobe(x, phase):
+    return np.full_like(x, 1.0 if phase % 1.0 < 0.15 else 0.0)
+
+
+def _gradient(x, phase):
+    return 0.5 + 0.5 * np.sin(2 * np.pi * (x - phase))
+
+
+def _siren(x, phase):
+    # Two rotating halves with soft edges, like a police light bar
+    return 0.5 + 0.5 * np.tanh(6 * np.sin(2 * np.pi * (x + phase)))
+
+
+EFFECTS: Dict[str, Callable] = {
+    "chase": _chase,
+    "pulse": _pulse,
+    "strobe": _strobe,
+    "gradient": _gradient,
+    "siren": _siren,
+}
+
+DEFAULT_COLORS = {"siren": ("#ff0000", "#0000ff")}
+
+
+class EffectRenderer:
+    """Renders frames of one effect as (led_count, 3) uint8 arrays"""
+
+    def __init__(self, led_count: int, effect: str = "chase", colors: Sequence[str] = ("#ff0000", "#000000"),
+                 speed: float = 1.0, brightness: int = 255, gamma: float = 2.2, max_milliamps: int = 0):
+        if np is None:
+            raise RuntimeError("animations need numpy (pip install numpy)")
+        if effect not in EFFECTS:
+            raise ValueError(f"unknown animation {effect!r}")
+        self.led_count = led_count
+        self.effect = EFFECTS[effect]
+        self.speed = speed  # cycles per second
+        self.max_milliamps = max_milliamps  # 0 = no limit
+        self._x = np.linspace(0.0, 1.0, led_count, endpoint=False, dtype=np.float32)
+        self._on = np.array(parse_hex_color(colors[0]), dtype=np.float32)
+        self._off = np.array(parse_hex_color(colors[1] if len(colors) > 1 else "#000000"), dtype=np.float32)
+        # Gamma correction and the brightness cap in one lookup
+        levels = np.arange(256, dtype=np.float64) / 255
+        self._lut = np.round(255 * levels ** gamma * (brightness / 255)).astype(np.uint8)
+        self._frame = np.empty((led_count, 3), dtype=np.uint8)
+
+    def render(self, t: float) -> "np.ndarray":
+        """Frame at t seconds; the returned array is reused by the next call"""
+        mix = self.effect(self._x, t * self.speed).astype(np.float32, copy=False)
+        linear = self._off + mix[:, None] * (self._on - self._off)
+        np.take(self._lut, linear.astype(np.uint8), out=self._frame)
+        if self.max_milliamps:
+            self._limit_current()
+        return self._frame
+
+    def _limit_current(self):
+        """Scale the frame down when it would draw more than max_milliamps"""
+        milliamps = int(self._frame.sum(dtype=np.uint32)) * MILLIAMPS_PER_CHANNEL / 255
+        if milliamps > self.max_milliamps:
+            scale = self.max_milliamps / milliamps
+            np.multiply(self._frame, scale, out=self._frame, casting="unsafe")
+
+
+def dnrgb_packets(frame: "np.ndarray", timeout: int = 2) -> List[bytes]:
+    """Realtime UDP packets for a frame; WLED falls back to normal mode after ``timeout`` s"""
+    data = frame.tobytes()
+    return [bytes((DNRGB, timeout, start >> 8, start & 0xFF)) + data[start * 3:(start + DNRGB_MAX_LEDS) * 3]
+            for start in range(0, len(frame), DNRGB_MAX_LEDS)]
+
+
+def seg_i_payloads(frame: "np.ndarray", chunk: int = SEG_I_CHUNK) -> List[bytes]:
+    """JSON bodies setting individual LEDs: {"seg":{"i":[start,"RRGGBB",...]}}"""
+    colors = np.frombuffer(frame.tobytes().hex().upper().encode("ascii"), dtype="S6")
+    return [b'{"seg":{"i":[%d,"' % start + b'","'.join(colors[start:start + chunk].tolist()) + b'"]}}'
+            for start in range(0, len(frame), chunk)]
+
+
+class UdpFrameOutput:
+    """WLED realtime UDP (DNRGB)"""
+
+    max_fps = 120
+
+    def __init__(self, controller, port: int = REALTIME_PORT, timeout: int = 2):
+        self.controller = controller
+        self.address = (controller.ip.split(":")[0], port)
+        self.timeout = timeout
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, frame) -> bool:
+        try:
+            for packet in dnrgb_packets(frame, self.timeout):
+                self._socket.sendto(packet, self.address)
+            return True
+        except OSError as e:
+            log.error("Realtime UDP send failed: %s", e, extra=kv(device=self.controller.device_key))
+            return False
+
+    def close(self):
+        self._socket.close()
+        # Leave realtime mode now instead of after the timeout
+        self.controller.send(ActionPlan(self.controller.device_key, "POST", self.controller.base_url,
+                                        JSON_HEADERS, encode_json({"live": False}), 2, "exit realtime mode"))
+
+
+class JsonFrameOutput:
+    """Per-LED writes through the JSON API (one request per 256 LEDs)"""
+
+    max_fps = 10
+
+    def __init__(self, controller):
+        self.controller = controller
+
+    def send(self, frame) -> bool:
+        return all(self.controller.send(ActionPlan(self.controller.device_key, "POST", self.controller.base_url,
+                                                   JSON_HEADERS, payload, 2, "send frame"))
+                   for payload in seg_i_payloads(frame))
+
+    def close(self):
+        pass
+
+
+class EffectPlayer:
+    """Plays a renderer into an output at a fixed frame rate on its own thread"""
+
+    def __init__(self, renderer: EffectRenderer, output, fps: float = 60, duration: Optional[float] = None):
+        self.renderer = renderer
+        self.output = output
+        self.fps = min(fps, output.max_fps)
+        self.duration = duration  # seconds, None = until stop()
+        self.frames = 0
+        self.late_frames = 0
+        self.first_frame_ok = None
+        self._first_frame = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="effect-player", daemon=True)
+
+    def start(self) -> "EffectPlayer":
+        self._thread.start()
+        return self
+
+    def stop(self, wait: float = 1.0):
+        self._stop.set()
+        if self._thread.is_alive() and threading.current_thread() is not self._thread:
+            self._thread.join(wait)
+
+    @property
+    def running(self) -> bool:
+        return self._thread.is_alive()
+
+    def wait_first_frame(self, timeout: float) -> bool:
+        """Whether the first frame reached the output"""
+        self._first_frame.wait(timeout)
+        return bool(self.first_frame_ok)
+
+    def _run(self):
+        interval = 1.0 / self.fps
+        start = next_frame = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                t = time.monotonic() - start
+                if self.duration is not None and t >= self.duration:
+                    break
+                ok = self.output.send(self.renderer.render(t))
+                self.frames += 1
+                if self.first_frame_ok is None:
+                    self.first_frame_ok = ok
+                    self._first_frame.set()
+                next_frame += interval
+                delay = next_frame - time.monotonic()
+                if delay < 0:
+                    # Behind schedule: drop the missed frames instead of bursting
+                    self.late_frames += 1
+                    next_frame = time.monotonic()
+                else:
+                    self._stop.wait(delay)
+        except Exception as e:
+            log.error("Animation stopped: %s", e)
+        finally:
+            self._first_frame.set()
+            self.output.close()
+            log.debug("Animation finished", extra=kv(frames=self.frames, late=self.late_frames))
+
+
+_players: Dict[str, EffectPlayer] = {}
+_players_lock = threading.Lock()
+
+
+def stop_effect(effect_key: str):
+    """Stop the animation running on a device (or DMX fixture group), if any"""
+    with _players_lock:
+        player = _players.pop(effect_key, None)
+    if player is not None:
+        player.stop()
+
+
+def play_effect(controller, effect: str, led_count: int, seconds: float = 10.0, fps: float = 60,
+                transport: str = "udp", colors: Optional[Sequence[str]] = None,
+                realtime_port: int = REALTIME_PORT, output=None, **options) -> EffectPlayer:
+    """Start an animation on a WLED controller, replacing the one running there.
+
+    Other devices pass their own ``output`` (see ``dmx.py``); ``transport``
+    then only labels the log line.
+    """
+    if output is None and transport not in ("udp", "json"):
+        raise ValueError(f"unknown animation transport {transport!r}")
+    renderer = EffectRenderer(led_count, effect, colors or DEFAULT_COLORS.get(effect, ("#ff0000", "#000000")),
+                              **options)
+    stop_effect(controller.effect_key)
+    if output is None:
+        output = UdpFrameOutput(controller, realtime_port) if transport == "udp" else JsonFrameOutput(controller)
+    player = EffectPlayer(renderer, output, fps, seconds or None)
+    with _players_lock:
+        _players[controller.effect_key] = player
+    log.info("Playing %s animation", effect, extra=kv(device=controller.effect_key, leds=led_count,
+                                                       fps=player.fps, transport=transport))
+    return player.start()
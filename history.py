@@ -0,0 +1,110 @@
+"""
+Alarm history built from the journal's hourly rollup
+
+``AlarmHistory`` keeps the rollup rows in memory and only re-reads the rows
+of the current hour and later on each ``refresh()``, so the first refresh
+reads months of history in one small query and every later one a handful of
+rows. Reports are rendered as text with bar charts, like the metrics tab:
+alarms per hour, per rule and per device, and the latency trend.
+"""
+
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from journal import EventJournal, journal
+
+HOUR = 3600
+
+
+class AlarmHistory:
+    """In-memory copy of the hourly rollup, refreshed incrementally"""
+
+    def __init__(self, source: EventJournal = journal):
+        self.source = source
+        self._rows: Dict[Tuple[int, str, str], Dict] = {}  # (hour, rule, device) -> rollup row
+        self._next_hour = 0  # rows before this hour are final
+        self._lock = threading.Lock()
+
+    def refresh(self) -> int:
+        """Load rollup rows that may have changed; returns how many were read"""
+        with self._lock:
+            rows = self.source.hourly(self._next_hour)
+            for row in rows:
+                self._rows[row["hour"], row["rule"], row["device"]] = row
+            if rows:
+                # The newest hour may still grow; everything before it is done
+                self._next_hour = rows[-1]["hour"]
+            return len(rows)
+
+    def report(self) -> str:
+        """Refresh, then render; meant to run off the GUI thread"""
+        self.refresh()
+        return self.render_text()
+
+    def render_text(self, hours: int = 24, bar_width: int = 30) -> str:
+        with self._lock:
+            rows = list(self._rows.values())
+        now_hour = int(time.time() // HOUR)
+        first_hour = now_hour - hours + 1
+        week_hour = now_hour - 7 * 24 + 1
+
+        per_hour = [0] * hours
+        latency_sum, latency_count, latency_max = [0.0] * hours, [0] * hours, [0.0] * hours
+        rules: Dict[str, List[int]] = {}  # rule -> [last hours, last 7 days, all time]
+        devices: Dict[str, List[float]] = {}  # device -> [ok, failed, dropped, latency sum, latency count]
+        for row in rows:
+            slot = row["hour"] - first_hour
+            if row["alarms"] and row["rule"]:
+                counts = rules.setdefault(row["rule"], [0, 0, 0])
+                counts[0] += row["alarms"] if slot >= 0 else 0
+                counts[1] += row["alarms"] if row["hour"] >= week_hour else 0
+                counts[2] += row["alarms"]
+            if 0 <= slot < hours:
+                per_hour[slot] += row["alarms"]
+                latency_sum[slot] += row["latency_sum"]
+                latency_count[slot] += row["latency_count"]
+                latency_max[slot] = max(latency_max[slot], row["latency_max"])
+            if row["device"]:
+                totals = devices.setdefault(row["device"], [0, 0, 0, 0.0, 0])
+                for i, key in enumerate(("ok", "failed", "dropped", "latency_sum", "latency_count")):
+                    totals[i] += row[key]
+
+        def label(slot):
+            return time.strftime("%a %H:00", time.localtime((first_hour + slot) * HOUR))
+
+        lines = [f"Alarms per hour (last {hours} h):"]
+        peak = max(per_hour) or 1
+        for slot, count in enumerate(per_hour):
+            lines.append(f"{label(slot):>10} {'█' * round(bar_width * count / peak)} {count}")
+
+        lines.append("")
+        lines.append(f"{'Rule':<24}{f'{hours} h':>8}{'7 days':>10}{'Total':>10}")
+        if not rules:
+            lines.append("(no alarms recorded yet)")
+        for rule, (recent, week, total) in sorted(rules.items(), key=lambda item: -item[1][2]):
+            lines.append(f"{rule:<24}{recent:>8}{week:>10}{total:>10}")
+
+        lines.append("")
+        lines.append(f"{'Device':<36}{'OK':>8}{'Failed':>8}{'Dropped':>9}{'Avg ms':>10}")
+        if not devices:
+            lines.append("(no commands recorded yet)")
+        for device, (ok, failed, dropped, total_ms, count) in sorted(devices.items()):
+            average = f"{total_ms / count:.1f}" if count else "-"
+            lines.append(f"{device:<36}{ok:>8}{failed:>8}{dropped:>9}{average:>10}")
+
+        lines.append("")
+        lines.append(f"Latency trend (avg / max ms per hour, last {hours} h):")
+        averages = [total / count if count else 0.0 for total, count in zip(latency_sum, latency_count)]
+        peak = max(averages) or 1
+        for slot, average in enumerate(averages):
+            if latency_count[slot]:
+                lines.append(f"{label(slot):>10} {'█' * round(bar_width * average / peak)} "
+                             f"{average:.1f} / {latency_max[slot]:.1f}")
+            else:
+                lines.append(f"{label(slot):>10} -")
+        return "\n".join(lines)
+
+
+# Shared by the GUI tab; cheap until the first refresh
+alarm_history = AlarmHistory()
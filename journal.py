@@ -0,0 +1,299 @@
+"""
+Append-only event journal in SQLite
+
+Every received message, scheduling decision, dispatched command and device
+result is appended to a SQLite database so past alarms can be looked up
+later ("all raid alarms since the wipe"). Rows are one table with indexes on
+time, chat, rule and device::
+
+    journal.query(since=wipe_start, rule="raid")
+
+Recording never touches the disk on the caller's thread: ``record()`` appends
+a tuple to a list and a writer thread inserts the rows in batches, one
+transaction per batch, with the database in WAL mode so queries don't block
+it. When the file grows past ``max_bytes`` the oldest quarter of the rows is
+deleted.
+
+Each batch also updates an ``hourly`` rollup (alarms, results and latency
+per hour, rule and device) in the same transaction, so history views read a
+few hundred rows instead of scanning the events. The rollup outlives the
+events that retention removes.
+
+Listeners added with ``add_listener()`` get every event as a dict on the
+recording thread, whether or not the database is open (the MQTT event
+publisher uses this).
+
+The module-level ``journal`` does nothing until ``open()`` is called.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app_logging import get_logger, kv, throttle
+from metrics import AlarmTrace
+
+log = get_logger("journal")
+
+FLUSH_INTERVAL = 0.5  # seconds the writer waits to collect a batch
+RETENTION_INTERVAL = 60.0  # seconds between size checks
+MAX_TEXT = 500  # characters of message text kept
+
+# Event kinds
+UPDATE = "update"  # a new message in a watched chat (rule is None when nothing matched)
+SCHEDULE = "schedule"  # an alarm deferred or dropped by the priority scheduler or a tenant's rate limit
+COMMAND = "command"  # a command about to be sent to a device
+RESULT = "result"  # the device's answer: "ok", "failed" or "dropped"
+
+COLUMNS = ("ts", "kind", "source", "bot", "chat_id", "message_id", "rule",
+           "device", "action", "result", "latency_ms", "text")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    kind TEXT NOT NULL,
+    source TEXT,
+    bot TEXT,
+    chat_id TEXT,
+    message_id INTEGER,
+    rule TEXT,
+    device TEXT,
+    action TEXT,
+    result TEXT,
+    latency_ms REAL,
+    text TEXT
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+CREATE INDEX IF NOT EXISTS events_chat ON events (chat_id, ts);
+CREATE INDEX IF NOT EXISTS events_rule ON events (rule, ts);
+CREATE INDEX IF NOT EXISTS events_device ON events (device, ts);
+CREATE TABLE IF NOT EXISTS hourly (
+    hour INTEGER NOT NULL,
+    rule TEXT NOT NULL,
+    device TEXT NOT NULL,
+    alarms INTEGER NOT NULL DEFAULT 0,
+    ok INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    dropped INTEGER NOT NULL DEFAULT 0,
+    latency_sum REAL NOT NULL DEFAULT 0,
+    latency_count INTEGER NOT NULL DEFAULT 0,
+    latency_max REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, rule, device)
+);
+"""
+
+# Folds events with id > ? into the hourly rollup ('' = no rule / no device)
+_ROLLUP = f"""
+INSERT INTO hourly (hour, rule, device, alarms, ok, failed, dropped, latency_sum, latency_count, latency_max)
+SELECT CAST(ts / 3600 AS INTEGER), COALESCE(rule, ''), COALESCE(device, ''),
+       SUM(kind = '{UPDATE}' AND rule IS NOT NULL),
+       SUM(kind = '{RESULT}' AND result = 'ok'),
+       SUM(kind = '{RESULT}' AND result = 'failed'),
+       SUM(kind = '{RESULT}' AND result = 'dropped'),
+       TOTAL(CASE WHEN kind = '{RESULT}' AND result = 'ok' THEN latency_ms END),
+       COUNT(CASE WHEN kind = '{RESULT}' AND result = 'ok' THEN latency_ms END),
+       COALESCE(MAX(CASE WHEN kind = '{RESULT}' AND result = 'ok' THEN latency_ms END), 0)
+FROM events WHERE id > ? AND kind IN ('{UPDATE}', '{RESULT}')
+GROUP BY 1, 2, 3
+ON CONFLICT (hour, rule, device) DO UPDATE SET
+    alarms = alarms + excluded.alarms,
+    ok = ok + excluded.ok,
+    failed = failed + excluded.failed,
+    dropped = dropped + excluded.dropped,
+    latency_sum = latency_sum + excluded.latency_sum,
+    latency_count = latency_count + excluded.latency_count,
+    latency_max = MAX(latency_max, excluded.latency_max)
+"""
+
+_INSERT = f"INSERT INTO events ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+
+
+class EventJournal:
+    """Batched, append-only event log; safe to call from any thread"""
+
+    def __init__(self):
+        self.path: Optional[str] = None
+        self.max_bytes = 0
+        self._pending: List[Tuple] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flushed = threading.Condition(self._lock)
+        self._recorded = 0  # events queued / written so far, for flush()
+        self._written = 0
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self._listeners: List[Callable[[Dict], None]] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self._running
+
+    def open(self, path: str, max_bytes: int = 50 * 1024 * 1024):
+        """Create or open the database and start the writer thread"""
+        if self._running:
+            self.close()
+        connection = sqlite3.connect(path)
+        try:
+            # Must be set before the first table exists to let retention shrink the file
+            connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            connection.execute("PRAGMA journal_mode = WAL")
+            has_rollup = connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'hourly'").fetchone()
+            connection.executescript(SCHEMA)
+            if not has_rollup:
+                with connection:  # journal from before the rollup existed
+                    connection.execute(_ROLLUP, (0,))
+        finally:
+            connection.close()
+        self.path = path
+        self.max_bytes = max_bytes
+        self._running = True
+        self._wake.clear()
+        self._thread = threading.Thread(target=self._write_loop, name="journal-writer", daemon=True)
+        self._thread.start()
+        log.info("Journaling events to %s", path, extra=kv(max_mb=max_bytes // (1024 * 1024)))
+
+    def close(self, timeout: float = 5.0):
+        """Write what's pending and stop the writer"""
+        if not self._running:
+            return
+        self._running = False
+        self._wake.set()
+        self._thread.join(timeout)
+        with self._lock:
+            self._thread = None
+            self._flushed.notify_all()
+
+    def add_listener(self, listener: Callable[[Dict], None]):
+        """Also hand every recorded event to ``listener`` (it must not block)"""
+        self._listeners = self._listeners + [listener]
+
+    def record(self, kind: str, trace: Optional[AlarmTrace] = None, *, source: Optional[str] = None,
+               bot: Optional[str] = None, chat_id: Optional[str] = None, message_id: Optional[int] = None,
+               rule: Optional[str] = None, device: Optional[str] = None, action: Optional[str] = None,
+               result: Optional[str] = None, latency_ms: Optional[float] = None, text: Optional[str] = None):
+        """Queue one event; chat, message and rule default to the trace's alarm"""
+        if not self._running and not self._listeners:
+            return
+        if trace is not None and trace.origin is not None:
+            origin_chat, origin_message, origin_rule = trace.origin
+            chat_id = chat_id or origin_chat
+            message_id = message_id or origin_message
+            rule = rule or origin_rule
+        row = (time.time(), kind, source, bot, chat_id, message_id, rule, device, action, result,
+               latency_ms, text[:MAX_TEXT] if text else text)
+        for listener in self._listeners:
+            try:
+                listener(dict(zip(COLUMNS, row)))
+            except Exception as e:
+                log.error("Journal listener failed: %s", e, extra=throttle("journal-listener", 60))
+        if not self._running:
+            return
+        with self._lock:
+            self._pending.append(row)
+            self._recorded += 1
+        self._wake.set()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until everything recorded so far is committed"""
+        with self._lock:
+            target = self._recorded
+            self._wake.set()
+            return self._flushed.wait_for(lambda: self._written >= target or self._thread is None, timeout)
+
+    def query(self, since: Optional[float] = None, until: Optional[float] = None, kind: Optional[str] = None,
+              chat_id: Optional[str] = None, rule: Optional[str] = None, device: Optional[str] = None,
+              limit: int = 1000) -> List[Dict]:
+        """Events matching every given filter, newest first (times are Unix seconds)"""
+        if self.path is None:
+            return []
+        clauses, params = [], []
+        for column, op, value in (("ts", ">=", since), ("ts", "<", until), ("kind", "=", kind),
+                                  ("chat_id", "=", chat_id), ("rule", "=", rule), ("device", "=", device)):
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        connection.row_factory = sqlite3.Row
+        try:
+            rows = connection.execute(f"SELECT * FROM events {where} ORDER BY ts DESC LIMIT ?",
+                                      params + [limit]).fetchall()
+        finally:
+            connection.close()
+        return [dict(row) for row in rows]
+
+    def hourly(self, since_hour: int = 0) -> List[Dict]:
+        """Rollup rows from ``since_hour`` (Unix time // 3600) on, oldest first"""
+        if self.path is None:
+            return []
+        connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        connection.row_factory = sqlite3.Row
+        try:
+            rows = connection.execute("SELECT * FROM hourly WHERE hour >= ? ORDER BY hour",
+                                      (since_hour,)).fetchall()
+        finally:
+            connection.close()
+        return [dict(row) for row in rows]
+
+    def _write_loop(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA synchronous = NORMAL")  # WAL: durable up to the last checkpoint
+        connection.execute("PRAGMA journal_size_limit = 4194304")
+        next_retention = time.monotonic()
+        try:
+            while True:
+                self._wake.wait()
+                if self._running:
+                    time.sleep(FLUSH_INTERVAL)  # let a burst collect into one transaction
+                self._wake.clear()
+                with self._lock:
+                    batch, self._pending = self._pending, []
+                if batch:
+                    try:
+                        with connection:
+                            last_id = connection.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+                            connection.executemany(_INSERT, batch)
+                            connection.execute(_ROLLUP, (last_id,))
+                    except sqlite3.Error as e:
+                        log.error("Failed to write %d journal events: %s", len(batch), e)
+                with self._lock:
+                    self._written += len(batch)
+                    self._flushed.notify_all()
+                if not self._running:
+                    break
+                if time.monotonic() >= next_retention:
+                    next_retention = time.monotonic() + RETENTION_INTERVAL
+                    self._enforce_retention(connection)
+        finally:
+            connection.close()
+            with self._lock:
+                self._flushed.notify_all()
+
+    def _enforce_retention(self, connection: sqlite3.Connection):
+        """Delete the oldest quarter of the rows while the file is over max_bytes"""
+        try:
+            size = os.path.getsize(self.path)
+            while self.max_bytes and size > self.max_bytes:
+                count = connection.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+                if count < 4:
+                    return
+                with connection:
+                    connection.execute("DELETE FROM events WHERE id <= "
+                                       "(SELECT id FROM events ORDER BY id LIMIT 1 OFFSET ?)", (count // 4,))
+                connection.executescript("PRAGMA incremental_vacuum;")  # execute() frees one page only
+                connection.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+                log.info("Journal over %d MB, removed oldest events", self.max_bytes // (1024 * 1024),
+                         extra=kv(removed=count // 4))
+                shrunk, size = size, os.path.getsize(self.path)
+                if size >= shrunk:
+                    return  # a journal created without auto_vacuum only stops growing
+        except (OSError, sqlite3.Error) as e:
+            log.error("Journal retention failed: %s", e)
+
+
+# Process-wide journal shared by intake, scheduler and dispatch
+journal = EventJournal()
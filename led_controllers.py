@@ -1,16 +1,310 @@
 """
 LED Controller Classes for different LED systems (WLED, Govee, Philips Hue)
+
+WLED over MQTT lives in ``mqtt_transport.py``, DMX (sACN, Art-Net) in ``dmx.py``.
 """
 
 import requests
 import json
+import random
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Dict, List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from types import MappingProxyType
+from typing import Dict, List, Mapping, NamedTuple, Optional, Tuple, Union
+
+from app_logging import get_logger, kv
+
+wled_log = get_logger("wled")
+govee_log = get_logger("govee")
+hue_log = get_logger("hue")
+log = get_logger("led")
+
+# One keep-alive pool for every device; urllib3 pools per host
+_session = requests.Session()
+_session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16))
+_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16))
+
+# Requests made on behalf of a Command run here so the caller can stop
+# waiting for them (see Command.run)
+_io_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="led-http")
+
+
+class DeviceUnavailable(Exception):
+    """Raised instead of sending a request while a device's circuit is open"""
+    
+    def __init__(self, device_key: str, retry_in: float):
+        super().__init__(f"{device_key} unavailable, retrying in {retry_in:.0f}s")
+        self.device_key = device_key
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Per-device circuit breaker with jittered exponential backoff.
+    
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    requests fail immediately. Once the backoff has elapsed, a single
+    half-open probe is let through (with a short timeout); success closes
+    the circuit, failure reopens it with a doubled backoff.
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+    
+    def __init__(self, name: str = "", failure_threshold: int = 3, base_backoff: float = 2.0,
+                 max_backoff: float = 60.0, jitter: float = 0.2, probe_timeout: float = 1.5):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.probe_timeout = probe_timeout
+        self.state = self.CLOSED
+        self.failures = 0  # consecutive failures
+        self.opened = 0  # consecutive times opened, drives the backoff
+        self.next_probe = 0.0
+        self._lock = threading.Lock()
+    
+    def allow(self) -> bool:
+        """Whether a request may be sent now (claims the probe when half-opening)"""
+        if self.state == self.CLOSED:  # lock-free fast path
+            return True
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() >= self.next_probe:
+                self.state = self.HALF_OPEN
+                return True
+            return self.state == self.CLOSED
+    
+    def record_success(self):
+        if self.state == self.CLOSED and not self.failures:
+            return
+        with self._lock:
+            if self.state != self.CLOSED:
+                log.info("Circuit closed, device is back", extra=kv(device=self.name))
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened = 0
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened += 1
+                backoff = min(self.max_backoff, self.base_backoff * 2 ** (self.opened - 1))
+                backoff *= random.uniform(1 - self.jitter, 1 + self.jitter)
+                self.next_probe = time.monotonic() + backoff
+                if self.state != self.OPEN:
+                    log.warning("Circuit opened, failing fast for %.1fs", backoff,
+                                extra=kv(device=self.name, failures=self.failures))
+                self.state = self.OPEN
+    
+    def rejecting(self) -> bool:
+        """True while requests would be refused (open and waiting, or a probe in flight)"""
+        if self.state == self.CLOSED:
+            return False
+        return self.state == self.HALF_OPEN or time.monotonic() < self.next_probe
+    
+    def retry_in(self) -> float:
+        return max(0.0, self.next_probe - time.monotonic()) if self.state == self.OPEN else 0.0
+    
+    def request_timeout(self, timeout: float) -> float:
+        """Probes use a short timeout so a dead device costs little even then"""
+        return min(timeout, self.probe_timeout) if self.state == self.HALF_OPEN else timeout
+    
+    def snapshot(self) -> Dict:
+        return {"state": self.state, "failures": self.failures, "retry_in": self.retry_in()}
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(device_key: str) -> CircuitBreaker:
+    """The circuit breaker shared by every controller for this device"""
+    breaker = _breakers.get(device_key)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(device_key, CircuitBreaker(device_key))
+    return breaker
+
+
+def breaker_states() -> Dict[str, Dict]:
+    """Snapshot of every device's circuit, for the GUI"""
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {device_key: breaker.snapshot() for device_key, breaker in breakers.items()}
+
+
+class CommandCancelled(BaseException):
+    """A command was dropped before or while talking to its device.
+    
+    Derives from BaseException (like asyncio.CancelledError) so the broad
+    ``except Exception`` handlers in the controllers don't swallow it.
+    """
+    
+    def __init__(self, device_key: str, reason: str):
+        super().__init__(f"{device_key}: {reason}")
+        self.device_key = device_key
+        self.reason = reason
+
+
+class DeadlineExceeded(CommandCancelled):
+    """The alarm is too old for its command to still be useful"""
+
+
+class Superseded(CommandCancelled):
+    """A newer command was issued for the same device"""
+
+
+_active = threading.local()
+
+
+class Command:
+    """One action on one device, with a deadline and supersession.
+    
+    Starting a command (``begin_command``) supersedes the previous one for
+    the same device. While a command is active (``with command:``), every
+    controller request on that thread checks it: nothing is sent once it is
+    superseded or past its deadline, request timeouts are capped at the time
+    left, and the caller stops waiting for an in-flight request as soon as
+    either happens. A command's first request waits (within its deadline)
+    for every request older commands still have on the wire, abandoned ones
+    included, so an older state can't land last.
+    """
+    
+    def __init__(self, device_key: str, deadline: Optional[float] = None):
+        self.device_key = device_key
+        self.deadline = deadline  # time.monotonic() value, None = no deadline
+        self.superseded = False
+        self._after: List[Future] = []  # older commands' requests still on the wire
+        self._in_flight: List[Future] = []
+        self._waiters: List[threading.Event] = []
+        self._lock = threading.Lock()
+    
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline (None without one)"""
+        return None if self.deadline is None else self.deadline - time.monotonic()
+    
+    def check(self):
+        """Raise if this command must not touch the device anymore"""
+        if self.superseded:
+            raise Superseded(self.device_key, "superseded by a newer alarm")
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(self.device_key, f"{-remaining:.1f}s past deadline")
+    
+    def supersede(self) -> List[Future]:
+        """Stop the command; returns the requests it (or older ones) still has on the wire"""
+        with self._lock:
+            self.superseded = True
+            waiters = list(self._waiters)
+            pending = [future for future in self._after + self._in_flight if not future.done()]
+        for event in waiters:
+            event.set()
+        return pending
+    
+    def run(self, fn, *args, **kwargs):
+        """Call fn on the I/O pool, waiting only while the command is live.
+        
+        An abandoned call keeps running in the background; requests has no
+        way to abort a request on the wire, so the socket is closed by its
+        (deadline-capped) timeout and the breaker still sees the outcome.
+        """
+        if self._after:
+            self._wait(self._after)
+            self._after = []
+        with self._lock:
+            # Atomic with supersede(): a newer command either sees this
+            # request in flight or this command already superseded
+            self.check()
+            future = _io_pool.submit(fn, *args, **kwargs)
+            self._in_flight = [pending for pending in self._in_flight if not pending.done()] + [future]
+        self._wait([future])
+        return future.result()
+    
+    def _wait(self, futures: List[Future]):
+        """Block until the futures are done, raising as soon as the command is dropped"""
+        done = threading.Event()
+        for future in futures:
+            future.add_done_callback(lambda _: done.set())
+        with self._lock:
+            self._waiters.append(done)
+        try:
+            while True:
+                done.clear()
+                if all(future.done() for future in futures):
+                    return
+                self.check()
+                done.wait(self.remaining())
+        finally:
+            with self._lock:
+                self._waiters.remove(done)
+    
+    def __enter__(self):
+        self._outer = getattr(_active, "command", None)
+        _active.command = self
+        return self
+    
+    def __exit__(self, *exc):
+        _active.command = self._outer
+
+
+_commands: Dict[str, Command] = {}
+_commands_lock = threading.Lock()
+
+
+def begin_command(device_key: str, deadline: Optional[float] = None) -> Command:
+    """Start a command for a device, superseding the one before it"""
+    with _commands_lock:
+        previous = _commands.get(device_key)
+        command = _commands[device_key] = Command(device_key, deadline)
+        if previous is not None:
+            command._after = previous.supersede()
+    return command
+
+
+class ActionPlan(NamedTuple):
+    """A compiled device command: everything needed to send it, pre-encoded.
+    
+    Plans are shared between threads, so ``headers`` is a read-only mapping
+    (``MappingProxyType``) that the controller can't change afterwards.
+    """
+    device_key: str
+    method: str
+    url: str
+    headers: Mapping[str, str]
+    body: bytes
+    timeout: float
+    description: str  # for logs, e.g. "set color RGB(255,0,0)"
+    # WLED segment plans: body is the segment object without its id, which
+    # is resolved at send time so plans for one strip can be merged
+    segment: Union[int, str, None] = None
+    power_on: bool = False  # the strip must be on for the segment to show
+
+
+JSON_HEADERS = MappingProxyType({"Content-Type": "application/json"})
+NO_HEADERS = MappingProxyType({})
+
+
+def encode_json(payload) -> bytes:
+    return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+
+def parse_hex_color(color: str) -> Tuple[int, int, int]:
+    """"#ff8000" -> (255, 128, 0); raises ValueError for anything else"""
+    hex_color = color.lstrip("#")
+    if len(hex_color) != 6:
+        raise ValueError(f"invalid color {color!r}")
+    return int(hex_color[0:2], 16), int(hex_color[2:4], 16), int(hex_color[4:6], 16)
 
 
 class LEDController(ABC):
     """Abstract base class for LED controllers"""
     
+    log = log
+    
     @abstractmethod
     def turn_on(self) -> bool:
         """Turn the LED device on"""
@@ -35,152 +329,473 @@ class LEDController(ABC):
     def get_status(self) -> Dict:
         """Get current device status"""
         pass
+    
+    @property
+    def device_key(self) -> str:
+        """Stable identifier for metrics and logs (e.g. ``wled:192.168.1.50``)"""
+        return type(self).__name__
+    
+    @property
+    def target_key(self) -> str:
+        """What a newer command supersedes: the device, or a part of it"""
+        return self.device_key
+    
+    @property
+    def effect_key(self) -> str:
+        """Where an animation plays; realtime frames take over the whole device"""
+        return self.device_key
+    
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return breaker_for(self.device_key)
+    
+    def available(self) -> bool:
+        """False while the device's circuit is open (no request would be sent)"""
+        return not self.breaker.rejecting()
+    
+    def compile_action(self, action: str, config: Dict) -> Optional[ActionPlan]:
+        """Pre-encode the request for a configured action.
+        
+        Returns None when the action can't be compiled (it needs a lookup on
+        the device first, or isn't supported) and has to go through the
+        controller methods instead. Raises ValueError for bad settings.
+        """
+        return None
+    
+    def send(self, plan: ActionPlan) -> bool:
+        """Send a compiled action; True if the device accepted it"""
+        try:
+            response = self._request(plan.method, plan.url, plan.timeout, data=plan.body, headers=plan.headers)
+            self.log.debug("%s -> %s (%d)", plan.description, plan.url, response.status_code)
+            return response.status_code == 200
+        except Exception as e:
+            self.log.error("Failed to %s: %s", plan.description, e, extra=kv(device=self.device_key))
+            return False
+    
+    def _admit(self) -> Tuple[Optional[Command], CircuitBreaker]:
+        """Check the thread's active command and the device's circuit before sending.
+        
+        Raises CommandCancelled or DeviceUnavailable; returns the command
+        (None outside one) and the breaker to record the outcome on.
+        """
+        command = getattr(_active, "command", None)
+        if command is not None:
+            command.check()
+        breaker = self.breaker
+        if not breaker.allow():
+            raise DeviceUnavailable(self.device_key, breaker.retry_in())
+        return command, breaker
+    
+    def _request(self, method: str, url: str, timeout: float, **kwargs) -> requests.Response:
+        """Send a request through the device's circuit breaker.
+        
+        Inside an active Command, the request is subject to its deadline and
+        supersession (and may raise CommandCancelled).
+        """
+        command, breaker = self._admit()
+        if command is not None:
+            remaining = command.remaining()
+            if remaining is not None:
+                timeout = min(timeout, remaining)
+        timeout = breaker.request_timeout(timeout)
+        if command is None:
+            return self._send(breaker, method, url, timeout, kwargs)
+        return command.run(self._send, breaker, method, url, timeout, kwargs)
+    
+    def _send(self, breaker: CircuitBreaker, method: str, url: str, timeout: float, kwargs: Dict) -> requests.Response:
+        try:
+            response = _session.request(method, url, timeout=timeout, **kwargs)
+        except requests.RequestException:
+            breaker.record_failure()
+            raise
+        # Rate limiting and server errors count against the device; other
+        # answers prove it is reachable
+        if response.status_code >= 500 or response.status_code == 429:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+
+MAIN_SEGMENT = -1  # ActionPlan.segment for "whatever the strip's main segment is"
+
+_wled_layouts: Dict[str, Dict] = {}  # device_key -> {"info": {...}, "segments": [...], "mainseg": id}
+
+
+def clear_layouts():
+    """Forget the cached WLED segment layouts; the next action reads them again"""
+    _wled_layouts.clear()
+
+
+def parse_segment(value) -> Union[int, str, None]:
+    """Config ``wled_segment``: a segment id ("2") or name ("Left")"""
+    if value is None or str(value).strip() == "":
+        return None
+    value = str(value).strip()
+    return int(value) if value.isdigit() else value
+
+
+def parse_led_range(value) -> Optional[Tuple[int, int]]:
+    """Config ``wled_leds``: inclusive "first-last" -> (start, stop) with stop exclusive"""
+    if value is None or str(value).strip() == "":
+        return None
+    first, sep, last = str(value).partition("-")
+    first, last = int(first), int(last if sep else first)
+    if first < 0 or last < first:
+        raise ValueError(f"invalid LED range {value!r}")
+    return first, last + 1
+
+
+class SegmentBatch:
+    """Group commit for one strip's segment updates.
+    
+    The first caller sends its update; updates for other segments that
+    arrive while that request is in flight are merged into the next one,
+    so a burst of alarms for different segments costs one or two requests.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[ActionPlan, Dict]] = []
+        self._flushing = False
+    
+    def send(self, controller: "WLEDController", plan: ActionPlan) -> bool:
+        slot = {"done": threading.Event(), "ok": False}
+        with self._lock:
+            self._pending.append((plan, slot))
+            leader = not self._flushing
+            self._flushing = True
+        if leader:
+            self._flush(controller)
+        # The merged request may go out late; answer with its real outcome.
+        # The leader finishes every slot, even when it fails
+        slot["done"].wait()
+        return slot["ok"]
+    
+    def _flush(self, controller: "WLEDController"):
+        # The merged request serves several commands, so it isn't subject to
+        # this thread's command (each was checked before joining the batch)
+        outer = getattr(_active, "command", None)
+        _active.command = None
+        batch = []
+        try:
+            while True:
+                with self._lock:
+                    batch, self._pending = self._pending, []
+                    if not batch:
+                        self._flushing = False
+                        return
+                parts, sent = [], []
+                for plan, slot in batch:
+                    try:
+                        parts.append(b'{"id":%d,' % controller.segment_id(plan.segment) + plan.body[1:])
+                        sent.append((plan, slot))
+                    except ValueError as e:
+                        wled_log.error("Failed to %s: %s", plan.description, e, extra=kv(ip=controller.ip))
+                        slot["done"].set()
+                if not sent:
+                    continue
+                power_on = any(plan.power_on for plan, _ in sent)
+                body = (b'{"on":true,"seg":[' if power_on else b'{"seg":[') + b",".join(parts) + b"]}"
+                ok = LEDController.send(controller, ActionPlan(
+                    controller.device_key, "POST", controller.base_url, JSON_HEADERS, body, 5,
+                    "; ".join(plan.description for plan, _ in sent)))
+                for _, slot in sent:
+                    slot["ok"] = ok
+                    slot["done"].set()
+        except BaseException:
+            # Never leave followers waiting on a leader that is gone
+            with self._lock:
+                batch += self._pending
+                self._pending, self._flushing = [], False
+            for _, slot in batch:
+                slot["done"].set()
+            raise
+        finally:
+            _active.command = outer
+
+
+_segment_batches: Dict[str, SegmentBatch] = {}
+_segment_batches_lock = threading.Lock()
 
 
 class WLEDController(LEDController):
-    """Controller for WLED devices"""
+    """Controller for WLED devices.
+    
+    By default actions address the whole strip (the main segment). With
+    ``segment`` (id or name) and/or ``leds`` (an LED range within that
+    segment) they paint only that part, so different alarms can share one
+    strip.
+    """
+    
+    log = wled_log
     
-    def __init__(self, ip: str):
+    def __init__(self, ip: str, segment: Union[int, str, None] = None, leds: Optional[Tuple[int, int]] = None):
         self.ip = ip
         self.base_url = f"http://{ip}/json/state"
+        self.segment = segment
+        self.leds = leds
+    
+    @property
+    def device_key(self) -> str:
+        return f"wled:{self.ip}"
+    
+    @property
+    def target_key(self) -> str:
+        target = self.device_key
+        if self.segment is not None:
+            target += f"/seg:{self.segment}"
+        if self.leds is not None:
+            target += f"/leds:{self.leds[0]}-{self.leds[1] - 1}"
+        return target
+    
+    def _state_plan(self, description: str, payload: Dict) -> ActionPlan:
+        return ActionPlan(self.device_key, "POST", self.base_url, JSON_HEADERS,
+                          encode_json(payload), 5, description)
+    
+    def _segment_plan(self, description: str, payload: Dict, power_on: bool = True) -> ActionPlan:
+        segment = MAIN_SEGMENT if self.segment is None else self.segment
+        return ActionPlan(self.device_key, "POST", self.base_url, JSON_HEADERS, encode_json(payload), 5,
+                          f"{description} on {self.target_key.split('/', 1)[1]}", segment, power_on)
+    
+    def compile_action(self, action: str, config: Dict) -> Optional[ActionPlan]:
+        if self.segment is not None or self.leds is not None:
+            return self._compile_segment_action(action, config)
+        if action == "on":
+            return self._state_plan("turn on", {"on": True})
+        if action == "off":
+            return self._state_plan("turn off", {"on": False})
+        if action == "color":
+            r, g, b = parse_hex_color(config.get("color", "#ffffff"))
+            return self._state_plan(f"set color RGB({r},{g},{b})", {"on": True, "seg": [{"col": [[r, g, b]]}]})
+        if action == "effect":
+            effect_id = int(config.get("effect", 0))
+            return self._state_plan(f"set effect #{effect_id}", {"on": True, "seg": [{"fx": effect_id}]})
+        if action == "preset":
+            preset_id = int(config.get("preset", 0))
+            return self._state_plan(f"run preset #{preset_id}", {"ps": preset_id})
+        return None
+    
+    def _compile_segment_action(self, action: str, config: Dict) -> Optional[ActionPlan]:
+        if self.leds is not None:
+            # Individual LEDs only hold a color (they are repainted by effects)
+            start, stop = self.leds
+            if action == "color":
+                r, g, b = parse_hex_color(config.get("color", "#ffffff"))
+                return self._segment_plan(f"set color RGB({r},{g},{b})",
+                                          {"fx": 0, "i": [start, stop, f"{r:02X}{g:02X}{b:02X}"]})
+            if action == "off":
+                return self._segment_plan("turn off", {"i": [start, stop, "000000"]}, power_on=False)
+            raise ValueError(f"LED ranges support color and off only, not '{action}'")
+        if action == "on":
+            return self._segment_plan("turn on", {"on": True})
+        if action == "off":
+            return self._segment_plan("turn off", {"on": False}, power_on=False)
+        if action == "color":
+            r, g, b = parse_hex_color(config.get("color", "#ffffff"))
+            return self._segment_plan(f"set color RGB({r},{g},{b})", {"on": True, "col": [[r, g, b]]})
+        if action == "effect":
+            effect_id = int(config.get("effect", 0))
+            return self._segment_plan(f"set effect #{effect_id}", {"on": True, "fx": effect_id})
+        if action == "preset":
+            raise ValueError("presets apply to the whole strip")
+        return None
+    
+    def send(self, plan: ActionPlan) -> bool:
+        if plan.segment is None:
+            return super().send(plan)
+        # Segment updates for one strip go out together
+        batch = _segment_batches.get(self.device_key)
+        if batch is None:
+            with _segment_batches_lock:
+                batch = _segment_batches.setdefault(self.device_key, SegmentBatch())
+        command = getattr(_active, "command", None)
+        if command is not None:
+            command.check()
+        return batch.send(self, plan)
+    
+    def _send_action(self, action: str, config: Dict, what: str) -> bool:
+        # LED ranges and segments don't support every action
+        try:
+            plan = self.compile_action(action, config)
+        except ValueError as e:
+            wled_log.error("Failed to %s: %s", what, e, extra=kv(ip=self.ip))
+            return False
+        return self.send(plan)
     
     def turn_on(self) -> bool:
         """Turn WLED on"""
-        try:
-            payload = {"on": True}
-            response = requests.post(self.base_url, json=payload, timeout=5)
-            print(f"[WLED] Turning ON -> {self.base_url}")
-            return response.status_code == 200
-        except Exception as e:
-            print(f"[WLED ERROR] Failed to turn on: {e}")
-            return False
+        return self._send_action("on", {}, "turn on")
     
     def turn_off(self) -> bool:
         """Turn WLED off"""
-        try:
-            payload = {"on": False}
-            response = requests.post(self.base_url, json=payload, timeout=5)
-            print(f"[WLED] Turning OFF -> {self.base_url}")
-            return response.status_code == 200
-        except Exception as e:
-            print(f"[WLED ERROR] Failed to turn off: {e}")
-            return False
+        return self._send_action("off", {}, "turn off")
     
     def set_color(self, color: str) -> bool:
         """Set WLED color"""
-        try:
-            hex_color = color.lstrip("#")
-            r = int(hex_color[0:2], 16)
-            g = int(hex_color[2:4], 16)
-            b = int(hex_color[4:6], 16)
-            payload = {"on": True, "seg": [{"col": [[r, g, b]]}]}
-            response = requests.post(self.base_url, json=payload, timeout=5)
-            print(f"[WLED] Setting color RGB({r},{g},{b}) -> {self.base_url}")
-            return response.status_code == 200
-        except Exception as e:
-            print(f"[WLED ERROR] Failed to set color: {e}")
-            return False
+        return self._send_action("color", {"color": color}, "set color")
     
     def set_effect(self, effect_id: int) -> bool:
         """Set WLED effect"""
-        try:
-            payload = {"on": True, "seg": [{"fx": effect_id}]}
-            response = requests.post(self.base_url, json=payload, timeout=5)
-            print(f"[WLED] Setting effect #{effect_id} -> {self.base_url}")
-            return response.status_code == 200
-        except Exception as e:
-            print(f"[WLED ERROR] Failed to set effect: {e}")
-            return False
+        return self._send_action("effect", {"effect": effect_id}, "set effect")
     
     def set_preset(self, preset_id: int) -> bool:
         """Set WLED preset"""
+        return self._send_action("preset", {"preset": preset_id}, "set preset")
+    
+    def set_animation(self, animation: str, seconds: float = 10.0, fps: float = 60,
+                      transport: str = "udp", **options) -> bool:
+        """Play a host-rendered animation (see effects.py, needs numpy)"""
+        from effects import play_effect
         try:
-            payload = {"ps": preset_id}
-            response = requests.post(self.base_url, json=payload, timeout=5)
-            print(f"[WLED] Running preset #{preset_id} -> {self.base_url}")
-            return response.status_code == 200
-        except Exception as e:
-            print(f"[WLED ERROR] Failed to set preset: {e}")
+            led_count = int(self.get_info().get("leds", {}).get("count", 0))
+            if not led_count:
+                wled_log.error("Failed to play animation: LED count unknown", extra=kv(ip=self.ip))
+                return False
+            player = play_effect(self, animation, led_count, seconds, fps, transport, **options)
+            return player.wait_first_frame(2.0)
+        except (RuntimeError, ValueError) as e:
+            wled_log.error("Failed to play animation: %s", e, extra=kv(ip=self.ip))
             return False
     
+    def get_info(self) -> Dict:
+        """/json/info (LED count, ...), from the cached layout"""
+        return self.get_layout().get("info", {})
+    
+    def get_layout(self) -> Dict:
+        """LED count and segments of the strip, read once per device and cached.
+        
+        Uses /json/si (info and state in one request) so segment names are
+        known too; older firmware without it falls back to /json/info.
+        """
+        layout = _wled_layouts.get(self.device_key)
+        if layout is not None:
+            return layout
+        try:
+            response = self._request("GET", f"http://{self.ip}/json/si", 5)
+            if response.status_code == 200:
+                data = response.json()
+                info, state = data.get("info", {}), data.get("state", {})
+            else:
+                response = self._request("GET", f"http://{self.ip}/json/info", 5)
+                if response.status_code != 200:
+                    return {}
+                info, state = response.json(), {}
+        except Exception as e:
+            wled_log.error("Failed to read segment layout: %s", e, extra=kv(ip=self.ip))
+            return {}
+        layout = {
+            "info": info,
+            "segments": [{"id": seg.get("id", i), "name": seg.get("n", ""),
+                          "start": seg.get("start", 0), "stop": seg.get("stop", 0)}
+                         for i, seg in enumerate(state.get("seg", []))],
+            "mainseg": state.get("mainseg", 0),
+        }
+        _wled_layouts[self.device_key] = layout
+        wled_log.debug("Segment layout: %s", ", ".join(f"{seg['id']}={seg['name'] or '-'}"
+                                                     for seg in layout["segments"]), extra=kv(ip=self.ip))
+        return layout
+    
+    def segment_id(self, segment: Union[int, str]) -> int:
+        """Resolve MAIN_SEGMENT or a segment name to its id (ValueError if unknown)"""
+        if isinstance(segment, int) and segment != MAIN_SEGMENT:
+            return segment
+        layout = self.get_layout()
+        if segment == MAIN_SEGMENT:
+            return layout.get("mainseg", 0)
+        for seg in layout.get("segments", []):
+            if seg["name"].lower() == segment.lower():
+                return seg["id"]
+        raise ValueError(f"no segment named {segment!r}")
+    
     def test_connection(self) -> bool:
         """Test WLED connection"""
         try:
-            response = requests.get(f"http://{self.ip}/json/info", timeout=5)
+            response = self._request("GET", f"http://{self.ip}/json/info", 5)
             return response.status_code == 200
-        except:
+        except Exception:
             return False
     
     def get_status(self) -> Dict:
         """Get WLED status"""
         try:
-            response = requests.get(self.base_url, timeout=5)
+            response = self._request("GET", self.base_url, 5)
             return response.json() if response.status_code == 200 else {}
-        except:
+        except Exception:
             return {}
 
 
 class GoveeController(LEDController):
     """Controller for Govee devices"""
     
-    def __init__(self, api_key: str, device_id: str, model: str):
+    API_URL = "https://developer-api.govee.com/v1/devices"
+    
+    log = govee_log
+    
+    def __init__(self, api_key: str, device_id: str, model: str, base_url: str = API_URL):
         self.api_key = api_key
         self.device_id = device_id
         self.model = model
-        self.base_url = "https://developer-api.govee.com/v1/devices"
+        self.base_url = base_url
         self.headers = {
             "Govee-API-Key": api_key,
             "Content-Type": "application/json"
         }
         self._scenes_cache = None
     
+    @property
+    def device_key(self) -> str:
+        return f"govee:{self.device_id}"
+    
+    def _control_plan(self, capability: str, value: any) -> ActionPlan:
+        payload = {
+            "device": self.device_id,
+            "model": self.model,
+            "cmd": {
+                "name": capability,
+                "value": value
+            }
+        }
+        # A snapshot: the plan outlives changes to this controller's headers
+        return ActionPlan(self.device_key, "PUT", f"{self.base_url}/control", MappingProxyType(dict(self.headers)),
+                          encode_json(payload), 10, f"control {capability}={value}")
+    
+    def compile_action(self, action: str, config: Dict) -> Optional[ActionPlan]:
+        if action in ("on", "off"):
+            return self._control_plan("turn", action)
+        if action == "color":
+            # Govee expects RGB values
+            r, g, b = parse_hex_color(config.get("color", "#ffffff"))
+            return self._control_plan("color", {"r": r, "g": g, "b": b})
+        if action == "brightness":
+            brightness = max(0, min(100, int(config.get("brightness", 100))))  # Clamp to valid range
+            return self._control_plan("brightness", brightness)
+        return None  # scenes need the device's scene list first
+    
     def _make_control_request(self, capability: str, value: any) -> bool:
         """Make a control request to Govee API"""
-        try:
-            payload = {
-                "device": self.device_id,
-                "model": self.model,
-                "cmd": {
-                    "name": capability,
-                    "value": value
-                }
-            }
-            response = requests.put(f"{self.base_url}/control", 
-                                  json=payload, headers=self.headers, timeout=10)
-            print(f"[GOVEE] Control request {capability}: {value} -> Status: {response.status_code}")
-            return response.status_code == 200
-        except Exception as e:
-            print(f"[GOVEE ERROR] Control request failed: {e}")
-            return False
+        return self.send(self._control_plan(capability, value))
     
     def turn_on(self) -> bool:
         """Turn Govee device on"""
-        return self._make_control_request("turn", "on")
+        return self.send(self.compile_action("on", {}))
     
     def turn_off(self) -> bool:
         """Turn Govee device off"""
-        return self._make_control_request("turn", "off")
+        return self.send(self.compile_action("off", {}))
     
     def set_color(self, color: str) -> bool:
         """Set Govee color"""
         try:
-            # Convert hex to RGB
-            hex_color = color.lstrip("#")
-            r = int(hex_color[0:2], 16)
-            g = int(hex_color[2:4], 16)
-            b = int(hex_color[4:6], 16)
-            
-            # Govee expects RGB values
-            rgb_value = {"r": r, "g": g, "b": b}
-            return self._make_control_request("color", rgb_value)
-        except Exception as e:
-            print(f"[GOVEE ERROR] Failed to set color: {e}")
+            plan = self.compile_action("color", {"color": color})
+        except ValueError as e:
+            govee_log.error("Failed to set color: %s", e)
             return False
+        return self.send(plan)
     
     def set_brightness(self, brightness: int) -> bool:
         """Set Govee brightness (0-100)"""
-        brightness = max(0, min(100, brightness))  # Clamp to valid range
-        return self._make_control_request("brightness", brightness)
+        return self.send(self.compile_action("brightness", {"brightness": brightness}))
     
     def set_scene(self, scene_id: int) -> bool:
         """Set Govee scene"""
@@ -189,7 +804,7 @@ class GoveeController(LEDController):
             scene_code = scenes[scene_id].get("code", 0)
             return self._make_control_request("scene", scene_code)
         else:
-            print(f"[GOVEE ERROR] Invalid scene ID: {scene_id}")
+            govee_log.error("Invalid scene ID: %d", scene_id)
             return False
     
     def get_scenes(self) -> List[Dict]:
@@ -199,35 +814,34 @@ class GoveeController(LEDController):
         
         try:
             params = {"device": self.device_id, "model": self.model}
-            response = requests.get(f"{self.base_url}/scenes", 
-                                  params=params, headers=self.headers, timeout=10)
+            response = self._request("GET", f"{self.base_url}/scenes", 10,
+                                     params=params, headers=self.headers)
             if response.status_code == 200:
                 data = response.json()
                 self._scenes_cache = data.get("data", {}).get("scenes", [])
-                print(f"[GOVEE] Loaded {len(self._scenes_cache)} scenes")
+                govee_log.info("Loaded %d scenes", len(self._scenes_cache))
                 return self._scenes_cache
             else:
-                print(f"[GOVEE ERROR] Failed to get scenes: {response.status_code}")
+                govee_log.error("Failed to get scenes: %d", response.status_code)
                 return []
         except Exception as e:
-            print(f"[GOVEE ERROR] Failed to get scenes: {e}")
+            govee_log.error("Failed to get scenes: %s", e)
             return []
     
     def get_devices(self) -> List[Dict]:
         """Get available Govee devices"""
         try:
-            response = requests.get(f"{self.base_url}/devices", 
-                                  headers=self.headers, timeout=10)
+            response = self._request("GET", self.base_url, 10, headers=self.headers)
             if response.status_code == 200:
                 data = response.json()
                 devices = data.get("data", {}).get("devices", [])
-                print(f"[GOVEE] Found {len(devices)} devices")
+                govee_log.info("Found %d devices", len(devices))
                 return devices
             else:
-                print(f"[GOVEE ERROR] Failed to get devices: {response.status_code}")
+                govee_log.error("Failed to get devices: %d", response.status_code)
                 return []
         except Exception as e:
-            print(f"[GOVEE ERROR] Failed to get devices: {e}")
+            govee_log.error("Failed to get devices: %s", e)
             return []
     
     def test_connection(self) -> bool:
@@ -239,22 +853,22 @@ class GoveeController(LEDController):
                 if device.get("device") == self.device_id and device.get("model") == self.model:
                     return True
             return False
-        except:
+        except Exception:
             return False
     
     def get_status(self) -> Dict:
         """Get Govee device status"""
         try:
             params = {"device": self.device_id, "model": self.model}
-            response = requests.get(f"{self.base_url}/state", 
-                                  params=params, headers=self.headers, timeout=10)
+            response = self._request("GET", f"{self.base_url}/state", 10,
+                                     params=params, headers=self.headers)
             if response.status_code == 200:
                 return response.json().get("data", {})
             else:
-                print(f"[GOVEE ERROR] Failed to get status: {response.status_code}")
+                govee_log.error("Failed to get status: %d", response.status_code)
                 return {}
         except Exception as e:
-            print(f"[GOVEE ERROR] Failed to get status: {e}")
+            govee_log.error("Failed to get status: %s", e)
             return {}
 
 
@@ -266,34 +880,38 @@ class PhilipsHueController(LEDController):
         self.username = username
         self.base_url = f"http://{bridge_ip}/api/{username}"
     
+    @property
+    def device_key(self) -> str:
+        return f"hue:{self.bridge_ip}"
+    
     def turn_on(self) -> bool:
         """Turn Philips Hue lights on"""
         # TODO: Implement Philips Hue API calls
-        print("[HUE] Turn on - Not implemented yet")
+        hue_log.warning("Turn on - Not implemented yet")
         return False
     
     def turn_off(self) -> bool:
         """Turn Philips Hue lights off"""
         # TODO: Implement Philips Hue API calls
-        print("[HUE] Turn off - Not implemented yet")
+        hue_log.warning("Turn off - Not implemented yet")
         return False
     
     def set_color(self, color: str) -> bool:
         """Set Philips Hue color"""
         # TODO: Implement Philips Hue API calls
-        print(f"[HUE] Set color {color} - Not implemented yet")
+        hue_log.warning("Set color %s - Not implemented yet", color)
         return False
     
     def test_connection(self) -> bool:
         """Test Philips Hue connection"""
         # TODO: Implement Philips Hue API calls
-        print("[HUE] Test connection - Not implemented yet")
+        hue_log.warning("Test connection - Not implemented yet")
         return False
     
     def get_status(self) -> Dict:
         """Get Philips Hue status"""
         # TODO: Implement Philips Hue API calls
-        print("[HUE] Get status - Not implemented yet")
+        hue_log.warning("Get status - Not implemented yet")
         return {}
 
 
@@ -303,9 +921,23 @@ def create_led_controller(led_type: str, config: Dict) -> Optional[LEDController
     if led_type == "wled":
         ip = config.get("wled_ip", "")
         if not ip:
-            print("[ERROR] WLED IP not configured")
+            log.error("WLED IP not configured")
+            return None
+        return WLEDController(ip, parse_segment(config.get("wled_segment")),
+                              parse_led_range(config.get("wled_leds")))
+    
+    elif led_type == "wled_mqtt":
+        from mqtt_transport import WLEDMQTTController, link_for  # optional paho-mqtt
+        topic = config.get("wled_mqtt_topic", "")
+        link = link_for(config.get("mqtt"))
+        if not topic or link is None:
+            log.error("WLED MQTT topic or broker not configured")
             return None
-        return WLEDController(ip)
+        return WLEDMQTTController(link, topic)
+    
+    elif led_type in ("sacn", "artnet"):
+        from dmx import dmx_controller  # DMX over UDP: pixel controllers, stage fixtures
+        return dmx_controller(led_type, config)
     
     elif led_type == "govee":
         api_key = config.get("govee_api_key", "")
@@ -313,19 +945,20 @@ def create_led_controller(led_type: str, config: Dict) -> Optional[LEDController
         model = config.get("govee_model", "")
         
         if not all([api_key, device_id, model]):
-            print("[ERROR] Govee API key, device ID, or model not configured")
+            log.error("Govee API key, device ID, or model not configured")
             return None
-        return GoveeController(api_key, device_id, model)
+        return GoveeController(api_key, device_id, model,
+                               config.get("govee_api_url") or GoveeController.API_URL)
     
     elif led_type == "philips_hue":
         bridge_ip = config.get("hue_bridge_ip", "")
         username = config.get("hue_username", "")
         
         if not all([bridge_ip, username]):
-            print("[ERROR] Philips Hue bridge IP or username not configured")
+            log.error("Philips Hue bridge IP or username not configured")
             return None
         return PhilipsHueController(bridge_ip, username)
     
     else:
-        print(f"[ERROR] Unknown LED type: {led_type}")
+        log.error("Unknown LED type: %s", led_type)
         return None
\ No newline at end of file
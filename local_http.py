@@ -0,0 +1,166 @@
+"""
+Minimal HTTP/1.1 JSON server on asyncio streams
+
+Shared by the webhook and the control API. Both only exchange small JSON
+bodies with scripts on the LAN, so a few dozen lines on
+``asyncio.start_server`` replace a web framework. Connections are kept
+alive, so a client sending bursts pays for one TCP handshake.
+
+Subclasses implement ``_handle(method, path, headers, body, client)`` and
+return ``(status, answer)``; the answer is sent as JSON.
+"""
+
+import asyncio
+import hmac
+import json
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+
+from app_logging import get_logger, kv
+
+log = get_logger("http")
+
+MAX_BODY = 64 * 1024
+MAX_HEADER = 16 * 1024
+KEEP_ALIVE_TIMEOUT = 30.0  # seconds an idle connection stays open
+
+LOOPBACK = ("127.0.0.1", "::1", "localhost")
+
+REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error",
+           503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+def check_secret(headers: Dict[str, str], secret: str, header: str) -> bool:
+    """The secret from ``header`` or ``Authorization: Bearer``; anything goes without one"""
+    if not secret:
+        return True
+    given = headers.get(header)
+    if given is None and headers.get("authorization", "").startswith("Bearer "):
+        given = headers["authorization"][len("Bearer "):]
+    return given is not None and hmac.compare_digest(given.encode("utf-8"), secret.encode("utf-8"))
+
+
+def parse_object(body: bytes) -> Dict:
+    """A JSON object request body (ValueError otherwise); empty means {}"""
+    value = json.loads(body or b"{}")
+    if not isinstance(value, dict):
+        raise ValueError("expected a JSON object")
+    return value
+
+
+class JSONServer(ABC):
+    """Serves JSON requests on the current event loop until ``stop()``"""
+
+    name = "HTTP server"  # for the log
+    log = log
+
+    def __init__(self):
+        self.running = True
+        self._clients = set()  # connection handler tasks, closed with the server
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _attach(self):
+        """Remember the loop and task ``stop()`` cancels; call first thing in ``run()``"""
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+
+    async def serve(self, host: str, port: int) -> bool:
+        """Serve until ``stop()``; False when the port can't be opened"""
+        try:
+            server = await asyncio.start_server(self._serve, host, port, limit=MAX_HEADER)
+        except OSError as e:
+            self.log.error("%s could not listen on %s:%d: %s", self.name, host, port, e)
+            return False
+        self.log.info("%s listening", self.name, extra=kv(host=host, port=port))
+        try:
+            async with server:
+                await server.serve_forever()
+        except asyncio.CancelledError:
+            if self.running:
+                raise
+            self.log.info("%s stopped", self.name)
+        finally:
+            for task in self._clients:
+                task.cancel()
+        return True
+
+    def stop(self):
+        """Close the server now, from any thread"""
+        self.running = False
+        loop, task = self._loop, self._task
+        if loop is not None and task is not None:
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                pass  # the loop already finished
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info("peername")
+        client = peer[0] if peer else "?"
+        task = asyncio.current_task()
+        self._clients.add(task)
+        try:
+            while self.running:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, 413, {"error": "headers too large"}, keep_alive=False)
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, path, version = lines[0].split(" ", 2)
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "bad request line"}, keep_alive=False)
+                    return
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._respond(writer, 400, {"error": "bad Content-Length"}, keep_alive=False)
+                    return
+                if length > MAX_BODY:
+                    await self._respond(writer, 413, {"error": "body too large"}, keep_alive=False)
+                    return
+                body = await reader.readexactly(length) if length else b""
+
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+                try:
+                    status, answer = await self._handle(method, path.split("?", 1)[0], headers, body, client)
+                except Exception as e:
+                    self.log.exception("%s request failed", self.name, extra=kv(client=client, path=path))
+                    status, answer = 500, {"error": str(e)[:200]}
+                await self._respond(writer, status, answer, keep_alive)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            pass  # server stopped; the handler task ends here either way
+        finally:
+            self._clients.discard(task)
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, answer: Dict, keep_alive: bool):
+        body = json.dumps(answer).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                     f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+
+    @abstractmethod
+    async def _handle(self, method: str, path: str, headers: Dict[str, str], body: bytes,
+                      client: str) -> Tuple[int, Dict]:
+        """Answer one request with ``(status, answer)``"""
+        pass
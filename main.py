@@ -1,5 +1,8 @@
+import os
 import sys
-import time
+import argparse
+import signal
+import socket
 import threading
 import requests
 import json
@@ -10,14 +13,216 @@ from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                                QDialog, QTextEdit, QColorDialog, QMessageBox,
                                QTabWidget, QProgressBar, QToolTip, QComboBox,
                                QGroupBox, QScrollArea)
-from PySide6.QtCore import Qt, Signal, QThread, QTimer, QPropertyAnimation, QEasingCurve, QObject
+from PySide6.QtCore import (Qt, Signal, QThread, QTimer, QPropertyAnimation, QEasingCurve, QObject,
+                            QCoreApplication, QFileSystemWatcher, QSocketNotifier)
 from PySide6.QtGui import QFont, QColor, QIcon, QTextCursor
-from telegram import Bot
-from telegram.error import TelegramError
 import asyncio
-from led_controllers import create_led_controller, GoveeController
+from concurrent.futures import ThreadPoolExecutor
+from led_controllers import GoveeController, breaker_states
+from api import ControlAPI, pool_stats
+from app_logging import configure_logging, get_logger, kv
+from config_reload import diff_config, merge_progress
+from discovery import device_cache, discover_devices
+from dispatch import action_plans, claim_device, execute_action, target_of
+from history import alarm_history
+from journal import journal
+from metrics import pipeline_metrics, start_metrics_server
+from dmx import close_senders
+from mqtt_transport import close_links, event_publisher
+from profiler import profiler
+from rustplus import RustPlusIntake
+from scheduler import PriorityScheduler
+from telegram_intake import TelegramIntake
+from webhook import WebhookIntake
+from zones import zone_stats
+
+log = get_logger("telegram")
+app_log = get_logger("app")
 
 CONFIG_FILE = "config.json"
+CONFIG_ONLY_LED_TYPES = ("wled_mqtt", "sacn", "artnet")  # no settings page, shown under the WLED button
+
+# The config.json contents the running config corresponds to, so the file
+# watcher can tell the app's own writes from edits made elsewhere
+_config_text = None
+
+
+def save_config_file(config, keep_edits=False):
+    """Write config.json atomically; with keep_edits, skip the write while
+    an outside edit is waiting to be reloaded (it would be overwritten)"""
+    global _config_text
+    if keep_edits and _config_text is not None:
+        try:
+            with open(CONFIG_FILE, "r") as f:
+                if f.read() != _config_text:
+                    return False
+        except OSError:
+            pass
+    text = json.dumps(config, indent=4)
+    _config_text = text
+    with open(CONFIG_FILE + ".tmp", "w") as f:
+        f.write(text)
+    os.replace(CONFIG_FILE + ".tmp", CONFIG_FILE)
+    return True
+
+
+def load_config_file():
+    """Load config.json, migrating old formats or creating defaults"""
+    global _config_text
+    try:
+        with open(CONFIG_FILE, "r") as f:
+            _config_text = f.read()
+        config = json.loads(_config_text)
+        app_log.info("Loaded config from %s", CONFIG_FILE)
+        
+        # Migrate old config format to new format
+        if "led_type" not in config:
+            app_log.info("Migrating old config format...")
+            config["led_type"] = "wled"  # Default to WLED for existing users
+            
+            # Add new fields with defaults
+            new_fields = {
+                "scene": "0",
+                "brightness": "100",
+                "govee_api_key": "",
+                "govee_device_id": "",
+                "govee_model": "",
+                "hue_bridge_ip": "",
+                "hue_username": ""
+            }
+            
+            for field, default_value in new_fields.items():
+                if field not in config:
+                    config[field] = default_value
+            
+            # Save the migrated config
+            save_config_file(config)
+            app_log.info("Config migration completed!")
+            
+    except:
+        app_log.info("Config file not found. Creating default config...")
+        config = {
+            "led_type": "wled",  # "wled", "govee", or "philips_hue"
+            "action": "on",
+            "color": "#ffffff",
+            "effect": "0",
+            "preset": "0",
+            "scene": "0",  # For Govee scenes
+            "brightness": "100",  # For Govee/Hue
+            # WLED settings
+            "wled_ip": "192.168.1.50",
+            # Govee settings
+            "govee_api_key": "",
+            "govee_device_id": "",
+            "govee_model": "",
+            # Philips Hue settings (for future)
+            "hue_bridge_ip": "",
+            "hue_username": "",
+            # Telegram settings
+            "telegram_bot_token": "",
+            "telegram_chat_id": "",
+            "last_message_id": 0,
+            "polling_rate": 2,
+            # Alarms queued while the app was off: "skip", "replay" or "coalesce"
+            "catchup_policy": "skip",
+            "catchup_minutes": 5,
+            # Logging: DEBUG, INFO, WARNING or ERROR
+            "log_level": "INFO",
+            # Prometheus /metrics port (0 = disabled)
+            "metrics_port": 0,
+            # Drop LED commands for alarms older than this (seconds, 0 = never)
+            "alarm_max_age": 5,
+            # Event history database ("" = off) and its size limit
+            "journal_path": "journal.db",
+            "journal_max_mb": 50
+        }
+        save_config_file(config)
+        app_log.info("Created default config file: %s", CONFIG_FILE)
+    return config
+
+
+def open_journal(config):
+    """Start the event journal unless journal_path is empty"""
+    path = config.get("journal_path", "journal.db")
+    if not path:
+        return
+    try:
+        journal.open(path, int(config.get("journal_max_mb", 50)) * 1024 * 1024)
+    except Exception as e:
+        app_log.error("Could not open event journal %s: %s", path, e)
+
+
+def reload_config(current, new, worker, restart_worker):
+    """Apply an edited config.json in place of ``current``.
+
+    Returns the config now in effect, or None if nothing relevant changed.
+    The Telegram and Rust+ connections are only rebuilt
+    (``restart_worker(config)``) when bot tokens, the API URL, the Rust+
+    server settings or the webhook address change.
+    """
+    new = merge_progress(current, new)
+    change = diff_config(current, new)
+    if not change.keys:
+        return None
+    app_log.info("Reloading config.json", extra=kv(changed=",".join(sorted(change.keys))))
+    action_plans.invalidate()
+    action_plans.get(new)
+    configure_logging(new.get("log_level"))
+    if "mqtt" in change.keys:
+        event_publisher.configure(new)
+    if change.reconnect or not worker or not worker.apply_config(new):
+        app_log.info("Connection settings changed, reconnecting...")
+        restart_worker(new)
+    for key in change.restart_keys:
+        app_log.warning("%s changed, restart the app to apply it", key)
+    return new
+
+
+class ConfigWatcher(QObject):
+    """Emits ``changed(config)`` when config.json is edited outside the app"""
+    changed = Signal(dict)
+    
+    def __init__(self, path, parent=None):
+        super().__init__(parent)
+        self.path = os.path.abspath(path)
+        self._watcher = QFileSystemWatcher(self)
+        # The directory too: editors (and save_config_file) replace the file,
+        # which ends the watch on it
+        self._watcher.addPath(os.path.dirname(self.path))
+        if os.path.exists(self.path):
+            self._watcher.addPath(self.path)
+        self._watcher.fileChanged.connect(self._schedule)
+        self._watcher.directoryChanged.connect(self._schedule)
+        # Editors write in several steps; read once things settle
+        self._debounce = QTimer(self)
+        self._debounce.setSingleShot(True)
+        self._debounce.setInterval(150)
+        self._debounce.timeout.connect(self.reload)
+    
+    def _schedule(self, path):
+        self._debounce.start()
+    
+    def reload(self):
+        """Read config.json now; emits ``changed`` if it differs from the running config"""
+        global _config_text
+        if self.path not in self._watcher.files() and os.path.exists(self.path):
+            self._watcher.addPath(self.path)
+        try:
+            with open(self.path, "r") as f:
+                text = f.read()
+        except OSError:
+            return
+        if text == _config_text:
+            return  # our own write, or nothing new
+        try:
+            config = json.loads(text)
+        except ValueError as e:
+            app_log.warning("config.json is not valid JSON, keeping the current settings: %s", e)
+            return
+        if isinstance(config, dict):
+            _config_text = text
+            self.changed.emit(config)
+
 
 class EmittingStream(QObject):
     """Stream that emits signals for GUI logging"""
@@ -30,171 +235,149 @@ class EmittingStream(QObject):
     def flush(self):
         pass
 
+class ControllerExecutor(QObject):
+    """Runs controller I/O on background threads and hands results back on the GUI thread"""
+    _finished = Signal(object, object)  # callback, future
+    
+    def __init__(self, max_workers=1, name="led-io", parent=None):
+        super().__init__(parent)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        # Emitted from pool threads, so Qt queues the call onto this object's (GUI) thread
+        self._finished.connect(self._deliver)
+    
+    def submit(self, fn, *args, on_done=None):
+        """Run fn(*args) in the pool; on_done(future) is later called on the GUI thread"""
+        future = self._pool.submit(fn, *args)
+        if on_done:
+            future.add_done_callback(lambda f: self._finished.emit(on_done, f))
+        return future
+    
+    def _deliver(self, callback, future):
+        callback(future)
+    
+    def stats(self):
+        return pool_stats(self._pool)
+    
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
 class TelegramWorker(QThread):
-    """Worker thread for polling Telegram"""
+    """Worker thread hosting the asyncio loop that polls every configured bot
+    and, when configured, listens to the Rust+ server and serves the webhook
+    and the control API"""
     status_update = Signal(str, str)  # message, color
-    log_message = Signal(str)  # for logging to GUI
+    reload_requested = Signal()  # the API asked to re-read config.json
+    progress_pending = Signal()  # handled messages to save, on the GUI thread
+    
+    PROGRESS_SAVE_DELAY = 500  # ms: a burst of messages costs one write
     
     def __init__(self, config):
         super().__init__()
         self.config = config
         self.running = True
+        self._progress = {}  # chat id -> last handled message id, not saved yet
+        self._progress_lock = threading.Lock()
+        # This object lives on the GUI thread, so the signal queues the
+        # write there: config.json has one writer
+        self._progress_timer = QTimer(self)
+        self._progress_timer.setSingleShot(True)
+        self._progress_timer.setInterval(self.PROGRESS_SAVE_DELAY)
+        self._progress_timer.timeout.connect(self.write_progress)
+        self.progress_pending.connect(self._schedule_progress)
         self.trigger_callback = None
+        self.action_runner = None  # config -> future of an ActionResult, for the API
+        self.stats_callback = None  # () -> queue stats, for the API
+        self.intake = None
+        self.rustplus = None
+        self.webhook = None
+        self.api = None
         
     def run(self):
-        self.log_message.emit("[TELEGRAM] Starting Telegram bot connection...")
-        self.status_update.emit("Connecting to Telegram...", "orange")
-        
-        bot_token = self.config.get("telegram_bot_token", "")
-        chat_id = self.config.get("telegram_chat_id", "")
-        
-        if not bot_token or not chat_id:
-            error_msg = "ERROR: Telegram bot token or chat ID not set!"
-            self.log_message.emit(f"[TELEGRAM] {error_msg}")
-            self.status_update.emit(error_msg, "red")
-            return
-        
-        # Validate bot token format
-        if ":" not in bot_token or len(bot_token.split(":")) != 2:
-            error_msg = "ERROR: Invalid bot token format! Should be like: 123456789:ABCdefGHI..."
-            self.log_message.emit(f"[TELEGRAM] {error_msg}")
-            self.status_update.emit(error_msg, "red")
-            return
-        
-        # Create one event loop for this thread and keep it alive
+        # One event loop for all bots and chats
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         
+        self.intake = TelegramIntake(self.config, self._on_event,
+                                     on_status=self.status_update.emit,
+                                     on_progress=self._note_progress)
+        self.rustplus = RustPlusIntake(self.config, self._on_event, on_status=self.status_update.emit)
+        self.webhook = WebhookIntake(self.config, self._on_event, on_status=self.status_update.emit)
+        self.api = ControlAPI(self.config, self._on_event, run_action=self.action_runner, status=self.health,
+                              reload=self.reload_requested.emit, on_status=self.status_update.emit)
+        self.intake.running = self.rustplus.running = self.webhook.running = self.api.running = self.running
         try:
-            print(f"[TELEGRAM] Connecting to bot...")
-            print(f"[TELEGRAM] Bot token: {bot_token[:10]}...{bot_token[-10:]}")
-            print(f"[TELEGRAM] Chat ID: {chat_id}")
-            
-            # Create bot with custom timeout
-            from telegram.request import HTTPXRequest
-            request = HTTPXRequest(connection_pool_size=1, connect_timeout=30, read_timeout=30)
-            bot = Bot(token=bot_token, request=request)
-            
-            # Test connection with timeout
-            print("[TELEGRAM] Testing bot connection (30s timeout)...")
-            bot_info = asyncio.wait_for(bot.get_me(), timeout=30.0)
-            bot_info = loop.run_until_complete(bot_info)
-            print(f"[TELEGRAM] ✓ Connected as @{bot_info.username} ({bot_info.first_name})")
-            self.status_update.emit(f"✓ Connected as @{bot_info.username}! Waiting for messages...", "green")
-                
-        except asyncio.TimeoutError:
-            error_msg = "ERROR: Connection timed out! Check your internet connection."
-            self.log_message.emit(f"[TELEGRAM] {error_msg}")
-            self.status_update.emit(error_msg, "red")
-            return
-        except TelegramError as e:
-            if "Unauthorized" in str(e):
-                error_msg = "ERROR: Invalid bot token! Check your bot token."
-            elif "Not Found" in str(e):
-                error_msg = "ERROR: Bot not found! Check your bot token."
-            elif "Forbidden" in str(e):
-                error_msg = "ERROR: Bot access forbidden! Make sure bot is active."
-            else:
-                error_msg = f"Telegram error: {str(e)}"
-            self.log_message.emit(f"[TELEGRAM] {error_msg}")
-            self.status_update.emit(error_msg, "red")
-            return
-        except Exception as e:
-            error_msg = f"Connection failed: {str(e)}"
-            self.log_message.emit(f"[TELEGRAM] {error_msg}")
-            self.status_update.emit(error_msg, "red")
+            loop.run_until_complete(asyncio.gather(self.intake.run(), self.rustplus.run(), self.webhook.run(),
+                                                   self.api.run()))
+        finally:
+            # Clean up the event loop when done
+            loop.close()
+    
+    def _on_event(self, event):
+        if self.trigger_callback:
+            self.trigger_callback(event)
+    
+    def health(self):
+        """Intake and queue state for the API's /status"""
+        health = {
+            "telegram": {"running": self.intake.running, "bots": [spec.name for spec in self.intake.specs]},
+            "rustplus": {"configured": self.rustplus.settings is not None},
+            "webhook": {"configured": self.webhook.settings is not None},
+        }
+        if self.stats_callback:
+            health.update(self.stats_callback())
+        return health
+    
+    def _note_progress(self, chat_id, message_id):
+        """Remember the last handled message per chat (polling thread)"""
+        with self._progress_lock:
+            first = not self._progress
+            self._progress[chat_id] = message_id
+        if first:
+            self.progress_pending.emit()
+    
+    def _schedule_progress(self):
+        if not self._progress_timer.isActive():
+            self._progress_timer.start()
+    
+    def write_progress(self, config=None):
+        """Persist the noted progress so restarts don't replay it (GUI thread).
+        
+        ``config`` is the one to save it in when a new worker takes over.
+        """
+        config = self.config if config is None else config
+        with self._progress_lock:
+            progress, self._progress = self._progress, {}
+        if not progress:
             return
-
-        self.log_message.emit(f"[TELEGRAM] Starting polling loop (every {self.config.get('polling_rate', 2)} seconds...)")
-        last_update_id = 0
-        
-        while self.running:
-            try:
-                # Use the same event loop throughout with timeout and offset
-                get_updates_params = {"timeout": 5, "offset": last_update_id + 1 if last_update_id > 0 else None}
-                get_updates_task = asyncio.wait_for(bot.get_updates(**get_updates_params), timeout=10.0)
-                updates = loop.run_until_complete(get_updates_task)
-                
-                print(f"[TELEGRAM] Received {len(updates)} updates")
-                
-                # Process all updates
-                for update in updates:
-                    last_update_id = update.update_id
-                    print(f"[TELEGRAM] Processing update ID: {update.update_id}")
-                    
-                    # Check for regular messages
-                    if update.message:
-                        message_chat_id = str(update.message.chat_id)
-                        message_id = update.message.message_id
-                        message_text = update.message.text or ""
-                        
-                        print(f"[TELEGRAM] Message from chat {message_chat_id}, expected {chat_id}")
-                        print(f"[TELEGRAM] Message text: '{message_text}'")
-                        
-                        if message_chat_id == str(chat_id):
-                            if message_id > self.config.get("last_message_id", 0):
-                                print(f"[TELEGRAM] ✓ New message detected! ID: {message_id}")
-                                
-                                if self.trigger_callback:
-                                    self.trigger_callback()
-                                
-                                self.config["last_message_id"] = message_id
-                                with open(CONFIG_FILE, "w") as f:
-                                    json.dump(self.config, f, indent=4)
-                                print(f"[TELEGRAM] Updated last_message_id to {message_id}")
-                            else:
-                                print(f"[TELEGRAM] Message ID {message_id} already processed (last: {self.config.get('last_message_id', 0)})")
-                        else:
-                            print(f"[TELEGRAM] Ignoring message from different chat: {message_chat_id}")
-                    
-                    # Check for channel posts
-                    elif update.channel_post:
-                        post_chat_id = str(update.channel_post.chat_id)
-                        post_id = update.channel_post.message_id
-                        post_text = update.channel_post.text or ""
-                        
-                        print(f"[TELEGRAM] Channel post from chat {post_chat_id}, expected {chat_id}")
-                        print(f"[TELEGRAM] Post text: '{post_text}'")
-                        
-                        if post_chat_id == str(chat_id):
-                            if post_id > self.config.get("last_message_id", 0):
-                                print(f"[TELEGRAM] ✓ New channel post detected! ID: {post_id}")
-                                
-                                if self.trigger_callback:
-                                    self.trigger_callback()
-                                
-                                self.config["last_message_id"] = post_id
-                                with open(CONFIG_FILE, "w") as f:
-                                    json.dump(self.config, f, indent=4)
-                                print(f"[TELEGRAM] Updated last_message_id to {post_id}")
-                            else:
-                                print(f"[TELEGRAM] Post ID {post_id} already processed (last: {self.config.get('last_message_id', 0)})")
-                        else:
-                            print(f"[TELEGRAM] Ignoring post from different channel: {post_chat_id}")
-                    
-                    else:
-                        print(f"[TELEGRAM] Update type not handled: {type(update)}")
-
-            except asyncio.TimeoutError:
-                print("[TELEGRAM] Polling timeout (normal, continuing...)")
-            except Exception as e:
-                print(f"[ERROR] Failed to poll Telegram: {str(e)}")
-                self.status_update.emit(f"Error polling: {str(e)[:50]}", "red")
-
-            # Use configurable polling rate with interruptible sleep
-            sleep_time = self.config.get("polling_rate", 2)
-            for i in range(sleep_time * 10):  # Check every 0.1 seconds
-                if not self.running:
-                    break
-                time.sleep(0.1)
-        
-        # Clean up the event loop when done
-        loop.close()
+        for chat_id, message_id in progress.items():
+            config.setdefault("last_message_ids", {})[chat_id] = message_id
+            if chat_id == str(config.get("telegram_chat_id", "")):
+                config["last_message_id"] = message_id
+        save_config_file(config, keep_edits=True)
+    
+    def apply_config(self, config):
+        """Switch to an edited config without reconnecting; False if that's not possible"""
+        self.config = config
+        if self.rustplus and not self.rustplus.apply_config(config):
+            return False
+        if self.webhook and not self.webhook.apply_config(config):
+            return False
+        if self.api and not self.api.apply_config(config):
+            return False
+        return self.intake.apply_config(config) if self.intake else True
     
     def stop(self):
+        """Cancel polling; run() returns as soon as the loop sees it"""
         self.running = False
-        # Force quit to avoid waiting for sleep
-        self.quit()
+        if self.intake:
+            self.intake.stop()
+        if self.rustplus:
+            self.rustplus.stop()
+        if self.webhook:
+            self.webhook.stop()
+        if self.api:
+            self.api.stop()
 
 
 class SetupDialog(QDialog):
@@ -299,11 +482,24 @@ control your WLED lights automatically!
 
 
 class RustWLEDApp(QMainWindow):
-    def __init__(self):
+    def __init__(self, metrics_port=None):
         super().__init__()
         self.load_config()
+        configure_logging(self.config.get("log_level"))
+        open_journal(self.config)
+        event_publisher.configure(self.config)
         self.telegram_worker = None
+        # Alarms run side by side: a newer alarm for the same device (or
+        # segment) supersedes older ones, and concurrent segment updates for
+        # one strip are merged into one request. Device lookups get their own
+        # pool so they never queue behind an alarm
+        self.led_executor = ControllerExecutor(max_workers=4, name="led-action", parent=self)
+        # Rule priorities decide which alarm a device shows when they overlap
+        self.scheduler = PriorityScheduler(self.dispatch_action, target_of)
+        self.lookup_executor = ControllerExecutor(max_workers=2, name="led-lookup", parent=self)
         self.current_color = QColor(self.config["color"])
+        self.discovered_wled_mac = None  # picked in the Discover dialog, saved with the settings
+        self.shown_wled_ip = None  # what the app put in the IP field; anything else was typed
         self.last_log_message = ""
         self.duplicate_count = 0
         
@@ -449,8 +645,18 @@ class RustWLEDApp(QMainWindow):
         
         self.init_ui()
         self.setup_logging()
+        
+        # Hand edits to config.json apply without a restart
+        self.config_watcher = ConfigWatcher(CONFIG_FILE, parent=self)
+        self.config_watcher.changed.connect(self.on_config_file_changed)
         self.start_telegram_worker()
         
+        self.metrics_server = None
+        if metrics_port is None:
+            metrics_port = int(self.config.get("metrics_port", 0))
+        if metrics_port:
+            self.metrics_server = start_metrics_server(metrics_port)
+        
     def init_ui(self):
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -512,6 +718,8 @@ class RustWLEDApp(QMainWindow):
         self.create_main_tab()
         self.create_settings_tab()
         self.create_logs_tab()
+        self.create_metrics_tab()
+        self.create_history_tab()
         
         # Connect LED type change to update action visibility (after both tabs are created)
         self.led_type_group.buttonClicked.connect(self.update_action_visibility)
@@ -804,7 +1012,7 @@ class RustWLEDApp(QMainWindow):
             led_type_layout.addWidget(radio)
         
         # Set current LED type
-        led_type_map = {"wled": 0, "govee": 1, "philips_hue": 2}
+        led_type_map = {"wled": 0, "govee": 1, "philips_hue": 2}  # anything else shows as WLED
         current_type = led_type_map.get(self.config.get("led_type", "wled"), 0)
         self.led_type_group.button(current_type).setChecked(True)
         
@@ -825,12 +1033,36 @@ class RustWLEDApp(QMainWindow):
         wled_ip_label.setMinimumWidth(130)
         wled_ip_label.setStyleSheet("color: #ffffff; padding: 5px;")
         self.ip_entry = QLineEdit(self.config.get("wled_ip", "192.168.1.50"))
+        self.shown_wled_ip = self.ip_entry.text()
         self.ip_entry.setFont(QFont("Arial", 13))
         self.ip_entry.setPlaceholderText("192.168.1.100")
         self.ip_entry.setToolTip("Enter the IP address of your WLED device")
         wled_ip_layout.addWidget(wled_ip_label)
         wled_ip_layout.addWidget(self.ip_entry)
         
+        # Discover button: mDNS + subnet sweep
+        discover_btn = QPushButton("🔍 Discover")
+        discover_btn.setFont(QFont("Arial", 12, QFont.Bold))
+        discover_btn.setToolTip("Search the local network for WLED devices")
+        discover_btn.setStyleSheet("""
+            QPushButton {
+                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
+                                           stop: 0 #9c27b0, stop: 1 #7b1fa2);
+                color: white;
+                border-radius: 8px;
+                font-weight: bold;
+                padding: 8px 16px;
+                border: 2px solid transparent;
+            }
+            QPushButton:hover {
+                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
+                                           stop: 0 #ba68c8, stop: 1 #9c27b0);
+                border: 2px solid #ce93d8;
+            }
+        """)
+        discover_btn.clicked.connect(self.discover_wled_devices)
+        wled_ip_layout.addWidget(discover_btn)
+        
         wled_layout.addLayout(wled_ip_layout)
         self.wled_group.setLayout(wled_layout)
         layout.addWidget(self.wled_group)
@@ -992,7 +1224,8 @@ class RustWLEDApp(QMainWindow):
         self.polling_spin.setValue(int(self.config.get("polling_rate", 2)))
         self.polling_spin.setFont(QFont("Arial", 14))
         self.polling_spin.setSuffix(" sec")
-        self.polling_spin.setToolTip("How often to check for new messages (1-30 seconds)")
+        self.polling_spin.setToolTip("Messages arrive instantly (long polling); this is the wait\n"
+                                     "before retrying after a failed poll (1-30 seconds)")
         polling_layout.addWidget(polling_label)
         polling_layout.addWidget(self.polling_spin)
         polling_layout.addStretch()
@@ -1081,6 +1314,171 @@ class RustWLEDApp(QMainWindow):
         logs_tab.setLayout(layout)
         self.tab_widget.addTab(logs_tab, "📜 Logs")
     
+    def create_metrics_tab(self):
+        """Create the latency metrics tab"""
+        metrics_tab = QWidget()
+        layout = QVBoxLayout()
+        layout.setSpacing(15)
+        layout.setContentsMargins(20, 20, 20, 20)
+        
+        # Title
+        title = QLabel("📊 Alarm Latency")
+        title.setFont(QFont("Arial", 16, QFont.Bold))
+        title.setStyleSheet("color: #ffffff; margin-bottom: 10px;")
+        layout.addWidget(title)
+        
+        # Report text area
+        self.metrics_text = QTextEdit()
+        self.metrics_text.setReadOnly(True)
+        self.metrics_text.setStyleSheet(self.logs_text.styleSheet())
+        layout.addWidget(self.metrics_text)
+        
+        # Reset metrics button
+        reset_btn = QPushButton("🔄 Reset Metrics")
+        reset_btn.setFixedHeight(40)
+        reset_btn.setStyleSheet("""
+            QPushButton {
+                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
+                                           stop: 0 #2196f3, stop: 1 #1976d2);
+                color: white;
+                border-radius: 8px;
+                font-size: 11pt;
+                font-weight: bold;
+                border: 2px solid transparent;
+            }
+            QPushButton:hover {
+                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
+                                           stop: 0 #42a5f5, stop: 1 #1e88e5);
+                border: 2px solid #64b5f6;
+            }
+        """)
+        reset_btn.clicked.connect(self.reset_metrics)
+        
+        # Sampling profiler, for when alarms get slow
+        self.profile_btn = QPushButton()
+        self.profile_btn.setFixedHeight(40)
+        self.profile_btn.setStyleSheet(reset_btn.styleSheet())
+        self.profile_btn.clicked.connect(self.toggle_profiling)
+        self.show_profiling_state()
+        
+        buttons = QHBoxLayout()
+        buttons.addWidget(reset_btn)
+        buttons.addWidget(self.profile_btn)
+        layout.addLayout(buttons)
+        
+        metrics_tab.setLayout(layout)
+        self.tab_widget.addTab(metrics_tab, "📊 Metrics")
+        
+        # Refresh once a second, only while the tab is visible
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.timeout.connect(self.refresh_metrics)
+        self.metrics_timer.start(1000)
+        self.refresh_metrics()
+    
+    def create_history_tab(self):
+        """Create the alarm history tab (fed by the event journal)"""
+        history_tab = QWidget()
+        layout = QVBoxLayout()
+        layout.setSpacing(15)
+        layout.setContentsMargins(20, 20, 20, 20)
+        
+        # Title
+        title = QLabel("📈 Alarm History")
+        title.setFont(QFont("Arial", 16, QFont.Bold))
+        title.setStyleSheet("color: #ffffff; margin-bottom: 10px;")
+        layout.addWidget(title)
+        
+        # Report text area
+        self.history_text = QTextEdit()
+        self.history_text.setReadOnly(True)
+        self.history_text.setStyleSheet(self.logs_text.styleSheet())
+        self.history_text.setPlainText("Loading history..." if journal.enabled
+                                       else "Event journal is off (set \"journal_path\" in config.json)")
+        layout.addWidget(self.history_text)
+        
+        history_tab.setLayout(layout)
+        self.tab_widget.addTab(history_tab, "📈 History")
+        
+        # Refresh every few seconds while the tab is visible; the journal is
+        # read on the lookup pool so the GUI thread never waits on the disk
+        self.history_pending = False
+        self.history_timer = QTimer(self)
+        self.history_timer.timeout.connect(self.refresh_history)
+        self.history_timer.start(5000)
+        self.tab_widget.currentChanged.connect(lambda index: self.refresh_history())
+    
+    def refresh_history(self):
+        """Re-read new journal rollup rows in the background and redraw"""
+        if not journal.enabled or self.history_pending or not self.history_text.isVisible():
+            return
+        self.history_pending = True
+        self.lookup_executor.submit(alarm_history.report, on_done=self.show_history)
+    
+    def show_history(self, future):
+        self.history_pending = False
+        if future.cancelled():
+            return
+        if future.exception():
+            self.history_text.setPlainText(f"❌ Could not read history: {future.exception()}")
+            return
+        # Keep the scroll position across refreshes
+        scroll = self.history_text.verticalScrollBar().value()
+        self.history_text.setPlainText(future.result())
+        self.history_text.verticalScrollBar().setValue(scroll)
+    
+    def refresh_metrics(self):
+        """Redraw the metrics report"""
+        if self.metrics_text.isVisible() or not self.metrics_text.toPlainText():
+            self.metrics_text.setPlainText(self.render_metrics_report())
+    
+    def reset_metrics(self):
+        """Clear all latency histograms and device counters"""
+        pipeline_metrics.reset()
+        zone_stats.reset()
+        self.metrics_text.setPlainText(self.render_metrics_report())
+    
+    def toggle_profiling(self):
+        """Start a profiling session, or stop it and write the flame graph files"""
+        if not profiler.running:
+            profiler.start()
+            self.update_status("🔬 Profiling... press Stop Profiling after the slow alarms", "blue")
+            self.show_profiling_state()
+            return
+        # Writing the session touches the disk: off the GUI thread
+        self.profile_btn.setEnabled(False)
+        self.lookup_executor.submit(profiler.stop, on_done=self.profiling_saved)
+    
+    def profiling_saved(self, future):
+        self.profile_btn.setEnabled(True)
+        self.show_profiling_state()
+        path = None if future.cancelled() or future.exception() else future.result()
+        if not path:
+            self.update_status("❌ Could not write the profile", "red")
+            return
+        self.update_status(f"✓ Profile saved to {path}", "green")
+        with open(os.path.join(path, "summary.txt"), "r", encoding="utf-8") as f:
+            summary = f.read()
+        QMessageBox.information(self, "Profile Saved",
+                                f"{summary}\nOpen the .folded files in {os.path.abspath(path)} "
+                                f"with speedscope.app or flamegraph.pl.")
+    
+    def show_profiling_state(self):
+        self.profile_btn.setText("⏹ Stop Profiling" if profiler.running else "🔬 Start Profiling")
+    
+    def render_metrics_report(self):
+        """Latency report, circuit breaker state of every device and zone skew"""
+        icons = {"closed": "🟢", "half-open": "🟡", "open": "🔴"}
+        lines = [pipeline_metrics.render_text(), "", f"{'Circuit':<36}{'State':>12}{'Failures':>10}{'Retry':>8}"]
+        states = breaker_states()
+        if not states:
+            lines.append("(no devices contacted yet)")
+        for device, state in states.items():
+            retry = f"{state['retry_in']:.0f}s" if state["state"] == "open" else "-"
+            lines.append(f"{device:<36}{icons.get(state['state'], '')} {state['state']:>9}"
+                         f"{state['failures']:>10}{retry:>8}")
+        lines += ["", zone_stats.render_text()]
+        return "\n".join(lines)
+    
     def setup_logging(self):
         """Setup logging to redirect stdout to the logs tab"""
         self.log_stream = EmittingStream()
@@ -1220,11 +1618,28 @@ class RustWLEDApp(QMainWindow):
                               "Please enter your Govee API key first.")
             return
         
+        # Show a busy state while the cloud lookup runs in the background
+        sender = self.sender()
+        original_text = sender.text() if sender else ""
+        if sender:
+            sender.setText("🔄 Loading...")
+            sender.setEnabled(False)
+        
+        def finished(future):
+            if sender:
+                sender.setText(original_text)
+                sender.setEnabled(True)
+            if not future.cancelled():
+                self.show_govee_devices(future)
+        
+        # Create a temporary Govee controller to get devices
+        temp_controller = GoveeController(api_key, "", "")
+        self.lookup_executor.submit(temp_controller.get_devices, on_done=finished)
+    
+    def show_govee_devices(self, future):
+        """Display the result of a Govee device lookup (GUI thread)"""
         try:
-            # Create a temporary Govee controller to get devices
-            from led_controllers import GoveeController
-            temp_controller = GoveeController(api_key, "", "")
-            devices = temp_controller.get_devices()
+            devices = future.result()
             
             if not devices:
                 QMessageBox.information(self, "No Devices", 
@@ -1281,6 +1696,89 @@ class RustWLEDApp(QMainWindow):
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to get Govee devices: {str(e)}")
     
+    def discover_wled_devices(self):
+        """Search the network for WLED devices in the background"""
+        sender = self.sender()
+        original_text = sender.text() if sender else ""
+        if sender:
+            sender.setText("🔄 Searching...")
+            sender.setEnabled(False)
+        
+        def finished(future):
+            if sender:
+                sender.setText(original_text)
+                sender.setEnabled(True)
+            if not future.cancelled():
+                self.show_wled_devices(future)
+        
+        self.lookup_executor.submit(discover_devices, on_done=finished)
+    
+    def show_wled_devices(self, future):
+        """Display the result of a WLED discovery (GUI thread)"""
+        try:
+            devices = future.result()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"WLED discovery failed: {str(e)}")
+            return
+        
+        if not devices:
+            QMessageBox.information(self, "No Devices",
+                                  "No WLED devices found. Make sure they are on the same network.")
+            return
+        
+        dialog = QDialog(self)
+        dialog.setWindowTitle("WLED Devices")
+        dialog.setFixedSize(600, 400)
+        
+        layout = QVBoxLayout()
+        
+        info_label = QLabel("Select a device to use it for alarms:")
+        info_label.setFont(QFont("Arial", 12, QFont.Bold))
+        layout.addWidget(info_label)
+        
+        device_list = QTextEdit()
+        device_list.setReadOnly(True)
+        device_list.setFont(QFont("Consolas", 10))
+        
+        device_text = ""
+        for i, device in enumerate(devices):
+            device_text += f"Device {i+1}:\n"
+            device_text += f"  Name: {device.name}\n"
+            device_text += f"  IP: {device.ip}\n"
+            device_text += f"  MAC: {device.mac}\n"
+            device_text += f"  LEDs: {device.led_count}\n"
+            device_text += f"  Version: {device.version}\n"
+            device_text += "\n"
+        
+        device_list.setPlainText(device_text)
+        layout.addWidget(device_list)
+        
+        button_layout = QHBoxLayout()
+        for i, device in enumerate(devices):
+            btn = QPushButton(f"Use Device {i+1}")
+            btn.clicked.connect(lambda checked, dev=device: self.select_wled_device(dev, dialog))
+            button_layout.addWidget(btn)
+        
+        close_btn = QPushButton("Close")
+        close_btn.clicked.connect(dialog.accept)
+        button_layout.addWidget(close_btn)
+        
+        layout.addLayout(button_layout)
+        dialog.setLayout(layout)
+        dialog.exec()
+    
+    def select_wled_device(self, device, dialog):
+        """Use a discovered WLED device; its MAC lets later IP changes be followed"""
+        self.ip_entry.setText(device.ip)
+        self.shown_wled_ip = device.ip
+        self.discovered_wled_mac = device.mac
+        dialog.accept()
+        
+        QMessageBox.information(self, "Device Selected",
+                              f"Selected: {device.name}\n"
+                              f"IP: {device.ip}\n\n"
+                              "Click Save Settings to keep it.")
+    
     def select_govee_device(self, device, dialog):
         """Select and populate a Govee device"""
         self.govee_device_id_entry.setText(device.get('device', ''))
@@ -1294,76 +1792,75 @@ class RustWLEDApp(QMainWindow):
     
     
     def load_config(self):
-        try:
-            with open(CONFIG_FILE, "r") as f:
-                self.config = json.load(f)
-            print(f"[INFO] Loaded config from {CONFIG_FILE}")
-            
-            # Migrate old config format to new format
-            if "led_type" not in self.config:
-                print("[INFO] Migrating old config format...")
-                self.config["led_type"] = "wled"  # Default to WLED for existing users
-                
-                # Add new fields with defaults
-                new_fields = {
-                    "scene": "0",
-                    "brightness": "100",
-                    "govee_api_key": "",
-                    "govee_device_id": "",
-                    "govee_model": "",
-                    "hue_bridge_ip": "",
-                    "hue_username": ""
-                }
-                
-                for field, default_value in new_fields.items():
-                    if field not in self.config:
-                        self.config[field] = default_value
-                
-                # Save the migrated config
-                with open(CONFIG_FILE, "w") as f:
-                    json.dump(self.config, f, indent=4)
-                print("[INFO] Config migration completed!")
-                
-        except:
-            print(f"[INFO] Config file not found. Creating default config...")
-            self.config = {
-                "led_type": "wled",  # "wled", "govee", or "philips_hue"
-                "action": "on",
-                "color": "#ffffff",
-                "effect": "0",
-                "preset": "0",
-                "scene": "0",  # For Govee scenes
-                "brightness": "100",  # For Govee/Hue
-                # WLED settings
-                "wled_ip": "192.168.1.50",
-                # Govee settings
-                "govee_api_key": "",
-                "govee_device_id": "",
-                "govee_model": "",
-                # Philips Hue settings (for future)
-                "hue_bridge_ip": "",
-                "hue_username": "",
-                # Telegram settings
-                "telegram_bot_token": "",
-                "telegram_chat_id": "",
-                "last_message_id": 0,
-                "polling_rate": 2
-            }
-            with open(CONFIG_FILE, "w") as f:
-                json.dump(self.config, f, indent=4)
-            print(f"[INFO] Created default config file: {CONFIG_FILE}")
+        self.config = load_config_file()
+        action_plans.invalidate()
+        action_plans.get(self.config)  # compile now so the first alarm only sends
+    
+    def on_config_file_changed(self, config):
+        """config.json was edited elsewhere: apply it and update the settings fields"""
+        def restart(new_config):
+            self.config = new_config
+            self.restart_telegram_worker()
+        
+        applied = reload_config(self.config, config, self.telegram_worker, restart)
+        if applied is None:
+            return
+        self.config = applied
+        self.populate_settings()
+        self.update_status("✓ Settings reloaded from config.json", "green")
+    
+    def populate_settings(self):
+        """Show the current config in the Control and Settings fields"""
+        led_type_map = {"wled": 0, "govee": 1, "philips_hue": 2}  # anything else shows as WLED
+        self.led_type_group.button(led_type_map.get(self.config.get("led_type", "wled"), 0)).setChecked(True)
+        self.ip_entry.setText(self.config.get("wled_ip", ""))
+        self.shown_wled_ip = self.ip_entry.text()
+        self.govee_api_key_entry.setText(self.config.get("govee_api_key", ""))
+        self.govee_device_id_entry.setText(self.config.get("govee_device_id", ""))
+        self.govee_model_entry.setText(self.config.get("govee_model", ""))
+        self.bot_token_entry.setText(self.config.get("telegram_bot_token", ""))
+        self.chat_id_entry.setText(self.config.get("telegram_chat_id", ""))
+        self.polling_spin.setValue(int(self.config.get("polling_rate", 2)))
+        
+        action_map = {"on": 0, "off": 1, "color": 2, "effect": 3, "preset": 4, "scene": 5, "brightness": 6}
+        self.action_group.button(action_map.get(self.config.get("action", "on"), 0)).setChecked(True)
+        self.current_color = QColor(self.config.get("color", "#ffffff"))
+        self.color_preview.setStyleSheet(f"""
+            background-color: {self.current_color.name()};
+            border: 3px solid #666666;
+            border-radius: 8px;
+        """)
+        self.effect_spin.setValue(int(self.config.get("effect", 0)))
+        self.preset_spin.setValue(int(self.config.get("preset", 0)))
+        self.scene_spin.setValue(int(self.config.get("scene", 0)))
+        self.brightness_spin.setValue(int(self.config.get("brightness", 100)))
+        self.on_led_type_changed()
     
     def save_config(self):
-        # Store old telegram settings to check if they changed
-        old_bot_token = self.config.get("telegram_bot_token", "")
-        old_chat_id = self.config.get("telegram_chat_id", "")
+        # Store old settings to check whether Telegram needs a reconnect
+        old_config = dict(self.config)
         
         # Get selected LED type
         led_type_map = {0: "wled", 1: "govee", 2: "philips_hue"}
-        self.config["led_type"] = led_type_map.get(self.led_type_group.checkedId(), "wled")
+        led_type = led_type_map.get(self.led_type_group.checkedId(), "wled")
+        if led_type == "wled" and self.config.get("led_type") in CONFIG_ONLY_LED_TYPES:
+            led_type = self.config["led_type"]  # set in config.json; the WLED button covers them
+        self.config["led_type"] = led_type
         
         # Save LED-specific settings
-        self.config["wled_ip"] = self.ip_entry.text()
+        # Keep following the discovered device unless an address was typed by
+        # hand; the field may still show the address it had before a DHCP move
+        wled_ip = self.ip_entry.text()
+        wled_mac = self.discovered_wled_mac or self.config.get("wled_mac")
+        if wled_mac and wled_ip == self.shown_wled_ip:
+            self.config["wled_mac"] = wled_mac
+            wled_ip = device_cache.ip_for(wled_mac) or wled_ip
+            self.ip_entry.setText(wled_ip)
+            self.shown_wled_ip = wled_ip
+        else:
+            self.config.pop("wled_mac", None)
+            self.discovered_wled_mac = None
+        self.config["wled_ip"] = wled_ip
         self.config["govee_api_key"] = self.govee_api_key_entry.text()
         self.config["govee_device_id"] = self.govee_device_id_entry.text()
         self.config["govee_model"] = self.govee_model_entry.text()
@@ -1384,11 +1881,14 @@ class RustWLEDApp(QMainWindow):
         self.config["scene"] = str(self.scene_spin.value())
         self.config["brightness"] = str(self.brightness_spin.value())
         
-        with open(CONFIG_FILE, "w") as f:
-            json.dump(self.config, f, indent=4)
+        save_config_file(self.config)
         
-        led_type = self.config.get("led_type", "wled")
-        print(f"[INFO] Settings saved: LED Type={led_type}, Action={self.config['action']}")
+        # Recompile the LED action for the new settings
+        action_plans.invalidate()
+        action_plans.get(self.config)
+        
+        app_log.info("Settings saved", extra=kv(led_type=self.config.get("led_type", "wled"),
+                                                action=self.config["action"]))
         self.update_status("✓ Settings Saved Successfully!", "green")
         
         # Visual feedback - briefly highlight save button
@@ -1423,12 +1923,10 @@ class RustWLEDApp(QMainWindow):
             }
         """))
         
-        # Only restart telegram worker if telegram settings changed
-        new_bot_token = self.config.get("telegram_bot_token", "")
-        new_chat_id = self.config.get("telegram_chat_id", "")
-        
-        if old_bot_token != new_bot_token or old_chat_id != new_chat_id:
-            print("[INFO] Telegram settings changed, restarting worker...")
+        # Only reconnect if the bot token changed; a new chat ID is swapped in
+        change = diff_config(old_config, self.config)
+        if change.reconnect or not self.telegram_worker.apply_config(self.config):
+            app_log.info("Telegram settings changed, restarting worker...")
             self.restart_telegram_worker()
     
     def pick_color(self):
@@ -1446,7 +1944,7 @@ class RustWLEDApp(QMainWindow):
         dialog.exec()
     
     def test_wled(self):
-        print("[INFO] Testing LED connection...")
+        app_log.info("Testing LED connection...")
         
         # Visual feedback - show testing state
         sender = self.sender()
@@ -1456,7 +1954,10 @@ class RustWLEDApp(QMainWindow):
         
         # Update config from UI without saving to file or restarting telegram
         led_type_map = {0: "wled", 1: "govee", 2: "philips_hue"}
-        self.config["led_type"] = led_type_map.get(self.led_type_group.checkedId(), "wled")
+        led_type = led_type_map.get(self.led_type_group.checkedId(), "wled")
+        if led_type == "wled" and self.config.get("led_type") in CONFIG_ONLY_LED_TYPES:
+            led_type = self.config["led_type"]  # set in config.json; the WLED button covers them
+        self.config["led_type"] = led_type
         self.config["wled_ip"] = self.ip_entry.text()
         self.config["govee_api_key"] = self.govee_api_key_entry.text()
         self.config["govee_device_id"] = self.govee_device_id_entry.text()
@@ -1470,76 +1971,48 @@ class RustWLEDApp(QMainWindow):
         self.config["scene"] = str(self.scene_spin.value())
         self.config["brightness"] = str(self.brightness_spin.value())
         
-        self.trigger_led()
-        
-        # Reset button after 2 seconds
-        QTimer.singleShot(2000, lambda: [
+        # Reset button once the device has answered
+        self.trigger_led(on_done=lambda: [
             sender.setText(original_text),
             sender.setEnabled(True)
         ])
     
-    def trigger_led(self):
-        """Trigger LED action using the appropriate controller"""
-        led_type = self.config.get("led_type", "wled")
-        action = self.config.get("action", "on")
-        
-        print(f"[LED] Triggering {led_type.upper()} action: {action}")
-        
-        try:
-            # Create the appropriate LED controller
-            controller = create_led_controller(led_type, self.config)
-            if not controller:
-                self.update_status("❌ Error: LED controller not configured properly", "red")
-                return
-            
-            # Test connection first
-            if not controller.test_connection():
-                self.update_status("❌ Error: Cannot connect to LED device", "red")
-                return
-            
-            # Execute the action
-            success = False
-            if action == "on":
-                success = controller.turn_on()
-                print(f"[LED] Turn ON result: {success}")
-            elif action == "off":
-                success = controller.turn_off()
-                print(f"[LED] Turn OFF result: {success}")
-            elif action == "color":
-                color = self.config.get("color", "#ffffff")
-                success = controller.set_color(color)
-                print(f"[LED] Set color {color} result: {success}")
-            elif action == "brightness" and hasattr(controller, 'set_brightness'):
-                brightness = int(self.config.get("brightness", 100))
-                success = controller.set_brightness(brightness)
-                print(f"[LED] Set brightness {brightness}% result: {success}")
-            elif action == "effect" and hasattr(controller, 'set_effect'):
-                effect = int(self.config.get("effect", 0))
-                success = controller.set_effect(effect)
-                print(f"[LED] Set effect #{effect} result: {success}")
-            elif action == "preset" and hasattr(controller, 'set_preset'):
-                preset = int(self.config.get("preset", 0))
-                success = controller.set_preset(preset)
-                print(f"[LED] Set preset #{preset} result: {success}")
-            elif action == "scene" and hasattr(controller, 'set_scene'):
-                scene = int(self.config.get("scene", 0))
-                success = controller.set_scene(scene)
-                print(f"[LED] Set scene #{scene} result: {success}")
-            else:
-                print(f"[LED] Action '{action}' not supported for {led_type}")
-                self.update_status(f"❌ Error: Action '{action}' not supported for {led_type.upper()}", "red")
+    def trigger_led(self, event=None, on_done=None):
+        """Trigger LED action using the appropriate controller.
+        
+        Safe to call from any thread: the action runs on the LED executor and
+        the status label is updated back on the GUI thread. An alarm event
+        applies its rule's overrides on top of the current settings and goes
+        through the priority scheduler; the Test button always runs.
+        """
+        # Snapshot: the GUI may edit self.config meanwhile
+        if event:
+            self.scheduler.submit(event.rule.apply(self.config), event.trace)
+        else:
+            self.dispatch_action(dict(self.config), None, on_done)
+    
+    def dispatch_action(self, config, trace=None, on_done=None):
+        """Queue an action on the LED executor (any thread); returns its future"""
+        # Claimed now, not when the executor gets to it, so this alarm
+        # supersedes any older one still queued or waiting on the device
+        command = claim_device(config, trace)
+        
+        def finished(future):
+            if future.cancelled():
                 return
-            
-            if success:
-                print(f"[LED] ✓ {led_type.upper()} action successful!")
-                self.update_status(f"✓ {led_type.upper()} {action.title()} Successful!", "green")
+            if future.exception():
+                self.update_status(f"❌ Error: {str(future.exception())[:50]}", "red")
             else:
-                print(f"[LED] ❌ {led_type.upper()} action failed!")
-                self.update_status(f"❌ {led_type.upper()} {action.title()} Failed!", "red")
+                result = future.result()
+                self.update_status(result.message, "green" if result.success else "red")
+            if on_done:
+                on_done()
         
-        except Exception as e:
-            print(f"[ERROR] LED control failed: {str(e)}")
-            self.update_status(f"❌ Error: {str(e)[:50]}", "red")
+        return self.led_executor.submit(execute_action, config, trace, command, on_done=finished)
+    
+    def queue_stats(self):
+        """Scheduler and LED executor queues, for the API (any thread)"""
+        return {"scheduler": self.scheduler.snapshot(), "led_actions": self.led_executor.stats()}
     
     def update_status(self, message, color):
         color_map = {
@@ -1579,25 +2052,140 @@ class RustWLEDApp(QMainWindow):
     def start_telegram_worker(self):
         self.telegram_worker = TelegramWorker(self.config)
         self.telegram_worker.status_update.connect(self.update_status)
-        self.telegram_worker.log_message.connect(self.append_log)
         self.telegram_worker.trigger_callback = self.trigger_led
+        self.telegram_worker.action_runner = self.dispatch_action
+        self.telegram_worker.stats_callback = self.queue_stats
+        self.telegram_worker.reload_requested.connect(self.config_watcher.reload)
         self.telegram_worker.start()
     
     def restart_telegram_worker(self):
         if self.telegram_worker and self.telegram_worker.isRunning():
             self.telegram_worker.stop()
             self.telegram_worker.wait()
+            self.telegram_worker.write_progress(self.config)
         self.start_telegram_worker()
     
     def closeEvent(self, event):
         if self.telegram_worker and self.telegram_worker.isRunning():
             self.telegram_worker.stop()
             self.telegram_worker.wait()
+            self.telegram_worker.write_progress()
+        self.scheduler.cancel()
+        self.led_executor.shutdown()
+        self.lookup_executor.shutdown()
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+        profiler.stop()
+        journal.close()
+        close_links()
+        close_senders()
         event.accept()
 
 
+def run_headless(args):
+    """Run the Telegram worker and LED dispatch without a window"""
+    app = QCoreApplication(sys.argv)
+    config = load_config_file()
+    configure_logging(config.get("log_level"), with_time=True)
+    action_plans.get(config)
+    open_journal(config)
+    event_publisher.configure(config)
+    
+    metrics_port = args.metrics_port if args.metrics_port is not None else int(config.get("metrics_port", 0))
+    metrics_server = start_metrics_server(metrics_port, host=args.metrics_host) if metrics_port else None
+    
+    # Same dispatch as the GUI: claimed when queued, run off the Telegram loop
+    led_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="led-action")
+    
+    scheduler = PriorityScheduler(
+        lambda action_config, trace: led_pool.submit(execute_action, action_config, trace,
+                                                     claim_device(action_config, trace)),
+        target_of)
+    
+    workers = []
+    
+    def start_worker(worker_config):
+        worker = TelegramWorker(worker_config)
+        worker.status_update.connect(lambda message, color: app_log.info(message))
+        # worker.config, not worker_config: reloads swap it
+        worker.trigger_callback = lambda event: scheduler.submit(event.rule.apply(worker.config), event.trace)
+        worker.action_runner = lambda action_config: led_pool.submit(execute_action, action_config, None,
+                                                                     claim_device(action_config))
+        worker.stats_callback = lambda: {"scheduler": scheduler.snapshot(), "led_actions": pool_stats(led_pool)}
+        worker.reload_requested.connect(config_watcher.reload)
+        
+        def finished():
+            if workers and workers[-1] is worker:
+                app.quit()  # gave up (e.g. no token); a restart for new credentials is not an exit
+        
+        worker.finished.connect(finished)
+        workers.append(worker)
+        worker.start()
+    
+    def restart_worker(worker_config):
+        worker = workers.pop()
+        worker.stop()
+        worker.wait()
+        worker.write_progress(worker_config)
+        start_worker(worker_config)
+    
+    def on_config_file_changed(new_config):
+        worker = workers[-1]
+        reload_config(worker.config, new_config, worker, restart_worker)
+    
+    config_watcher = ConfigWatcher(CONFIG_FILE)
+    config_watcher.changed.connect(on_config_file_changed)
+    start_worker(config)
+    
+    # Let Ctrl+C through: Python only runs signal handlers when it gets
+    # control, so the signal wakes Qt through a socket instead of a timer
+    signal.signal(signal.SIGINT, lambda *_: app.quit())
+    signal.signal(signal.SIGTERM, lambda *_: app.quit())
+    signal_reader, signal_writer = socket.socketpair()
+    signal_writer.setblocking(False)
+    signal.set_wakeup_fd(signal_writer.fileno())
+    signal_notifier = QSocketNotifier(signal_reader.fileno(), QSocketNotifier.Read)
+    signal_notifier.activated.connect(lambda: signal_reader.recv(64))
+    
+    try:
+        return app.exec()
+    finally:
+        workers[-1].stop()
+        workers[-1].wait()
+        workers[-1].write_progress()
+        scheduler.cancel()
+        led_pool.shutdown(wait=False, cancel_futures=True)
+        profiler.stop()
+        if metrics_server:
+            metrics_server.shutdown()
+        journal.close()
+        close_links()
+        close_senders()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Rust+ Multi-LED Trigger")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without the GUI (Telegram polling and LED control only)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve Prometheus metrics on this port (0 = off; default: metrics_port from config.json)")
+    parser.add_argument("--metrics-host", default="127.0.0.1",
+                        help="address for the metrics endpoint (default 127.0.0.1)")
+    parser.add_argument("--profile", action="store_true",
+                        help="sample every thread's stack until exit and write flame graph files under profiles/")
+    parser.add_argument("--profile-interval", type=float, default=10,
+                        help="milliseconds between profiler samples (default 10)")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    configure_logging(with_time=args.headless)
+    if args.profile:
+        profiler.start(args.profile_interval / 1000)
+    if args.headless:
+        sys.exit(run_headless(args))
     app = QApplication(sys.argv)
-    window = RustWLEDApp()
+    window = RustWLEDApp(metrics_port=args.metrics_port)
     window.show()
     sys.exit(app.exec())
@@ -0,0 +1,247 @@
+"""
+Alarm pipeline latency metrics
+
+Each alarm carries an ``AlarmTrace`` that is stamped as it moves through the
+pipeline (Telegram message date -> update received -> rule matched ->
+command sent -> device ack). Completed traces feed per-stage latency
+histograms and per-device success counters, which can be rendered as a text
+report for the GUI or in Prometheus text exposition format for scraping.
+"""
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from app_logging import get_logger
+
+log = get_logger("metrics")
+
+# Pipeline stages, in order. "delivery" is IFTTT/Telegram transit time and
+# only has one-second resolution because Telegram message dates are whole
+# seconds.
+STAGES = ("delivery", "match", "dispatch", "device", "end_to_end")
+
+# Histogram bucket upper bounds in seconds (roughly 1-2.5-5 log spacing).
+# Match and dispatch take well under a millisecond, hence the low buckets
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class AlarmTrace:
+    """Timestamps for one alarm as it moves through the pipeline"""
+
+    __slots__ = ("message_ts", "received_wall", "received", "matched",
+                 "sent", "acked", "device", "success", "origin")
+
+    def __init__(self, message_ts: Optional[float] = None):
+        self.message_ts = message_ts  # wall clock, from the Telegram message date
+        self.received_wall = time.time()
+        self.received = time.monotonic()
+        self.matched = None
+        self.sent = None
+        self.acked = None
+        self.device = None
+        self.success = None
+        self.origin = None  # (chat_id, message_id, rule name) of the alarm, for the journal
+
+    def mark_matched(self):
+        self.matched = time.monotonic()
+
+    def mark_sent(self):
+        self.sent = time.monotonic()
+
+    def mark_acked(self, device: str, success: Optional[bool]):
+        """success=None means the command was dropped (late or superseded)"""
+        self.acked = time.monotonic()
+        self.device = device
+        self.success = success
+
+    def stage_durations(self) -> Dict[str, float]:
+        """Seconds spent in each stage that has both of its timestamps"""
+        durations = {}
+        if self.message_ts is not None:
+            durations["delivery"] = max(0.0, self.received_wall - self.message_ts)
+        if self.matched is not None:
+            durations["match"] = self.matched - self.received
+            if self.sent is not None:
+                durations["dispatch"] = self.sent - self.matched
+        if self.success is None:
+            return durations  # dropped: never reached the device
+        if self.sent is not None and self.acked is not None:
+            durations["device"] = self.acked - self.sent
+        if self.acked is not None:
+            durations["end_to_end"] = durations.get("delivery", 0.0) + (self.acked - self.received)
+        return durations
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with interpolated percentiles"""
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        if not self.count or value < self.min:
+            self.min = value
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Estimate the q-th quantile (0-1) by interpolating inside its bucket.
+
+        The observed min and max narrow the outer buckets, so values that all
+        fall into one bucket still spread out instead of reading as its bound.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = max(self.buckets[i - 1] if i > 0 else 0.0, self.min)
+                upper = min(self.buckets[i] if i < len(self.buckets) else self.max, self.max)
+                fraction = (rank - seen) / bucket_count
+                return lower + (upper - lower) * fraction
+            seen += bucket_count
+        return self.max
+
+
+class PipelineMetrics:
+    """Per-stage latency histograms and per-device success counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {stage: LatencyHistogram() for stage in STAGES}
+        self.devices: Dict[str, List[int]] = {}  # device -> [success, failure, dropped]
+
+    def record(self, trace: AlarmTrace):
+        """Fold a completed trace into the histograms"""
+        durations = trace.stage_durations()
+        with self._lock:
+            for stage, seconds in durations.items():
+                self.stages[stage].observe(seconds)
+            if trace.device is not None:
+                counters = self.devices.setdefault(trace.device, [0, 0, 0])
+                counters[2 if trace.success is None else 0 if trace.success else 1] += 1
+
+    def reset(self):
+        with self._lock:
+            self.stages = {stage: LatencyHistogram() for stage in STAGES}
+            self.devices = {}
+
+    def snapshot(self) -> Dict:
+        """Plain-dict summary: counts and p50/p95/p99 per stage, device counters"""
+        with self._lock:
+            stages = {
+                stage: {
+                    "count": hist.count,
+                    "p50": hist.percentile(0.50),
+                    "p95": hist.percentile(0.95),
+                    "p99": hist.percentile(0.99),
+                    "max": hist.max if hist.count else None,
+                }
+                for stage, hist in self.stages.items()
+            }
+            devices = {device: {"success": ok, "failure": failed, "dropped": dropped}
+                       for device, (ok, failed, dropped) in self.devices.items()}
+        return {"stages": stages, "devices": devices}
+
+    def render_text(self, bar_width: int = 30) -> str:
+        """Human readable report with an end-to-end histogram"""
+        snapshot = self.snapshot()
+
+        def ms(value):
+            return "-" if value is None else f"{value * 1000:.1f}"
+
+        lines = [f"{'Stage':<12}{'Count':>8}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}"]
+        for stage, row in snapshot["stages"].items():
+            lines.append(f"{stage:<12}{row['count']:>8}{ms(row['p50']):>12}"
+                         f"{ms(row['p95']):>12}{ms(row['p99']):>12}")
+
+        lines.append("")
+        lines.append("End-to-end distribution:")
+        with self._lock:
+            hist = self.stages["end_to_end"]
+            counts = list(hist.counts)
+        peak = max(counts) or 1
+        for i, bucket_count in enumerate(counts):
+            label = f"<= {hist.buckets[i]:g}s" if i < len(hist.buckets) else f"> {hist.buckets[-1]:g}s"
+            bar = "█" * round(bar_width * bucket_count / peak)
+            lines.append(f"{label:>11} {bar} {bucket_count}")
+
+        lines.append("")
+        lines.append(f"{'Device':<36}{'OK':>8}{'Failed':>8}{'Dropped':>9}")
+        if not snapshot["devices"]:
+            lines.append("(no alarms dispatched yet)")
+        for device, row in snapshot["devices"].items():
+            lines.append(f"{device:<36}{row['success']:>8}{row['failure']:>8}{row['dropped']:>9}")
+        return "\n".join(lines)
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = [
+            "# HELP rustplusled_stage_latency_seconds Alarm pipeline latency per stage.",
+            "# TYPE rustplusled_stage_latency_seconds histogram",
+        ]
+        with self._lock:
+            for stage, hist in self.stages.items():
+                cumulative = 0
+                for bound, bucket_count in zip(hist.buckets, hist.counts):
+                    cumulative += bucket_count
+                    lines.append(f'rustplusled_stage_latency_seconds_bucket{{stage="{stage}",le="{bound:g}"}} {cumulative}')
+                lines.append(f'rustplusled_stage_latency_seconds_bucket{{stage="{stage}",le="+Inf"}} {hist.count}')
+                lines.append(f'rustplusled_stage_latency_seconds_sum{{stage="{stage}"}} {hist.sum:.6f}')
+                lines.append(f'rustplusled_stage_latency_seconds_count{{stage="{stage}"}} {hist.count}')
+
+            lines.append("# HELP rustplusled_device_commands_total Device commands by result.")
+            lines.append("# TYPE rustplusled_device_commands_total counter")
+            for device, (ok, failed, dropped) in self.devices.items():
+                label = device.replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(f'rustplusled_device_commands_total{{device="{label}",result="success"}} {ok}')
+                lines.append(f'rustplusled_device_commands_total{{device="{label}",result="failure"}} {failed}')
+                lines.append(f'rustplusled_device_commands_total{{device="{label}",result="dropped"}} {dropped}')
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide metrics shared by the worker, the GUI and the exposition endpoint
+pipeline_metrics = PipelineMetrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    metrics: PipelineMetrics = pipeline_metrics
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug("%s %s", self.address_string(), format % args)
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1",
+                         metrics: PipelineMetrics = pipeline_metrics) -> ThreadingHTTPServer:
+    """Serve ``GET /metrics`` from a daemon thread; returns the server for shutdown()"""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"metrics": metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    log.info("Serving Prometheus metrics on http://%s:%d/metrics", host, server.server_address[1])
+    return server
@@ -0,0 +1,226 @@
+"""
+MQTT transport: WLED commands and alarm events over one broker connection
+
+WLED subscribes to MQTT topics on its own, so with a broker on the network
+the lights can be driven without an HTTP request per alarm. The broker is
+configured once::
+
+    "mqtt": {"host": "192.168.1.5", "port": 1883, "username": "", "password": "",
+             "event_topic": "rustplusled/events"}
+
+and devices use ``"led_type": "wled_mqtt"`` with the device topic set in
+WLED's Sync settings, e.g. ``"wled_mqtt_topic": "wled/kitchen"``. Actions are
+compiled to a JSON state on ``<topic>/api``, the same body the HTTP path
+posts, and published with QoS 0: no handshake per command, so "sent" is the
+best acknowledgement there is.
+
+Every device on one broker shares a single persistent connection
+(``link_for``), kept up by paho's network thread with automatic reconnects.
+With ``event_topic`` set, every journaled event (message, scheduling
+decision, command, result) is also published as JSON to
+``<event_topic>/<kind>`` for other consumers, e.g. Home Assistant.
+
+Needs the optional ``paho-mqtt`` package (``pip install paho-mqtt``).
+"""
+
+import json
+import threading
+from typing import Dict, Optional, Tuple
+
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:  # only needed for wled_mqtt devices and event publishing
+    mqtt = None
+
+from app_logging import get_logger, kv, throttle
+from journal import journal
+from led_controllers import NO_HEADERS, ActionPlan, LEDController, encode_json, parse_hex_color
+
+log = get_logger("mqtt")
+
+DEFAULT_PORT = 1883
+KEEPALIVE = 30  # seconds between pings on an idle connection
+CONNECT_WAIT = 2.0  # seconds test_connection waits for a fresh link
+
+
+class MQTTLink:
+    """One persistent broker connection, shared by every device and the event publisher"""
+
+    def __init__(self, host: str, port: int = DEFAULT_PORT, username: str = "", password: str = "",
+                 client_id: str = ""):
+        self.host = host
+        self.port = port
+        self.connected = threading.Event()
+        self.stopping = False
+        if hasattr(mqtt, "CallbackAPIVersion"):  # paho-mqtt 2.x
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+        else:
+            self.client = mqtt.Client(client_id=client_id)
+        if username:
+            self.client.username_pw_set(username, password or None)
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+
+    def start(self):
+        log.info("Connecting to MQTT broker...", extra=kv(broker=f"{self.host}:{self.port}"))
+        self.client.connect_async(self.host, self.port, KEEPALIVE)
+        self.client.loop_start()
+
+    def stop(self):
+        self.stopping = True
+        self.client.disconnect()
+        self.client.loop_stop()
+        self.connected.clear()
+
+    def publish(self, topic: str, payload: bytes, qos: int = 0) -> bool:
+        """Queue a message for the network thread; False while disconnected"""
+        if not self.connected.is_set():
+            return False
+        return self.client.publish(topic, payload, qos=qos).rc == mqtt.MQTT_ERR_SUCCESS
+
+    def _on_connect(self, client, userdata, flags, reason_code, *_):
+        if int(getattr(reason_code, "value", reason_code)) == 0:
+            self.connected.set()
+            log.info("✓ Connected to MQTT broker", extra=kv(broker=f"{self.host}:{self.port}"))
+        else:
+            log.error("MQTT broker refused the connection: %s", reason_code,
+                      extra=throttle("mqtt-refused", 30, broker=f"{self.host}:{self.port}"))
+
+    def _on_disconnect(self, client, userdata, *args):
+        self.connected.clear()
+        if self.stopping:
+            return
+        log.warning("Disconnected from MQTT broker, reconnecting",
+                    extra=throttle("mqtt-disconnect", 30, broker=f"{self.host}:{self.port}"))
+
+
+_links: Dict[Tuple, MQTTLink] = {}
+_links_lock = threading.Lock()
+
+
+def link_for(settings: Optional[Dict]) -> Optional[MQTTLink]:
+    """The shared, started link for the ``mqtt`` settings; None if not configured or unavailable"""
+    if not settings or not settings.get("host"):
+        return None
+    if mqtt is None:
+        log.error("MQTT needs the paho-mqtt package: pip install paho-mqtt", extra=throttle("mqtt-missing", 300))
+        return None
+    key = (settings["host"], int(settings.get("port", DEFAULT_PORT)), settings.get("username", ""),
+           settings.get("password", ""), settings.get("client_id", ""))
+    with _links_lock:
+        link = _links.get(key)
+        if link is None:
+            link = _links[key] = MQTTLink(*key)
+            link.start()
+    return link
+
+
+def close_links():
+    """Disconnect every broker (on exit)"""
+    with _links_lock:
+        links = list(_links.values())
+        _links.clear()
+    for link in links:
+        link.stop()
+
+
+class WLEDMQTTController(LEDController):
+    """WLED driven through its MQTT device topic instead of HTTP"""
+
+    log = log
+
+    def __init__(self, link: MQTTLink, topic: str):
+        self.link = link
+        self.topic = topic.rstrip("/")
+
+    @property
+    def device_key(self) -> str:
+        return f"wled-mqtt:{self.topic}"
+
+    def _plan(self, description: str, payload: Dict) -> ActionPlan:
+        return ActionPlan(self.device_key, "PUBLISH", f"{self.topic}/api", NO_HEADERS, encode_json(payload), 0,
+                          description)
+
+    def compile_action(self, action: str, config: Dict) -> Optional[ActionPlan]:
+        if action == "on":
+            return self._plan("turn on", {"on": True})
+        if action == "off":
+            return self._plan("turn off", {"on": False})
+        if action == "color":
+            r, g, b = parse_hex_color(config.get("color", "#ffffff"))
+            return self._plan(f"set color RGB({r},{g},{b})", {"on": True, "seg": [{"col": [[r, g, b]]}]})
+        if action == "effect":
+            effect_id = int(config.get("effect", 0))
+            return self._plan(f"set effect #{effect_id}", {"on": True, "seg": [{"fx": effect_id}]})
+        if action == "preset":
+            preset_id = int(config.get("preset", 0))
+            return self._plan(f"run preset #{preset_id}", {"ps": preset_id})
+        if action == "brightness":
+            brightness = max(0, min(100, int(config.get("brightness", 100))))
+            return self._plan(f"set brightness {brightness}%", {"on": True, "bri": round(brightness * 2.55)})
+        return None
+
+    def send(self, plan: ActionPlan) -> bool:
+        _, breaker = self._admit()  # publishing never blocks, so one check is enough
+        if self.link.publish(plan.url, plan.body):
+            breaker.record_success()
+            self.log.debug("%s -> %s", plan.description, plan.url)
+            return True
+        breaker.record_failure()
+        self.log.error("Failed to %s: not connected to the broker", plan.description, extra=kv(device=self.device_key))
+        return False
+
+    def set_brightness(self, brightness: int) -> bool:
+        return self.send(self.compile_action("brightness", {"brightness": brightness}))
+
+    def set_effect(self, effect_id: int) -> bool:
+        return self.send(self.compile_action("effect", {"effect": effect_id}))
+
+    def set_preset(self, preset_id: int) -> bool:
+        return self.send(self.compile_action("preset", {"preset": preset_id}))
+
+    def turn_on(self) -> bool:
+        return self.send(self.compile_action("on", {}))
+
+    def turn_off(self) -> bool:
+        return self.send(self.compile_action("off", {}))
+
+    def set_color(self, color: str) -> bool:
+        return self.send(self.compile_action("color", {"color": color}))
+
+    def test_connection(self) -> bool:
+        return self.link.connected.wait(CONNECT_WAIT)
+
+    def get_status(self) -> Dict:
+        return {"broker": f"{self.link.host}:{self.link.port}", "connected": self.link.connected.is_set(),
+                "topic": self.topic}
+
+
+class EventPublisher:
+    """Publishes every journaled event to ``<event_topic>/<kind>`` (QoS 0)"""
+
+    def __init__(self):
+        self.link: Optional[MQTTLink] = None
+        self.topic = ""
+        self._subscribed = False
+
+    def configure(self, config: Dict):
+        """Start, retarget or stop publishing for a (new) config"""
+        settings = config.get("mqtt") or {}
+        topic = str(settings.get("event_topic", "")).rstrip("/")
+        self.link = link_for(settings) if topic else None
+        self.topic = topic if self.link else ""
+        if self.link and not self._subscribed:
+            journal.add_listener(self._publish)
+            self._subscribed = True
+
+    def _publish(self, event: Dict):
+        link, topic = self.link, self.topic
+        if link is None:
+            return
+        payload = {key: value for key, value in event.items() if value is not None}
+        link.publish(f"{topic}/{event['kind']}", json.dumps(payload).encode("utf-8"))
+
+
+event_publisher = EventPublisher()
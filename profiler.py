@@ -0,0 +1,220 @@
+"""
+Sampling profiler: where the time goes when alarms get slow
+
+Toggled from the Metrics tab or started with ``--profile``. While it runs, a
+background thread looks at every thread's Python stack ``interval`` seconds
+apart (``sys._current_frames``, no tracing hooks), so the app runs at full
+speed between samples and not at all slower while it's off.
+
+Each sample is tagged with the pipeline stage it belongs to, taken from the
+innermost frame in one of the app's modules:
+
+    intake    Telegram polling, Rust+, webhook and API servers
+    match     routing a message through the rules
+    dispatch  scheduling, compiling and running actions, zones, animations
+    http      talking to a device (HTTP, MQTT, UDP)
+    ui        the Qt thread
+    idle      threads waiting on a queue, lock or socket
+
+When profiling stops, the session is written to ``profiles/<time>/``:
+``all.folded`` with every sample, one ``<stage>.folded`` per stage and a
+``summary.txt``. The ``.folded`` files are collapsed stacks
+(``stage;thread;frame;frame count``) for speedscope.app or flamegraph.pl.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+from app_logging import get_logger, kv
+
+log = get_logger("profile")
+
+PROFILE_DIR = "profiles"
+DEFAULT_INTERVAL = 0.01  # seconds between samples
+MAX_DEPTH = 128  # frames kept per stack, innermost first
+
+INTAKE, MATCH, DISPATCH, HTTP, UI, IDLE, OTHER = "intake", "match", "dispatch", "http", "ui", "idle", "other"
+STAGES = (INTAKE, MATCH, DISPATCH, HTTP, UI, IDLE, OTHER)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (module, function) in the app's own files; None matches the whole module.
+# The innermost frame with a marker decides the stage of a sample
+STAGE_MARKERS: Dict[Tuple[str, Optional[str]], str] = {
+    ("led_controllers", "_request"): HTTP,
+    ("led_controllers", "_send"): HTTP,
+    ("led_controllers", "send"): HTTP,
+    ("mqtt_transport", "publish"): HTTP,
+    ("dmx", "_send_frame"): HTTP,
+    ("effects", "send"): HTTP,
+    ("rules", None): MATCH,
+    ("telegram_intake", "_handle_update"): MATCH,
+    ("rustplus", "_entity_changed"): MATCH,
+    ("rustplus", "_alarm"): MATCH,
+    ("webhook", "_handle"): MATCH,
+    ("api", "_trigger"): MATCH,
+    ("dispatch", None): DISPATCH,
+    ("scheduler", None): DISPATCH,
+    ("zones", None): DISPATCH,
+    ("effects", None): DISPATCH,
+    ("dmx", None): DISPATCH,
+    ("led_controllers", None): DISPATCH,
+    ("mqtt_transport", None): DISPATCH,
+    ("telegram_intake", None): INTAKE,
+    ("rustplus", None): INTAKE,
+    ("webhook", None): INTAKE,
+    ("api", None): INTAKE,
+    ("local_http", None): INTAKE,
+    ("service", None): INTAKE,
+    ("main", "run"): INTAKE,  # TelegramWorker's event loop
+    ("main", None): UI,
+}
+
+# Innermost frames of a thread that is only waiting. The Qt thread shows as
+# the line calling app.exec() while Qt has nothing for Python to do. Waiting
+# on a device still counts as http
+IDLE_FRAMES = {("threading", "wait"), ("threading", "_wait_for_tstate_lock"), ("selectors", "select"),
+               ("queue", "get"), ("thread", "_worker"), ("socket", "accept"), ("socketserver", "serve_forever"),
+               ("main", "<module>"), ("main", "run_headless")}
+
+
+class SamplingProfiler:
+    """Samples every thread's stack on a timer; one session between ``start()`` and ``stop()``"""
+
+    def __init__(self, directory: str = PROFILE_DIR, interval: float = DEFAULT_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.samples = 0
+        self._stacks: Counter = Counter()  # (stage, thread, (code, ...)) -> samples
+        self._codes: Dict[object, Tuple[Optional[str], str, bool]] = {}  # code -> (stage, label, idle)
+        self._names: Dict[int, str] = {}  # thread ident -> name without the pool index
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+        self._session = ""
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval: Optional[float] = None) -> bool:
+        """Start a session (any thread); False if one is already running"""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            if interval:
+                self.interval = interval
+            self.samples = 0
+            self._stacks = Counter()
+            self._stopping.clear()
+            self._started = time.monotonic()
+            self._session = time.strftime("%Y%m%d-%H%M%S")
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+        log.info("Profiling started", extra=kv(interval_ms=f"{self.interval * 1000:g}"))
+        return True
+
+    def stop(self) -> Optional[str]:
+        """End the session and write it; returns its directory (None if nothing ran)"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return None
+            self._stopping.set()
+            thread.join()
+            seconds = time.monotonic() - self._started
+            path = os.path.join(self.directory, self._session)
+            try:
+                self._write(path, seconds)
+            except OSError as e:
+                log.error("Could not write the profile: %s", e, extra=kv(path=path))
+                return None
+        log.info("Profiling stopped", extra=kv(samples=self.samples, seconds=f"{seconds:.1f}", path=path))
+        return path
+
+    def _run(self):
+        own = threading.get_ident()
+        interval = self.interval
+        next_sample = time.monotonic()
+        while not self._stopping.wait(max(0.0, next_sample - time.monotonic())):
+            next_sample += interval
+            frames = sys._current_frames()
+            for ident, frame in frames.items():
+                if ident != own:
+                    self._sample(ident, frame)
+            self.samples += 1
+            if next_sample < time.monotonic():
+                next_sample = time.monotonic()  # fell behind (suspended laptop, GIL hog): don't burst
+
+    def _sample(self, ident: int, frame):
+        stage, idle, codes = None, None, []
+        while frame is not None and len(codes) < MAX_DEPTH:
+            code = frame.f_code
+            info = self._codes.get(code) or self._describe(code)
+            if idle is None:
+                idle = info[2]
+            if stage is None:
+                stage = info[0]
+            codes.append(code)
+            frame = frame.f_back
+        name = self._names.get(ident)
+        if name is None:
+            self._names = {thread.ident: thread.name.rstrip("0123456789").rstrip("_-") or thread.name
+                           for thread in threading.enumerate()}
+            name = self._names.setdefault(ident, "thread")  # started outside Python (Qt)
+        if idle and stage != HTTP:
+            stage = IDLE
+        self._stacks[(stage or OTHER, name, tuple(codes))] += 1
+
+    def _describe(self, code) -> Tuple[Optional[str], str, bool]:
+        """Stage, flame graph label and idleness of a code object, worked out once"""
+        path = os.path.abspath(code.co_filename)
+        module = os.path.splitext(os.path.basename(path))[0]
+        function = code.co_name
+        stage = None
+        if os.path.dirname(path) == APP_DIR:
+            stage = STAGE_MARKERS.get((module, function)) or STAGE_MARKERS.get((module, None))
+        label = f"{module}:{getattr(code, 'co_qualname', function)}".replace(";", ":")
+        info = (stage, label, (module, function) in IDLE_FRAMES)
+        self._codes[code] = info
+        return info
+
+    def _write(self, path: str, seconds: float):
+        os.makedirs(path, exist_ok=True)
+        per_stage: Dict[str, Dict[str, int]] = {stage: {} for stage in STAGES}
+        leaves: Dict[str, Counter] = {stage: Counter() for stage in STAGES}
+        for (stage, thread, codes), count in self._stacks.items():
+            labels = [self._codes[code][1] for code in reversed(codes)]
+            per_stage[stage][";".join([stage, thread] + labels)] = count
+            leaves[stage][labels[-1]] += count
+        with open(os.path.join(path, "all.folded"), "w", encoding="utf-8") as all_file:
+            for stage, stacks in per_stage.items():
+                if not stacks:
+                    continue
+                lines = "".join(f"{stack} {count}\n" for stack, count in stacks.items())
+                all_file.write(lines)
+                if stage != IDLE:
+                    with open(os.path.join(path, f"{stage}.folded"), "w", encoding="utf-8") as f:
+                        f.write(lines)
+        with open(os.path.join(path, "summary.txt"), "w", encoding="utf-8") as f:
+            f.write(self._summary(seconds, per_stage, leaves))
+
+    def _summary(self, seconds: float, per_stage: Dict[str, Dict[str, int]], leaves: Dict[str, Counter]) -> str:
+        total = sum(sum(stacks.values()) for stacks in per_stage.values()) or 1
+        lines = [f"{self.samples} samples of every thread, {self.interval * 1000:g} ms apart over {seconds:.1f}s",
+                 "", f"{'Stage':<12}{'Stacks':>10}{'Share':>8}   Top functions"]
+        for stage in STAGES:
+            count = sum(per_stage[stage].values())
+            if not count:
+                continue
+            top = ", ".join(f"{label} {n * 100 / count:.0f}%" for label, n in leaves[stage].most_common(3))
+            lines.append(f"{stage:<12}{count:>10}{count * 100 / total:>7.1f}%   {top}")
+        return "\n".join(lines) + "\n"
+
+
+profiler = SamplingProfiler()
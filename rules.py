@@ -0,0 +1,103 @@
+"""
+Alarm rules and the events they route
+
+A rule decides which LED action an incoming message triggers. Rules are
+configured per chat; the first rule whose ``match`` regex is found in the
+message text wins, and a rule without ``match`` catches everything::
+
+    "rules": [
+        {"name": "raid", "match": "raid|door|explosive", "action": "color", "color": "#ff0000"},
+        {"name": "cargo", "match": "cargo", "action": "effect", "effect": "38"},
+        {"name": "default", "action": "on"}
+    ]
+
+Every key besides ``name`` and ``match`` overrides the matching setting of the
+main config when the rule fires. The scheduling keys (``priority``, ``hold``,
+``max_defer``, see ``scheduler.py``) are checked when the rules load; a bad
+value is logged and left out, so the default applies.
+"""
+
+import re
+from typing import Dict, Iterable, List, Optional
+
+from app_logging import get_logger
+from metrics import AlarmTrace
+
+log = get_logger("rules")
+
+RULE_META_KEYS = ("name", "match")
+# Scheduling keys: how to read them and the smallest value allowed
+RULE_NUMBERS = {"priority": (int, None), "hold": (float, 0.0), "max_defer": (float, 0.0)}
+
+
+class Rule:
+    """A named text pattern plus config overrides for the action it runs"""
+
+    __slots__ = ("name", "pattern", "overrides")
+
+    def __init__(self, name: str, match: Optional[str] = None, overrides: Optional[Dict] = None):
+        self.name = name
+        self.pattern = re.compile(match, re.IGNORECASE) if match else None
+        self.overrides = dict(overrides or {})
+
+    def matches(self, text: str) -> bool:
+        return self.pattern is None or self.pattern.search(text) is not None
+
+    def apply(self, config: Dict) -> Dict:
+        """The main config with this rule's overrides on top"""
+        merged = dict(config)
+        merged.update(self.overrides)
+        return merged
+
+    def __repr__(self):
+        return f"Rule({self.name!r})"
+
+
+def parse_rules(specs: Optional[Iterable[Dict]]) -> List[Rule]:
+    """Build rules from config dicts; no rules means one catch-all rule"""
+    rules = []
+    for i, spec in enumerate(specs or []):
+        name = spec.get("name") or f"rule{i + 1}"
+        overrides = {k: v for k, v in spec.items() if k not in RULE_META_KEYS}
+        for key, (kind, minimum) in RULE_NUMBERS.items():
+            if key not in overrides:
+                continue
+            try:
+                value = kind(overrides[key])
+                if minimum is not None and value < minimum:
+                    raise ValueError("negative")
+                overrides[key] = value
+            except (TypeError, ValueError):
+                log.error("Rule %s: invalid %s %r, using the default", name, key, overrides.pop(key))
+        rules.append(Rule(name, spec.get("match"), overrides))
+    return rules or [Rule("default")]
+
+
+def match_rule(rules: List[Rule], text: str) -> Optional[Rule]:
+    """First rule matching the text, or None"""
+    for rule in rules:
+        if rule.matches(text):
+            return rule
+    return None
+
+
+class AlarmEvent:
+    """One matched alarm on its way to the LED dispatcher"""
+
+    __slots__ = ("source", "bot", "chat_id", "message_id", "text", "rule", "trace")
+
+    def __init__(self, source: str, bot: str, chat_id: str, message_id: int, text: str,
+                 rule: Rule, trace: Optional[AlarmTrace] = None):
+        self.source = source  # "telegram", ...
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+        self.rule = rule
+        self.trace = trace
+        if trace is not None:
+            trace.origin = (chat_id, message_id, rule.name)
+
+    def __repr__(self):
+        return (f"AlarmEvent({self.source}:{self.bot} chat={self.chat_id} "
+                f"id={self.message_id} rule={self.rule.name})")
@@ -0,0 +1,411 @@
+"""
+Rust+ intake: alarms straight from the game server's companion WebSocket
+
+The usual path (smart alarm -> Rust+ app -> IFTTT -> Telegram -> polling)
+puts several seconds of third-party latency in front of the lights. With a
+``rustplus`` section the app connects to the server's Rust+ port itself,
+with the credentials the Rust+ app got when pairing::
+
+    "rustplus": {
+        "server": "123.45.67.89", "port": 28082,
+        "player_id": "76561198000000000", "player_token": -123456789,
+        "entities": {"1234567": "Raid alarm: main base", "2345678": "Raid alarm: loot room"},
+        "team_chat": false,
+        "rules": [{"name": "raid", "match": "raid", "action": "effect", "effect": "38"}]
+    }
+
+Asking for an entity's info (``getEntityInfo``) subscribes the connection to
+its changes; every watched smart alarm (or switch) that turns on is matched
+against ``rules`` by its name here and handed to ``on_event`` as an
+``AlarmEvent``, like a Telegram message. With ``team_chat`` team chat
+messages are matched as well.
+
+Messages are protobuf (the companion ``rustplus.proto`` schema). Only a
+handful of fields are needed, so they are encoded and decoded here rather
+than pulling in protobuf and generated code. The WebSocket client is the
+optional ``websockets`` package (``pip install websockets``).
+
+``capture_path`` appends every received frame as a hex line; the benchmarks'
+``FakeRustPlus`` replays such files.
+"""
+
+import asyncio
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    import websockets
+except ImportError:  # only needed when a rustplus section is configured
+    websockets = None
+
+from app_logging import get_logger, kv, throttle
+from journal import UPDATE, journal
+from metrics import AlarmTrace
+from rules import AlarmEvent, Rule, match_rule, parse_rules
+
+log = get_logger("rustplus")
+
+RECONNECT_DELAYS = (1, 2, 5, 10, 30)  # seconds, the last one repeats
+REQUEST_TIMEOUT = 10.0
+
+# rustplus.proto field numbers
+# AppRequest
+REQ_SEQ, REQ_PLAYER_ID, REQ_PLAYER_TOKEN, REQ_ENTITY_ID = 1, 2, 3, 4
+REQ_GET_TEAM_CHAT, REQ_GET_ENTITY_INFO = 12, 14
+# AppMessage, AppResponse, AppBroadcast
+MSG_RESPONSE, MSG_BROADCAST = 1, 2
+RESP_SEQ, RESP_ERROR, RESP_ENTITY_INFO = 1, 5, 11
+BROADCAST_TEAM_MESSAGE, BROADCAST_ENTITY_CHANGED = 5, 6
+# AppEntityType
+ENTITY_SWITCH, ENTITY_ALARM, ENTITY_STORAGE_MONITOR = 1, 2, 3
+
+# Parsed message kinds
+RESPONSE = "response"
+ENTITY = "entity"
+TEAM_CHAT = "team_chat"
+
+
+# --- protobuf wire format (varint and length-delimited fields only) ---
+
+def _varint(value: int) -> bytes:
+    value &= (1 << 64) - 1  # negative int32/int64 are sent as 10-byte two's complement
+    out = bytearray()
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def encode_fields(*fields: Tuple[int, object]) -> bytes:
+    """(number, value) pairs; ints become varints, bytes and str length-delimited, None is skipped"""
+    out = bytearray()
+    for number, value in fields:
+        if value is None:
+            continue
+        if isinstance(value, bool) or isinstance(value, int):
+            out += _varint(number << 3) + _varint(int(value))
+        else:
+            data = value.encode("utf-8") if isinstance(value, str) else bytes(value)
+            out += _varint(number << 3 | 2) + _varint(len(data)) + data
+    return bytes(out)
+
+
+def decode_fields(data: bytes) -> Dict[int, List]:
+    """Field number -> values (ints for varints and fixed fields, bytes for the rest)"""
+    fields: Dict[int, List] = {}
+    position, end = 0, len(data)
+
+    def varint():
+        nonlocal position
+        result = shift = 0
+        while True:
+            if position >= end:
+                raise ValueError("truncated varint")
+            byte = data[position]
+            position += 1
+            result |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return result
+            shift += 7
+
+    while position < end:
+        key = varint()
+        number, wire = key >> 3, key & 7
+        if wire == 0:
+            value = varint()
+        elif wire == 1 or wire == 5:
+            size = 8 if wire == 1 else 4
+            value = int.from_bytes(data[position:position + size], "little")
+            position += size
+        elif wire == 2:
+            size = varint()
+            value = data[position:position + size]
+            position += size
+        else:
+            raise ValueError(f"unsupported wire type {wire}")
+        if position > end:
+            raise ValueError("truncated field")
+        fields.setdefault(number, []).append(value)
+    return fields
+
+
+def _first(fields: Dict[int, List], number: int, default=None):
+    values = fields.get(number)
+    return values[-1] if values else default
+
+
+def _signed32(value: int) -> int:
+    value &= 0xFFFFFFFF
+    return value - (1 << 32) if value & 0x80000000 else value
+
+
+# --- Rust+ messages ---
+
+class AppEvent(NamedTuple):
+    """The parts of an AppMessage the intake uses"""
+    kind: str  # RESPONSE, ENTITY or TEAM_CHAT
+    seq: int = 0
+    error: Optional[str] = None
+    entity_id: int = 0
+    entity_type: int = 0
+    value: Optional[bool] = None
+    name: str = ""  # team chat sender
+    text: str = ""  # team chat message
+    time: Optional[int] = None  # team chat Unix time
+
+
+def encode_request(seq: int, player_id: int, player_token: int, entity_id: Optional[int] = None,
+                   get_entity_info: bool = False, get_team_chat: bool = False) -> bytes:
+    return encode_fields((REQ_SEQ, seq), (REQ_PLAYER_ID, player_id), (REQ_PLAYER_TOKEN, player_token),
+                         (REQ_ENTITY_ID, entity_id),
+                         (REQ_GET_TEAM_CHAT, b"" if get_team_chat else None),
+                         (REQ_GET_ENTITY_INFO, b"" if get_entity_info else None))
+
+
+def decode_request(data: bytes) -> Dict:
+    """An AppRequest as a dict (for the fake server)"""
+    fields = decode_fields(data)
+    return {"seq": _first(fields, REQ_SEQ, 0), "player_id": _first(fields, REQ_PLAYER_ID, 0),
+            "player_token": _signed32(_first(fields, REQ_PLAYER_TOKEN, 0)),
+            "entity_id": _first(fields, REQ_ENTITY_ID),
+            "get_entity_info": REQ_GET_ENTITY_INFO in fields, "get_team_chat": REQ_GET_TEAM_CHAT in fields}
+
+
+def encode_entity_info(seq: int, entity_type: int, value: bool) -> bytes:
+    """AppMessage answering getEntityInfo"""
+    info = encode_fields((1, entity_type), (3, encode_fields((1, value))))
+    return encode_fields((MSG_RESPONSE, encode_fields((RESP_SEQ, seq), (RESP_ENTITY_INFO, info))))
+
+
+def encode_error(seq: int, error: str) -> bytes:
+    return encode_fields((MSG_RESPONSE, encode_fields((RESP_SEQ, seq), (RESP_ERROR, encode_fields((1, error))))))
+
+
+def encode_entity_changed(entity_id: int, value: bool) -> bytes:
+    changed = encode_fields((1, entity_id), (2, encode_fields((1, value))))
+    return encode_fields((MSG_BROADCAST, encode_fields((BROADCAST_ENTITY_CHANGED, changed))))
+
+
+def encode_team_message(steam_id: int, name: str, text: str, sent: int, color: str = "#5af") -> bytes:
+    message = encode_fields((1, steam_id), (2, name), (3, text), (4, color), (5, sent))
+    return encode_fields((MSG_BROADCAST, encode_fields((BROADCAST_TEAM_MESSAGE, encode_fields((1, message))))))
+
+
+def parse_app_message(data: bytes) -> Optional[AppEvent]:
+    """Decode an AppMessage; None for broadcasts the intake doesn't use"""
+    message = decode_fields(data)
+    response = _first(message, MSG_RESPONSE)
+    if response is not None:
+        fields = decode_fields(response)
+        error = _first(fields, RESP_ERROR)
+        info = _first(fields, RESP_ENTITY_INFO)
+        entity_type = value = None
+        if info is not None:
+            info = decode_fields(info)
+            entity_type = _first(info, 1, 0)
+            value = bool(_first(decode_fields(_first(info, 3, b"")), 1, 0))
+        return AppEvent(RESPONSE, seq=_first(fields, RESP_SEQ, 0),
+                        error=_first(decode_fields(error), 1, b"").decode("utf-8", "replace") if error else None,
+                        entity_type=entity_type or 0, value=value)
+
+    broadcast = _first(message, MSG_BROADCAST)
+    if broadcast is None:
+        return None
+    fields = decode_fields(broadcast)
+    changed = _first(fields, BROADCAST_ENTITY_CHANGED)
+    if changed is not None:
+        changed = decode_fields(changed)
+        payload = decode_fields(_first(changed, 2, b""))
+        return AppEvent(ENTITY, entity_id=_first(changed, 1, 0), value=bool(_first(payload, 1, 0)))
+    team = _first(fields, BROADCAST_TEAM_MESSAGE)
+    if team is not None:
+        message = decode_fields(_first(decode_fields(team), 1, b""))
+        return AppEvent(TEAM_CHAT, name=_first(message, 2, b"").decode("utf-8", "replace"),
+                        text=_first(message, 3, b"").decode("utf-8", "replace"), time=_first(message, 5))
+    return None
+
+
+# --- intake ---
+
+class RustPlusSettings(NamedTuple):
+    url: str
+    player_id: int
+    player_token: int
+    entities: Dict[int, str]  # entity id -> name, the text rules are matched against
+    team_chat: bool
+    rules: List[Rule]
+    capture_path: Optional[str]
+
+    @property
+    def connection(self) -> Tuple:
+        """What a reconnect is needed for"""
+        return self.url, self.player_id, self.player_token, tuple(sorted(self.entities)), self.team_chat
+
+
+def rustplus_settings(config: Dict) -> Optional[RustPlusSettings]:
+    """Settings from the ``rustplus`` section; None when it's missing or incomplete"""
+    section = config.get("rustplus")
+    if not section or not section.get("server") or not section.get("player_id"):
+        return None
+    url = section.get("url") or f"ws://{section['server']}:{int(section.get('port', 28082))}"
+    entities = {int(entity_id): str(name) for entity_id, name in section.get("entities", {}).items()}
+    return RustPlusSettings(url, int(section["player_id"]), int(section.get("player_token", 0)), entities,
+                            bool(section.get("team_chat", False)), parse_rules(section.get("rules")),
+                            section.get("capture_path"))
+
+
+class RustPlusIntake:
+    """Listens to one Rust+ server on the current event loop, reconnecting as needed"""
+
+    def __init__(self, config: Dict, on_event: Callable[[AlarmEvent], None],
+                 on_status: Optional[Callable[[str, str], None]] = None):
+        self.config = config
+        self.on_event = on_event
+        self.on_status = on_status or (lambda message, color: None)
+        self.running = True
+        self.settings = rustplus_settings(config)
+        self._seq = 0
+        self._events = 0
+        self._states: Dict[int, bool] = {}  # last known value per entity
+        self._pending: Dict[int, asyncio.Future] = {}  # seq -> response
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self):
+        """Connect and listen until ``stop()``; returns at once without a rustplus section"""
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        if not self.running or self.settings is None:
+            return
+        if websockets is None:
+            log.error("Rust+ needs the websockets package: pip install websockets")
+            self.on_status("ERROR: Rust+ needs the websockets package", "red")
+            return
+        try:
+            await self._run()
+        except asyncio.CancelledError:
+            if self.running:
+                raise
+            log.info("Rust+ connection closed")
+
+    def stop(self):
+        """Disconnect now, from any thread"""
+        self.running = False
+        loop, task = self._loop, self._task
+        if loop is not None and task is not None:
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                pass  # the loop already finished
+
+    def apply_config(self, config: Dict) -> bool:
+        """Swap in new entity names and rules (any thread); False when a reconnect is needed"""
+        settings = rustplus_settings(config)
+        current = self.settings
+        if (settings is None) != (current is None) or (settings and settings.connection != current.connection):
+            return False
+        self.settings = settings
+        self.config = config
+        return True
+
+    async def _run(self):
+        attempt = 0
+        while self.running:
+            settings = self.settings
+            try:
+                log.info("Connecting to Rust+ server...", extra=kv(url=settings.url, entities=len(settings.entities)))
+                async with websockets.connect(settings.url, open_timeout=REQUEST_TIMEOUT,
+                                              max_size=2 ** 22) as connection:
+                    attempt = 0
+                    await self._session(connection, settings)
+                log.warning("Rust+ server closed the connection, reconnecting", extra=kv(url=settings.url))
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+                log.error("Rust+ connection failed: %s", e, extra=throttle("rustplus-error", 30, url=settings.url))
+                self.on_status(f"Rust+ error: {str(e)[:50]}", "red")
+            delay = RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)]
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _session(self, connection, settings: RustPlusSettings):
+        receiver = asyncio.ensure_future(self._receive(connection, settings))
+        try:
+            # getEntityInfo subscribes this connection to the entity's changes
+            answers = await asyncio.gather(*(self._request(connection, settings, entity_id, get_entity_info=True)
+                                             for entity_id in settings.entities))
+            for entity_id, answer in zip(settings.entities, answers):
+                if answer.error:
+                    log.warning("Rust+ entity %s unavailable: %s", settings.entities[entity_id], answer.error,
+                                extra=kv(entity=entity_id))
+                else:
+                    self._states[entity_id] = bool(answer.value)
+            if settings.team_chat:
+                await self._request(connection, settings, get_team_chat=True)
+            watched = sum(1 for answer in answers if not answer.error)
+            self.on_status(f"✓ Connected to Rust+! Watching {watched} alarms...", "green")
+            log.info("✓ Connected to Rust+", extra=kv(url=settings.url, watching=watched))
+            await receiver
+        finally:
+            receiver.cancel()
+
+    async def _request(self, connection, settings: RustPlusSettings, entity_id: Optional[int] = None,
+                       **request) -> AppEvent:
+        self._seq += 1
+        seq = self._seq
+        future = self._pending[seq] = asyncio.get_running_loop().create_future()
+        await connection.send(encode_request(seq, settings.player_id, settings.player_token, entity_id, **request))
+        try:
+            return await asyncio.wait_for(future, REQUEST_TIMEOUT)
+        finally:
+            self._pending.pop(seq, None)
+
+    async def _receive(self, connection, settings: RustPlusSettings):
+        capture = open(settings.capture_path, "a") if settings.capture_path else None
+        try:
+            async for frame in connection:
+                if isinstance(frame, str):
+                    continue
+                if capture:
+                    capture.write(frame.hex() + "\n")
+                    capture.flush()
+                try:
+                    message = parse_app_message(frame)
+                except ValueError as e:
+                    log.warning("Undecodable Rust+ message: %s", e, extra=kv(size=len(frame)))
+                    continue
+                if message is None:
+                    continue
+                if message.kind == RESPONSE:
+                    future = self._pending.get(message.seq)
+                    if future and not future.done():
+                        future.set_result(message)
+                elif message.kind == ENTITY:
+                    self._entity_changed(message)
+                elif message.kind == TEAM_CHAT and self.settings.team_chat:
+                    self._alarm("team", message.text, message.time)
+        finally:
+            if capture:
+                capture.close()
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Rust+ connection closed"))
+
+    def _entity_changed(self, message: AppEvent):
+        was_on = self._states.get(message.entity_id, False)
+        self._states[message.entity_id] = message.value
+        name = self.settings.entities.get(message.entity_id)
+        log.debug("Entity changed", extra=kv(entity=message.entity_id, value=message.value))
+        if name is not None and message.value and not was_on:
+            self._alarm(f"entity:{message.entity_id}", name)
+
+    def _alarm(self, chat_id: str, text: str, sent: Optional[int] = None):
+        trace = AlarmTrace(float(sent) if sent else None)
+        self._events += 1
+        rule = match_rule(self.settings.rules, text)
+        journal.record(UPDATE, source="rustplus", bot=self.settings.url, chat_id=chat_id, message_id=self._events,
+                       rule=rule.name if rule else None, text=text)
+        if rule is None:
+            log.debug("No rule matched", extra=kv(chat=chat_id, text=text))
+            return
+        trace.mark_matched()
+        log.info("✓ Rust+ alarm: %s", text, extra=kv(chat=chat_id, rule=rule.name))
+        self.on_event(AlarmEvent("rustplus", self.settings.url, chat_id, self._events, text, rule, trace))
@@ -0,0 +1,175 @@
+"""
+Priority scheduling of alarms per device
+
+Rules can carry a ``priority`` (higher wins, default 0) and a ``hold`` time
+in seconds during which their state should stay on the device::
+
+    {"name": "raid", "match": "raid", "priority": 10, "hold": 30, "action": "effect", "effect": "38"},
+    {"name": "cargo", "match": "cargo", "priority": 1, "action": "color", "color": "#00ff00"}
+
+While a held alarm is active, lower-priority alarms for the same target
+(device, segment or LED range) are deferred until it ends, or dropped when
+their rule says ``"when_busy": "drop"``. A higher-priority alarm preempts a
+held one, which resumes for the rest of its hold afterwards. Alarms of
+equal priority replace each other, newest first, as before. An alarm
+without a hold of its own (equal or higher priority) is shown without
+ending the held alarm, which keeps deferring lower priorities.
+
+Deciding costs a dictionary lookup and a comparison; only held alarms
+start a timer.
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from app_logging import get_logger, kv
+from journal import SCHEDULE, journal
+from metrics import AlarmTrace
+
+log = get_logger("sched")
+
+RUN = "run"
+DEFERRED = "deferred"
+DROPPED = "dropped"
+
+DEFAULT_MAX_DEFER = 60.0  # seconds a deferred alarm may wait before it's stale
+
+
+class _Entry:
+    __slots__ = ("config", "priority", "hold", "max_defer", "queued", "until")
+
+    def __init__(self, config: Dict, priority: int, hold: float, max_defer: float):
+        self.config = config
+        self.priority = priority
+        self.hold = hold  # seconds left to show once (re)started
+        self.max_defer = max_defer
+        self.queued = time.monotonic()
+        self.until = 0.0
+
+    def stale(self, now: float) -> bool:
+        return now - self.queued > self.max_defer
+
+
+class _Target:
+    __slots__ = ("active", "pending", "timer")
+
+    def __init__(self):
+        self.active: Optional[_Entry] = None
+        self.pending: List[_Entry] = []
+        self.timer: Optional[threading.Timer] = None
+
+
+class PriorityScheduler:
+    """Arbitrates between alarms per target and calls ``run`` for the winners.
+
+    ``run(config, trace)`` must not block; it normally claims the device and
+    queues the action. ``target_of(config)`` names the target an action
+    writes to.
+    """
+
+    def __init__(self, run: Callable[[Dict, Optional[AlarmTrace]], None],
+                 target_of: Callable[[Dict], Optional[str]]):
+        self._run = run
+        self._target_of = target_of
+        self._targets: Dict[str, _Target] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, config: Dict, trace: Optional[AlarmTrace] = None) -> str:
+        """Run, defer or drop an alarm's action; returns RUN, DEFERRED or DROPPED"""
+        key = self._target_of(config)
+        if key is None:
+            self._run(config, trace)  # not configured: let dispatch report it
+            return RUN
+        # Rules validate these when they load (see rules.py)
+        entry = _Entry(config, int(config.get("priority", 0)), float(config.get("hold", 0)),
+                       float(config.get("max_defer", DEFAULT_MAX_DEFER)))
+        now = time.monotonic()
+
+        with self._lock:
+            target = self._targets.setdefault(key, _Target())
+            active = target.active if target.active and target.active.until > now else None
+            if active and entry.priority < active.priority:
+                if config.get("when_busy", "defer") == "drop":
+                    decision = DROPPED
+                else:
+                    target.pending = [p for p in target.pending if not p.stale(now)]
+                    target.pending.append(entry)
+                    decision = DEFERRED
+                active_priority = active.priority
+            else:
+                if entry.hold > 0:
+                    if active and active.priority < entry.priority:
+                        # Preempted: resume for the rest of its hold afterwards
+                        active.hold = active.until - now
+                        active.queued = now
+                        target.pending.append(active)
+                    self._activate(key, target, entry, now)
+                # A one-shot is only shown: a held alarm keeps its timer,
+                # which starts the deferred alarms when it ends
+                decision = RUN
+
+        if decision == RUN:
+            self._run(config, trace)
+        else:
+            log.info("Alarm %s, higher priority alarm active", decision,
+                     extra=kv(target=key, priority=entry.priority, active=active_priority))
+            journal.record(SCHEDULE, trace, device=key, action=config.get("action"), result=decision)
+        return decision
+
+    def _activate(self, key: str, target: _Target, entry: _Entry, now: float):
+        """Make a held entry the target's active alarm (under the lock)"""
+        if target.timer:
+            target.timer.cancel()
+        entry.until = now + entry.hold
+        target.active = entry
+        target.timer = threading.Timer(entry.hold, self._expire, args=(key, entry))
+        target.timer.daemon = True
+        target.timer.start()
+
+    def _expire(self, key: str, entry: _Entry):
+        """A hold ended: start the best pending alarms"""
+        now = time.monotonic()
+        resumed: List[_Entry] = []
+        with self._lock:
+            target = self._targets.get(key)
+            if target is None or target.active is not entry:
+                return  # replaced meanwhile
+            target.active = None
+            target.timer = None
+            target.pending = [p for p in target.pending if not p.stale(now)]
+            # Highest priority first; among equals the newest replaces the
+            # rest. One-shots don't hold the device, so continue down to the
+            # next held alarm, which defers whatever is left
+            while target.pending:
+                best = max(target.pending, key=lambda p: (p.priority, p.queued))
+                target.pending = [p for p in target.pending if p.priority != best.priority]
+                resumed.append(best)
+                if best.hold > 0:
+                    self._activate(key, target, best, now)
+                    break
+
+        # Lowest first, so the highest priority is what stays on the device.
+        # No trace: a resumed alarm is not a delivery latency sample and its
+        # deadline starts now
+        for alarm in reversed(resumed):
+            log.info("Resuming alarm after higher priority alarm ended",
+                     extra=kv(target=key, priority=alarm.priority, hold=f"{alarm.hold:.0f}s"))
+            self._run(alarm.config, None)
+
+    def cancel(self):
+        """Stop all hold timers (on shutdown)"""
+        with self._lock:
+            for target in self._targets.values():
+                if target.timer:
+                    target.timer.cancel()
+            self._targets.clear()
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Active priority and queue length per target, for diagnostics"""
+        now = time.monotonic()
+        with self._lock:
+            return {key: {"active": target.active.priority if target.active else None,
+                          "remaining": max(0.0, target.active.until - now) if target.active else 0.0,
+                          "pending": len(target.pending)}
+                    for key, target in self._targets.items()}
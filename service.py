@@ -0,0 +1,444 @@
+"""
+Multi-tenant service: one process for a whole clan's bots and lights
+
+Instead of one app per player, ``python service.py tenants/`` serves every
+tenant found in a directory::
+
+    tenants/
+        alice/config.json
+        bob/config.json
+
+Each ``config.json`` is an ordinary app config (bots, chats, rules, lights,
+Rust+ and webhook sections). All tenants share one asyncio loop for their
+intakes, one httpx pool for the Bot API, the LED connection pools and a
+fixed set of LED threads, so a tenant costs a few idle tasks and a
+long-poll connection per bot rather than a process.
+
+Per tenant:
+
+- its own priority scheduler; holds and priorities only compete within it
+- a rate limit of ``alarms_per_minute`` (default 30, 0 = none) with bursts
+  of up to ``alarm_burst`` (default 10); alarms over it are dropped and
+  journaled
+- at most ``max_parallel_actions`` (default 2) actions on the LED threads at
+  a time, so a tenant with unreachable lights can't take them all
+- failures stay inside: a config that doesn't parse (limits included) or a
+  bot that won't connect is logged, and every other tenant keeps running
+
+Webhooks are per tenant too, so each tenant with a ``webhook`` section needs
+its own ``port``. Tenants sharing one are logged as an error; only the first
+to bind the port gets webhook events.
+
+Every tenant connects at once when the service starts, so the time until
+all bots are long-polling grows with their number and with the Bot API's
+latency.
+
+The directory is checked every ``SCAN_INTERVAL`` seconds: new tenants start,
+removed ones stop and edited configs are applied as in the app (chats and
+rules in place, new tokens reconnect that tenant only). Each tenant's last
+handled message per chat is written back to its config.json then too.
+
+Needs no Qt; the journal and the Prometheus endpoint are shared.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from app_logging import configure_logging, get_logger, kv, throttle
+from config_reload import diff_config, merge_progress
+from dispatch import ActionPlans, action_plans, claim_device, execute_action, target_of
+from dmx import close_senders
+from journal import SCHEDULE, journal
+from metrics import start_metrics_server
+from mqtt_transport import close_links
+from profiler import profiler
+from rules import AlarmEvent
+from rustplus import RustPlusIntake
+from scheduler import PriorityScheduler
+from telegram_intake import TelegramIntake
+from webhook import WebhookIntake, webhook_settings
+
+log = get_logger("service")
+
+CONFIG_NAME = "config.json"
+SCAN_INTERVAL = 2.0  # seconds between checks of the tenants directory
+DEFAULT_ALARMS_PER_MINUTE = 30
+DEFAULT_ALARM_BURST = 10
+DEFAULT_PARALLEL_ACTIONS = 2
+PLANS_PER_TENANT = 8  # compiled actions kept per tenant (main config plus rule overrides)
+RATE_LIMITED = "rate_limited"
+# Per-tenant limits: type, default and lowest value (lower ones are raised to it)
+LIMITS = {
+    "alarms_per_minute": (float, DEFAULT_ALARMS_PER_MINUTE, 0),
+    "alarm_burst": (int, DEFAULT_ALARM_BURST, 1),
+    "max_parallel_actions": (int, DEFAULT_PARALLEL_ACTIONS, 1),
+}
+
+
+class RateLimit:
+    """Token bucket: ``burst`` alarms at once, refilled at ``per_minute``"""
+
+    def __init__(self, per_minute: float, burst: int):
+        self.per_minute = per_minute
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def allow(self) -> bool:
+        if self.per_minute <= 0:
+            return True  # no limit
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class Lane:
+    """A tenant's share of the LED threads: at most ``limit`` of its actions run at once"""
+
+    def __init__(self, pool: ThreadPoolExecutor, limit: int):
+        self.pool = pool
+        self.limit = limit
+        self._running = 0
+        self._queued = deque()
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable, *args):
+        """Queue fn(*args); called from the loop and from scheduler timers"""
+        with self._lock:
+            if self._running >= self.limit:
+                self._queued.append((fn, args))
+                return
+            self._running += 1
+        self._start(fn, args)
+
+    def _start(self, fn: Callable, args: Tuple):
+        try:
+            self.pool.submit(fn, *args).add_done_callback(self._done)
+        except RuntimeError:
+            pass  # shutting down
+
+    def _done(self, future: Future):
+        with self._lock:
+            if not self._queued or self._running > self.limit:
+                self._running -= 1
+                return
+            fn, args = self._queued.popleft()
+        self._start(fn, args)
+
+
+def tenant_limits(config: Dict) -> Tuple[float, int, int]:
+    """alarms_per_minute, alarm_burst and max_parallel_actions; raises ValueError"""
+    values = []
+    for key, (kind, default, lowest) in LIMITS.items():
+        value = config.get(key, default)
+        try:
+            value = kind(value)
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError(f"{key} must be a number, not {value!r}") from None
+        if math.isnan(value):
+            raise ValueError(f"{key} must be a number, not {value!r}")
+        values.append(max(lowest, value))
+    return tuple(values)
+
+
+def webhook_port(config: Dict) -> Optional[int]:
+    """The port the tenant's webhook listens on, None without one; raises ValueError"""
+    try:
+        settings = webhook_settings(config)
+    except (AttributeError, TypeError, ValueError) as e:
+        raise ValueError(f"webhook: {e}") from None
+    return settings.port if settings else None
+
+
+def read_config(path: str) -> Tuple[Dict, str]:
+    """A tenant's config and the text it was parsed from; raises OSError or ValueError"""
+    with open(path, "r") as f:
+        text = f.read()
+    config = json.loads(text)
+    if not isinstance(config, dict):
+        raise ValueError("expected a JSON object")
+    tenant_limits(config)
+    webhook_port(config)
+    return config, text
+
+
+class Tenant:
+    """One user's intakes, scheduler, rate limit and share of the LED threads"""
+
+    def __init__(self, name: str, path: str, config: Dict, text: str, pool: ThreadPoolExecutor):
+        self.name = name
+        self.path = path
+        self.config = config
+        self.text = text  # the file contents self.config corresponds to
+        self.stamp = None  # (mtime, size) of the file when last read
+        self.limit = RateLimit(DEFAULT_ALARMS_PER_MINUTE, DEFAULT_ALARM_BURST)
+        self.lane = Lane(pool, DEFAULT_PARALLEL_ACTIONS)
+        self.scheduler = PriorityScheduler(self._dispatch, target_of)
+        self.intakes = []
+        self.task: Optional[asyncio.Task] = None
+        self._progress_changed = False
+        self._apply_limits(config)
+        self.webhook_port = webhook_port(config)
+
+    def _apply_limits(self, config: Dict):
+        self.limit.per_minute, self.limit.burst, self.lane.limit = tenant_limits(config)
+
+    def start(self, client: httpx.AsyncClient):
+        """Start the intakes as a task on the running loop"""
+        status = lambda message, color: log.debug(message, extra=kv(tenant=self.name))
+        self.intakes = [
+            TelegramIntake(self.config, self._on_event, on_status=status, on_progress=self._save_progress,
+                           client=client, bot_prefix=f"{self.name}/"),
+            RustPlusIntake(self.config, self._on_event, on_status=status),
+            WebhookIntake(self.config, self._on_event, on_status=status),
+        ]
+        self.task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        try:
+            await asyncio.gather(*(intake.run() for intake in self.intakes))
+        except Exception as e:
+            log.error("Tenant stopped: %s", e, extra=kv(tenant=self.name))
+
+    async def stop(self):
+        for intake in self.intakes:
+            intake.stop()
+        if self.task is not None:
+            await asyncio.gather(self.task, return_exceptions=True)
+        self.scheduler.cancel()
+
+    def apply_config(self, config: Dict, text: str) -> bool:
+        """Take an edited config; True when the intakes have to be restarted"""
+        config = merge_progress(self.config, config)
+        self.text = text
+        change = diff_config(self.config, config)
+        if not change.keys:
+            return False
+        log.info("Reloading config", extra=kv(tenant=self.name, changed=",".join(sorted(change.keys))))
+        self.config = config
+        self._apply_limits(config)
+        self.webhook_port = webhook_port(config)
+        if change.reconnect or self.task is None or self.task.done():
+            return True
+        return not all(intake.apply_config(config) for intake in self.intakes)
+
+    def _on_event(self, event: AlarmEvent):
+        """A matched alarm (on the loop): rate limit, then the scheduler"""
+        if not self.limit.allow():
+            log.warning("Alarm over the rate limit, dropped",
+                        extra=throttle(f"rate-limit:{self.name}", 30, tenant=self.name, rule=event.rule.name,
+                                       per_minute=self.limit.per_minute))
+            journal.record(SCHEDULE, event.trace, source=event.source, bot=event.bot, result=RATE_LIMITED)
+            return
+        self.scheduler.submit(event.rule.apply(self.config), event.trace)
+
+    def _dispatch(self, config: Dict, trace):
+        # Claimed now so the alarm supersedes older ones queued in the lane
+        self.lane.submit(execute_action, config, trace, claim_device(config, trace))
+
+    def _save_progress(self, chat_id: str, message_id: int):
+        self.config.setdefault("last_message_ids", {})[chat_id] = message_id
+        if chat_id == str(self.config.get("telegram_chat_id", "")):
+            self.config["last_message_id"] = message_id
+        self._progress_changed = True
+
+    def write_progress(self):
+        """Write the config back if messages were handled, unless the file was edited meanwhile"""
+        if not self._progress_changed:
+            return
+        try:
+            with open(self.path, "r") as f:
+                if f.read() != self.text:
+                    return  # reloaded with the next scan, then written
+            text = json.dumps(self.config, indent=4)
+            with open(self.path + ".tmp", "w") as f:
+                f.write(text)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            log.error("Could not save progress: %s", e, extra=kv(tenant=self.name))
+            return
+        self.text = text
+        self.stamp = _stamp(self.path)
+        self._progress_changed = False
+
+
+def _stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class Service:
+    """Runs every tenant under ``root`` on the current event loop until ``stop()``"""
+
+    def __init__(self, root: str, led_workers: int = 32):
+        self.root = root
+        self.tenants: Dict[str, Tenant] = {}
+        self.pool = ThreadPoolExecutor(max_workers=led_workers, thread_name_prefix="led-action")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopped: Optional[asyncio.Event] = None
+        self._port_clashes: Dict[int, List[str]] = {}
+        self._skipped: Dict[str, Optional[Tuple[int, int]]] = {}  # unreadable new tenants, by stamp
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        # One pool for every tenant's bots; each holds a long-poll plus a spare connection
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(30.0)) as client:
+            try:
+                while not self._stopped.is_set():
+                    self._scan(client)
+                    try:
+                        await asyncio.wait_for(self._stopped.wait(), SCAN_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                await asyncio.gather(*(tenant.stop() for tenant in self.tenants.values()))
+                for tenant in self.tenants.values():
+                    tenant.write_progress()
+                self.pool.shutdown(wait=False, cancel_futures=True)
+        log.info("Service stopped")
+
+    def stop(self):
+        """Shut down, from any thread or a signal handler"""
+        loop, stopped = self._loop, self._stopped
+        if loop is not None and stopped is not None:
+            loop.call_soon_threadsafe(stopped.set)
+
+    def _scan(self, client: httpx.AsyncClient):
+        """Start, reload and stop tenants to match the directory"""
+        try:
+            names = {entry.name for entry in os.scandir(self.root)
+                     if entry.is_dir() and os.path.isfile(os.path.join(entry.path, CONFIG_NAME))}
+        except OSError as e:
+            log.error("Cannot read tenants directory %s: %s", self.root, e)
+            return
+        for name in sorted(self.tenants.keys() - names):
+            log.info("Tenant removed", extra=kv(tenant=name))
+            asyncio.ensure_future(self.tenants.pop(name).stop())
+        for name in self._skipped.keys() - names:
+            del self._skipped[name]
+        for name in sorted(names):
+            tenant = self.tenants.get(name)
+            path = os.path.join(self.root, name, CONFIG_NAME)
+            stamp = _stamp(path)
+            if tenant is not None:
+                tenant.write_progress()
+                if stamp == tenant.stamp:
+                    continue
+            try:
+                config, text = read_config(path)
+            except (OSError, ValueError) as e:
+                reported = self._skipped.get(name, False) if tenant is None else tenant.stamp
+                if stamp != reported:
+                    log.error("Tenant config unreadable, %s: %s", "skipped" if tenant is None else
+                              "keeping the current settings", e, extra=kv(tenant=name))
+                if tenant is None:
+                    self._skipped[name] = stamp
+                else:
+                    tenant.stamp = stamp
+                continue
+            self._skipped.pop(name, None)
+            if tenant is None:
+                tenant = self.tenants[name] = Tenant(name, path, config, text, self.pool)
+                tenant.stamp = stamp
+                tenant.start(client)
+                log.info("Tenant started", extra=kv(tenant=name))
+            else:
+                tenant.stamp = stamp
+                if text != tenant.text and tenant.apply_config(config, text):
+                    asyncio.ensure_future(self._restart(tenant, client))
+        self._check_webhook_ports()
+        # Keep every tenant's compiled actions cached
+        action_plans.MAX_PLANS = max(ActionPlans.MAX_PLANS, PLANS_PER_TENANT * len(self.tenants))
+
+    def _check_webhook_ports(self):
+        """Report tenants whose webhooks share a port, once per change"""
+        owners: Dict[int, List[str]] = {}
+        for name, tenant in sorted(self.tenants.items()):
+            if tenant.webhook_port is not None:
+                owners.setdefault(tenant.webhook_port, []).append(name)
+        clashes = {port: names for port, names in owners.items() if len(names) > 1}
+        for port, names in clashes.items():
+            if self._port_clashes.get(port) != names:
+                log.error("Tenants share webhook port %d, only one of them gets its events; "
+                          "give each tenant its own port", port, extra=kv(tenants=",".join(names)))
+        self._port_clashes = clashes
+
+    async def _restart(self, tenant: Tenant, client: httpx.AsyncClient):
+        log.info("Connection settings changed, reconnecting...", extra=kv(tenant=tenant.name))
+        await tenant.stop()
+        if self.tenants.get(tenant.name) is tenant:
+            tenant.start(client)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="RustPlusLED multi-tenant service")
+    parser.add_argument("tenants", help="directory with one sub-directory (holding a config.json) per tenant")
+    parser.add_argument("--led-workers", type=int, default=32, help="LED threads shared by all tenants (default 32)")
+    parser.add_argument("--journal", default="journal.db", help="shared event journal (\"\" = off)")
+    parser.add_argument("--journal-max-mb", type=int, default=200, help="journal size limit (default 200)")
+    parser.add_argument("--metrics-port", type=int, default=9464, help="Prometheus metrics port (0 = off)")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="address for the metrics endpoint")
+    parser.add_argument("--log-level", default="INFO", help="DEBUG, INFO, WARNING or ERROR")
+    parser.add_argument("--profile", action="store_true",
+                        help="sample every thread's stack until exit and write flame graph files under profiles/")
+    parser.add_argument("--profile-interval", type=float, default=10, help="milliseconds between samples (default 10)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    configure_logging(args.log_level, with_time=True)
+    if not os.path.isdir(args.tenants):
+        log.error("Tenants directory %s not found", args.tenants)
+        return 1
+    if args.journal:
+        journal.open(args.journal, args.journal_max_mb * 1024 * 1024)
+    metrics_server = start_metrics_server(args.metrics_port, host=args.metrics_host) if args.metrics_port else None
+    if args.profile:
+        profiler.start(args.profile_interval / 1000)
+    service = Service(args.tenants, args.led_workers)
+
+    async def serve():
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, service.stop)
+            except NotImplementedError:  # Windows
+                signal.signal(signum, lambda *_: service.stop())
+        await service.run()
+
+    try:
+        asyncio.run(serve())
+    finally:
+        profiler.stop()
+        if metrics_server:
+            metrics_server.shutdown()
+        journal.close()
+        close_links()
+        close_senders()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
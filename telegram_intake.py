@@ -0,0 +1,459 @@
+"""
+Telegram intake: one asyncio loop polling any number of bots and chats
+
+All bots share a single httpx connection pool and run as tasks on the same
+event loop. Each bot watches one or more chats, and each chat has its own
+rules (see ``rules.py``). Matched messages are handed to ``on_event`` as
+``AlarmEvent`` objects.
+
+Multiple bots are configured with ``telegram_bots``::
+
+    "telegram_bots": [
+        {"name": "main", "token": "123456789:ABC...",
+         "chats": [{"chat_id": "-1001234567890", "rules": [...]},
+                   {"chat_id": "-1009876543210"}]},
+        {"name": "teammate", "token": "987654321:XYZ...",
+         "chats": [{"chat_id": "-1005555555555", "rules": [...]}]}
+    ]
+
+Without it, the classic ``telegram_bot_token`` / ``telegram_chat_id`` pair
+(plus optional top-level ``rules``) is used as a single bot.
+
+An intake normally owns its connection pool. ``service.py`` runs one intake
+per tenant and passes them all the same ``client``.
+
+On startup each bot first drains the updates Telegram queued while the app
+was off, in pages and without touching any device, then applies
+``catchup_policy``:
+
+- ``"skip"`` (default): ignore the backlog and start from the newest update
+- ``"replay"``: run every alarm from the last ``catchup_minutes`` minutes
+- ``"coalesce"``: run only the newest alarm of the whole backlog
+
+Each bot catches up on its own, so one that can't reach Telegram doesn't
+hold back the others; with several bots, ``"coalesce"`` runs the newest
+alarm of each bot's backlog. A failed backlog fetch is retried with backoff
+rather than handled as live updates.
+
+Only updates dated before the intake started are backlog; alarms posted
+while the bots were connecting are handled like any live alarm.
+
+After that, every bot long-polls: Telegram holds each ``getUpdates`` open
+for up to ``LONG_POLL_TIMEOUT`` seconds and answers as soon as a message
+arrives, so an idle app makes one request per bot every 25 s and nothing in
+between. ``stop()`` cancels the polling task from any thread, which aborts
+in-flight requests at once.
+"""
+
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+from telegram import Bot
+from telegram.error import NetworkError, TelegramError, TimedOut
+from telegram.request import BaseRequest, RequestData
+
+from app_logging import DEBUG, get_logger, kv, throttle
+from journal import UPDATE, journal
+from metrics import AlarmTrace
+from rules import AlarmEvent, Rule, match_rule, parse_rules
+
+log = get_logger("telegram")
+
+TELEGRAM_API_URL = "https://api.telegram.org/bot"
+
+CATCHUP_POLICIES = ("skip", "replay", "coalesce")
+BACKLOG_PAGE_SIZE = 100  # getUpdates maximum
+LONG_POLL_TIMEOUT = 25  # seconds Telegram may hold a getUpdates request
+DRAIN_RETRY_DELAYS = (1, 2, 5, 10, 30)  # seconds between backlog fetch attempts, the last one repeats
+# Updates dated this close to the start are live, not backlog: Telegram dates
+# are whole seconds from Telegram's clock, not ours
+BACKLOG_GRACE = 2.0
+
+
+class ChatRoute:
+    """A watched chat and its rules"""
+
+    __slots__ = ("chat_id", "rules")
+
+    def __init__(self, chat_id: str, rules: List[Rule]):
+        self.chat_id = chat_id
+        self.rules = rules
+
+
+class BotSpec:
+    """One bot token and the chats it watches"""
+
+    __slots__ = ("name", "token", "chats")
+
+    def __init__(self, name: str, token: str, chats: Dict[str, ChatRoute]):
+        self.name = name
+        self.token = token
+        self.chats = chats
+
+
+def valid_token(token: str) -> bool:
+    """Bot tokens look like 123456789:ABCdefGHI..."""
+    return bool(token) and len(token.split(":")) == 2
+
+
+def bot_specs_from_config(config: Dict, prefix: str = "") -> Tuple[List[BotSpec], List[str]]:
+    """Build bot specs from the config; returns (specs, configuration errors).
+
+    ``prefix`` goes in front of every bot name (the tenant in ``service.py``).
+    """
+    entries = config.get("telegram_bots")
+    if not entries:
+        # Classic single bot / single chat settings
+        entries = [{
+            "name": "bot",
+            "token": config.get("telegram_bot_token", ""),
+            "chats": [{"chat_id": config.get("telegram_chat_id", ""), "rules": config.get("rules")}],
+        }]
+
+    specs, errors = [], []
+    for i, entry in enumerate(entries):
+        name = prefix + (entry.get("name") or f"bot{i + 1}")
+        token = entry.get("token", "")
+        chats = {str(chat["chat_id"]): ChatRoute(str(chat["chat_id"]), parse_rules(chat.get("rules")))
+                 for chat in entry.get("chats", []) if str(chat.get("chat_id", "")).strip()}
+
+        if not token or not chats:
+            errors.append("ERROR: Telegram bot token or chat ID not set!" if len(entries) == 1
+                          else f"ERROR: Bot '{name}' has no token or chats!")
+        elif not valid_token(token):
+            errors.append("ERROR: Invalid bot token format! Should be like: 123456789:ABCdefGHI..."
+                          if len(entries) == 1 else f"ERROR: Invalid bot token format for '{name}'!")
+        else:
+            specs.append(BotSpec(name, token, chats))
+    return specs, errors
+
+
+def describe_telegram_error(e: TelegramError) -> str:
+    if "Unauthorized" in str(e):
+        return "ERROR: Invalid bot token! Check your bot token."
+    if "Not Found" in str(e):
+        return "ERROR: Bot not found! Check your bot token."
+    if "Forbidden" in str(e):
+        return "ERROR: Bot access forbidden! Make sure bot is active."
+    return f"Telegram error: {str(e)}"
+
+
+class SharedHTTPXRequest(BaseRequest):
+    """python-telegram-bot request backend on a shared httpx client.
+
+    Every bot (and its getUpdates calls) goes through the same connection
+    pool; the owner of the client is responsible for closing it.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, read_timeout: float = 30.0):
+        self._client = client
+        self._read_timeout = read_timeout
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self._read_timeout
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass  # the shared client outlives individual bots
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE) -> Tuple[int, bytes]:
+        defaults = self._client.timeout
+
+        def pick(value, default):
+            return default if value is BaseRequest.DEFAULT_NONE else value
+
+        timeout = httpx.Timeout(connect=pick(connect_timeout, defaults.connect),
+                                read=pick(read_timeout, self._read_timeout),
+                                write=pick(write_timeout, defaults.write),
+                                pool=pick(pool_timeout, defaults.pool))
+        files = request_data.multipart_data if request_data else None
+        data = request_data.json_parameters if request_data else None
+        try:
+            response = await self._client.request(method=method, url=url, timeout=timeout,
+                                                  headers={"User-Agent": self.USER_AGENT},
+                                                  files=files, data=data)
+        except httpx.TimeoutException as err:
+            raise TimedOut from err
+        except httpx.HTTPError as err:
+            raise NetworkError(f"httpx.{err.__class__.__name__}: {err}") from err
+        return response.status_code, response.content
+
+
+class TelegramIntake:
+    """Polls every configured bot concurrently on the current event loop"""
+
+    def __init__(self, config: Dict, on_event: Callable[[AlarmEvent], None],
+                 on_status: Optional[Callable[[str, str], None]] = None,
+                 on_progress: Optional[Callable[[str, int], None]] = None,
+                 client: Optional[httpx.AsyncClient] = None, bot_prefix: str = ""):
+        self.config = config
+        self.on_event = on_event
+        self.on_status = on_status or (lambda message, color: None)
+        self.on_progress = on_progress or (lambda chat_id, message_id: None)
+        self.running = True
+        self.client = client  # shared pool, owned by the caller; None: one of our own
+        self.bot_prefix = bot_prefix
+        self.last_message_ids = self._initial_message_ids(config)
+        self.specs: List[BotSpec] = []
+        self._started = time.time()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _initial_message_ids(config: Dict) -> Dict[str, int]:
+        ids = {str(k): int(v) for k, v in config.get("last_message_ids", {}).items()}
+        legacy_chat = str(config.get("telegram_chat_id", ""))
+        if legacy_chat and legacy_chat not in ids and config.get("last_message_id"):
+            ids[legacy_chat] = int(config["last_message_id"])
+        return ids
+
+    async def run(self):
+        """Connect and poll until ``stop()``"""
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        if not self.running:
+            return  # stopped before the loop was up
+        self._started = time.time()
+        try:
+            await self._run()
+        except asyncio.CancelledError:
+            if self.running:
+                raise
+            log.info("Telegram polling stopped")
+
+    def stop(self):
+        """Stop polling now, from any thread; in-flight requests are cancelled"""
+        self.running = False
+        loop, task = self._loop, self._task
+        if loop is not None and task is not None:
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                pass  # the loop already finished
+
+    async def _run(self):
+        log.info("Starting Telegram bot connection...")
+        self.on_status("Connecting to Telegram...", "orange")
+
+        specs, errors = bot_specs_from_config(self.config, self.bot_prefix)
+        for error_msg in errors:
+            log.error(error_msg)
+            self.on_status(error_msg, "red")
+        if not specs:
+            return
+        self.specs = specs
+
+        if self.client is not None:
+            await self._serve(self.client, specs)
+            return
+        # One pool for all bots: a long-poll plus a spare connection each
+        limits = httpx.Limits(max_connections=2 * len(specs) + 2, max_keepalive_connections=2 * len(specs) + 2)
+        async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(30.0)) as client:
+            await self._serve(client, specs)
+
+    async def _serve(self, client: httpx.AsyncClient, specs: List[BotSpec]):
+        request = SharedHTTPXRequest(client)
+        base_url = self.config.get("telegram_api_url") or TELEGRAM_API_URL
+        bots = [(spec, Bot(token=spec.token, request=request, get_updates_request=request,
+                           base_url=base_url)) for spec in specs]
+
+        connected = await asyncio.gather(*(self._connect(spec, bot) for spec, bot in bots))
+        bots = [(spec, bot) for (spec, bot), username in zip(bots, connected) if username]
+        if not bots:
+            return
+
+        names = ", ".join(f"@{username}" for username in connected if username)
+        self.on_status(f"✓ Connected as {names}! Waiting for messages...", "green")
+        log.info("Starting long polling...",
+                 extra=kv(bots=len(bots), chats=sum(len(spec.chats) for spec, _ in bots)))
+
+        await asyncio.gather(*(self._poll(spec, bot) for spec, bot in bots))
+
+    def apply_config(self, config: Dict) -> bool:
+        """Swap in new chats and rules for the connected bots (any thread).
+
+        Returns False when the bot tokens differ, which needs a reconnect.
+        Each bot's routes are replaced in one assignment, so an update is
+        routed entirely by the old or entirely by the new rules.
+        """
+        specs, _ = bot_specs_from_config(config, self.bot_prefix)
+        by_token = {spec.token: spec for spec in specs}
+        if set(by_token) != {spec.token for spec in self.specs}:
+            return False
+        for spec in self.specs:
+            spec.name = by_token[spec.token].name
+            spec.chats = by_token[spec.token].chats
+        self.config = config
+        return True
+
+    async def _connect(self, spec: BotSpec, bot: Bot) -> Optional[str]:
+        """Check the token with getMe; returns the bot username or None"""
+        log.info("Connecting to bot...", extra=kv(bot=spec.name, token=f"{spec.token[:10]}...{spec.token[-10:]}",
+                                                  chats=",".join(spec.chats)))
+        try:
+            bot_info = await asyncio.wait_for(bot.get_me(), timeout=30.0)
+            log.info("✓ Connected as @%s (%s)", bot_info.username, bot_info.first_name)
+            return bot_info.username
+        except asyncio.TimeoutError:
+            error_msg = "ERROR: Connection timed out! Check your internet connection."
+        except TelegramError as e:
+            error_msg = describe_telegram_error(e)
+        except Exception as e:
+            error_msg = f"Connection failed: {str(e)}"
+        log.error(error_msg, extra=kv(bot=spec.name))
+        self.on_status(error_msg, "red")
+        return None
+
+    async def _catch_up(self, spec: BotSpec, bot: Bot) -> Optional[int]:
+        """Drain the pending backlog and apply the catch-up policy.
+
+        Returns the offset to continue polling from. A failed fetch is
+        retried with backoff from the pages already drained: handling the
+        backlog as new updates would run every stale alarm.
+        """
+        policy = self.config.get("catchup_policy", "skip")
+        if policy not in CATCHUP_POLICIES:
+            log.warning("Unknown catchup_policy %r, using 'skip'", policy)
+            policy = "skip"
+
+        backlog, live, offset = [], [], None
+        started = self._started - BACKLOG_GRACE
+        attempt = 0
+        while self.running:
+            try:
+                page = await asyncio.wait_for(
+                    bot.get_updates(offset=offset, limit=BACKLOG_PAGE_SIZE, timeout=0), timeout=30.0)
+            except Exception as e:
+                delay = DRAIN_RETRY_DELAYS[min(attempt, len(DRAIN_RETRY_DELAYS) - 1)]
+                attempt += 1
+                log.error("Failed to fetch backlog, retrying in %ds: %s", delay, e,
+                          extra=throttle(f"backlog-error:{spec.name}", 30, bot=spec.name))
+                self.on_status(f"Error fetching backlog: {str(e)[:50]}", "red")
+                await asyncio.sleep(delay)  # stop() cancels the sleep
+                continue
+            attempt = 0
+            if not page:
+                break
+            for update in page:
+                message = update.message or update.channel_post
+                if message and message.date and message.date.timestamp() >= started:
+                    live.append(update)
+                else:
+                    backlog.append(update)
+            offset = page[-1].update_id + 1
+            if len(page) < BACKLOG_PAGE_SIZE:
+                break
+        if not self.running:
+            return offset
+
+        # Route everything first: only the policy decides what reaches a device
+        cutoff = time.time() - float(self.config.get("catchup_minutes", 5)) * 60
+        alarms, newest = [], {}
+        for update in backlog:
+            routed = self._route(spec, update)
+            if routed is None:
+                continue
+            message, chat_id, rule = routed
+            newest[chat_id] = message.message_id
+            if rule is not None:
+                alarms.append((message, chat_id, rule))
+
+        if policy == "skip":
+            alarms = []
+        elif policy == "coalesce":
+            alarms = alarms[-1:]
+        else:
+            alarms = [alarm for alarm in alarms if alarm[0].date and alarm[0].date.timestamp() >= cutoff]
+        for message, chat_id, rule in alarms:
+            # Catch-up alarms are not latency samples; their deadline runs from now
+            trace = AlarmTrace()
+            trace.mark_matched()
+            self.on_event(AlarmEvent("telegram", spec.name, chat_id, message.message_id,
+                                     message.text or "", rule, trace))
+        for chat_id, message_id in newest.items():
+            self.on_progress(chat_id, message_id)
+
+        if backlog:
+            log.info("Caught up on %d pending updates", len(backlog),
+                     extra=kv(bot=spec.name, policy=policy, triggered=len(alarms)))
+        for update in live:
+            self._handle_update(spec, update)
+        return offset
+
+    async def _poll(self, spec: BotSpec, bot: Bot):
+        offset = await self._catch_up(spec, bot)
+        while self.running:
+            try:
+                # Returns as soon as there is an update; the read timeout
+                # is extended by the long poll time automatically
+                updates = await bot.get_updates(timeout=LONG_POLL_TIMEOUT, offset=offset)
+                if updates:
+                    log.debug("Received %d updates", len(updates), extra=kv(bot=spec.name))
+                for update in updates:
+                    offset = update.update_id + 1
+                    self._handle_update(spec, update)
+            except TimedOut:
+                log.debug("Polling timeout (normal, continuing...)")
+            except Exception as e:
+                log.error("Failed to poll Telegram: %s", e, extra=throttle(f"poll-error:{spec.name}", 30, bot=spec.name))
+                self.on_status(f"Error polling: {str(e)[:50]}", "red")
+                # Back off before retrying (polling_rate seconds); stop() cancels the sleep
+                await asyncio.sleep(self.config.get("polling_rate", 2))
+
+    def _handle_update(self, spec: BotSpec, update):
+        trace = AlarmTrace()
+        routed = self._route(spec, update)
+        if routed is None:
+            return
+        message, chat_id, rule = routed
+        if message.date:
+            trace.message_ts = message.date.timestamp()
+        if rule is not None:
+            trace.mark_matched()
+            log.info("✓ New message detected!",
+                     extra=kv(bot=spec.name, chat=chat_id, id=message.message_id, rule=rule.name))
+            self.on_event(AlarmEvent("telegram", spec.name, chat_id, message.message_id,
+                                     message.text or "", rule, trace))
+        self.on_progress(chat_id, message.message_id)
+
+    def _route(self, spec: BotSpec, update):
+        """Filter and dedupe an update; returns (message, chat_id, rule or None) or None"""
+        # Regular messages and channel posts are handled the same way
+        message = update.message or update.channel_post
+        if not message:
+            log.debug("Update type not handled", extra=kv(update_id=update.update_id))
+            return None
+
+        chat_id = str(message.chat_id)
+        message_id = message.message_id
+        text = message.text or ""
+        if log.isEnabledFor(DEBUG):
+            log.debug("Update from chat %s: %r", chat_id, text,
+                      extra=kv(bot=spec.name, update_id=update.update_id, message_id=message_id))
+
+        route = spec.chats.get(chat_id)
+        if route is None:
+            log.debug("Ignoring message from different chat: %s", chat_id)
+            return None
+
+        # Chat ids are global, so two bots in one chat see each message once
+        last_message_id = self.last_message_ids.get(chat_id, 0)
+        if message_id <= last_message_id:
+            log.debug("Message ID %d already processed (last: %d)", message_id, last_message_id)
+            return None
+        self.last_message_ids[chat_id] = message_id
+
+        rule = match_rule(route.rules, text)
+        if rule is None:
+            log.debug("No rule matched", extra=kv(chat=chat_id, id=message_id))
+        journal.record(UPDATE, source="telegram", bot=spec.name, chat_id=chat_id, message_id=message_id,
+                       rule=rule.name if rule else None, text=text)
+        return message, chat_id, rule
@@ -0,0 +1,39 @@
+from config_reload import diff_config, merge_progress
+
+BOT = {"telegram_bot_token": "123456:ABCDEF", "telegram_chat_id": "-100"}
+
+
+def test_progress_markers_are_not_changes():
+    change = diff_config(dict(BOT, last_message_id=1), dict(BOT, last_message_id=5))
+    assert not change.keys
+    assert not change.reconnect
+
+
+def test_led_settings_apply_without_reconnecting():
+    change = diff_config(dict(BOT, color="#ff0000"), dict(BOT, color="#00ff00"))
+    assert change.keys == {"color"}
+    assert not change.reconnect
+    assert change.restart_keys == ()
+
+
+def test_new_token_reconnects():
+    change = diff_config(BOT, dict(BOT, telegram_bot_token="654321:FEDCBA"))
+    assert change.reconnect
+
+
+def test_restart_keys():
+    assert diff_config(dict(BOT, metrics_port=0), dict(BOT, metrics_port=9464)).restart_keys == ("metrics_port",)
+
+
+def test_merge_progress_never_goes_backwards():
+    current = dict(BOT, last_message_id=10, last_message_ids={"-100": 10, "-200": 7})
+    new = dict(BOT, last_message_id=3, last_message_ids={"-100": 4}, color="#123456")
+    merged = merge_progress(current, new)
+    assert merged["last_message_id"] == 10
+    assert merged["last_message_ids"] == {"-100": 10, "-200": 7}
+    assert merged["color"] == "#123456"
+
+
+def test_merge_progress_resets_the_legacy_id_for_another_chat():
+    merged = merge_progress(dict(BOT, last_message_id=10), dict(BOT, telegram_chat_id="-300", last_message_id=0))
+    assert merged["last_message_id"] == 0
@@ -0,0 +1,75 @@
+import struct
+
+import pytest
+
+from dmx import CHANNELS, SOURCE_NAME, ArtNetSender, DMXController, SACNSender
+
+
+@pytest.fixture
+def sacn():
+    sender = SACNSender("127.0.0.1", priority=150)
+    yield sender
+    sender._socket.close()
+
+
+@pytest.fixture
+def artnet():
+    sender = ArtNetSender("127.0.0.1")
+    yield sender
+    sender._socket.close()
+
+
+def test_sacn_header_layout(sacn):
+    header = sacn.header(0x1234)
+    assert len(header) == 126
+    assert header[4:16] == b"ASC-E1.17\0\0\0"
+    assert struct.unpack(">H", header[16:18])[0] == 0x7000 | (126 + CHANNELS - 16)  # root flags and length
+    assert header[22:38] == SACNSender.CID
+    assert header[44:44 + len(SOURCE_NAME)] == SOURCE_NAME
+    assert header[SACNSender.PRIORITY_AT] == 150
+    assert struct.unpack(">H", header[113:115])[0] == 0x1234  # universe
+    assert struct.unpack(">H", header[123:125])[0] == CHANNELS + 1  # start code plus channels
+    assert header[125] == 0  # DMX start code
+
+
+def test_sacn_multicast_address():
+    sender = SACNSender("")
+    try:
+        assert sender.address(0x0102) == ("239.255.1.2", 5568)
+    finally:
+        sender._socket.close()
+
+
+def test_artnet_header_layout(artnet):
+    header = artnet.header(0x1234)
+    assert len(header) == 18
+    assert header[:8] == b"Art-Net\0"
+    assert struct.unpack("<H", header[8:10])[0] == 0x5000  # OpDmx, little endian
+    assert struct.unpack(">H", header[10:12])[0] == 14  # protocol version
+    assert (header[14], header[15]) == (0x34, 0x12)  # SubUni, Net
+    assert struct.unpack(">H", header[16:18])[0] == CHANNELS
+
+
+def test_artnet_sequence_skips_zero(artnet):
+    assert artnet.next_sequence(255) == 1
+    assert artnet.next_sequence(0) == 1
+
+
+def test_write_marks_the_universe_dirty(artnet):
+    artnet.write(1, 3, b"\xff\x00\x80")
+    universe = artnet.universe(1)
+    assert universe.dirty
+    assert universe.packet[18 + 3:18 + 6] == b"\xff\x00\x80"
+    assert artnet.read(1, 3, 3) == b"\xff\x00\x80"
+
+
+def test_fixture_groups_animate_independently(artnet):
+    front, back = DMXController(artnet, 1, start=1, fixtures=4), DMXController(artnet, 1, start=13, fixtures=4)
+    assert front.device_key == back.device_key
+    assert front.effect_key != back.effect_key
+
+
+def test_plan_headers_are_read_only(artnet):
+    plan = DMXController(artnet, 1).compile_action("on", {"color": "#ff0000"})
+    with pytest.raises(TypeError):
+        plan.headers["X-Test"] = "1"
@@ -0,0 +1,23 @@
+from metrics import LatencyHistogram
+
+
+def test_sub_millisecond_percentiles_spread_out():
+    hist = LatencyHistogram()
+    for i in range(100):
+        hist.observe(0.0002 + i * 0.000001)  # 0.200 .. 0.299 ms
+    p50, p95, p99 = (hist.percentile(q) for q in (0.50, 0.95, 0.99))
+    assert 0.0002 <= p50 < p95 < p99 <= hist.max
+    assert abs(p50 - 0.00025) < 0.00001
+
+
+def test_percentiles_stay_within_observed_range():
+    hist = LatencyHistogram()
+    for value in (0.01, 0.02, 0.03, 0.2):
+        hist.observe(value)
+    assert hist.percentile(0.0) == 0.01
+    assert hist.percentile(1.0) == 0.2
+    assert 0.01 <= hist.percentile(0.5) <= 0.025
+
+
+def test_empty_histogram_has_no_percentiles():
+    assert LatencyHistogram().percentile(0.5) is None
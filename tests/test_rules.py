@@ -0,0 +1,18 @@
+from rules import match_rule, parse_rules
+
+
+def test_first_matching_rule_wins():
+    rules = parse_rules([{"name": "raid", "match": "raid|door"}, {"name": "default"}])
+    assert match_rule(rules, "Your DOOR is open").name == "raid"
+    assert match_rule(rules, "cargo ship").name == "default"
+
+
+def test_no_rules_is_a_catch_all():
+    assert match_rule(parse_rules(None), "anything").name == "default"
+
+
+def test_scheduling_values_are_checked_on_load():
+    rule, = parse_rules([{"name": "raid", "priority": "high", "hold": "-3", "max_defer": "10", "color": "#f00"}])
+    assert rule.overrides == {"max_defer": 10.0, "color": "#f00"}
+    rule, = parse_rules([{"name": "raid", "priority": "5", "hold": 2}])
+    assert rule.apply({"priority": 0}) == {"priority": 5, "hold": 2.0}
@@ -0,0 +1,38 @@
+import pytest
+
+from rustplus import (ENTITY, RESPONSE, TEAM_CHAT, decode_fields, decode_request, encode_entity_changed,
+                      encode_entity_info, encode_error, encode_fields, encode_request, encode_team_message,
+                      parse_app_message)
+
+
+def test_fields_round_trip():
+    data = encode_fields((1, 150), (2, "hé"), (3, b"\x00\x01"), (4, None), (5, True))
+    assert decode_fields(data) == {1: [150], 2: ["hé".encode("utf-8")], 3: [b"\x00\x01"], 5: [1]}
+
+
+def test_varint_encoding_matches_protobuf():
+    assert encode_fields((1, 150)) == b"\x08\x96\x01"
+    assert encode_fields((1, -1)) == b"\x08" + b"\xff" * 9 + b"\x01"  # int32 -1 is ten bytes
+
+
+def test_request_round_trip_with_negative_token():
+    data = encode_request(7, 76561198000000000, -123456789, entity_id=1234567, get_entity_info=True)
+    assert decode_request(data) == {"seq": 7, "player_id": 76561198000000000, "player_token": -123456789,
+                                    "entity_id": 1234567, "get_entity_info": True, "get_team_chat": False}
+
+
+def test_parse_messages():
+    info = parse_app_message(encode_entity_info(3, 2, True))
+    assert (info.kind, info.seq, info.entity_type, info.value) == (RESPONSE, 3, 2, True)
+    assert parse_app_message(encode_error(4, "not_found")).error == "not_found"
+    changed = parse_app_message(encode_entity_changed(1234567, True))
+    assert (changed.kind, changed.entity_id, changed.value) == (ENTITY, 1234567, True)
+    chat = parse_app_message(encode_team_message(1, "Bob", "raid at base", 1700000000))
+    assert (chat.kind, chat.name, chat.text, chat.time) == (TEAM_CHAT, "Bob", "raid at base", 1700000000)
+
+
+def test_truncated_data_raises():
+    with pytest.raises(ValueError):
+        decode_fields(b"\x08\x96")
+    with pytest.raises(ValueError):
+        decode_fields(b"\x12\x05ab")
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+from scheduler import DEFERRED, DROPPED, RUN, PriorityScheduler
+
+
+@pytest.fixture
+def scheduler():
+    ran = []
+    scheduler = PriorityScheduler(lambda config, trace: ran.append(config["name"]), lambda config: "strip")
+    scheduler.ran = ran
+    yield scheduler
+    scheduler.cancel()
+
+
+def alarm(name, priority=0, hold=0, **extra):
+    return dict(name=name, priority=priority, hold=hold, **extra)
+
+
+def test_lower_priority_waits_for_the_hold(scheduler):
+    assert scheduler.submit(alarm("raid", 10, 0.2)) == RUN
+    assert scheduler.submit(alarm("cargo", 1)) == DEFERRED
+    assert scheduler.snapshot()["strip"]["pending"] == 1
+    time.sleep(0.35)
+    assert scheduler.ran == ["raid", "cargo"]
+
+
+def test_when_busy_drop(scheduler):
+    scheduler.submit(alarm("raid", 10, 5))
+    assert scheduler.submit(alarm("cargo", 1, when_busy="drop")) == DROPPED
+    assert scheduler.snapshot()["strip"]["pending"] == 0
+    assert scheduler.ran == ["raid"]
+
+
+def test_preempted_hold_resumes(scheduler):
+    scheduler.submit(alarm("raid", 10, 0.5))
+    assert scheduler.submit(alarm("urgent", 20, 0.1)) == RUN
+    time.sleep(0.25)
+    assert scheduler.ran == ["raid", "urgent", "raid"]
+    assert scheduler.snapshot()["strip"]["active"] == 10
+
+
+def test_higher_one_shot_keeps_the_hold(scheduler):
+    scheduler.submit(alarm("raid", 10, 5))
+    assert scheduler.submit(alarm("urgent", 20)) == RUN
+    assert scheduler.submit(alarm("cargo", 1)) == DEFERRED
+    assert scheduler.snapshot()["strip"]["active"] == 10
+
+
+def test_stale_deferred_alarms_are_dropped(scheduler):
+    scheduler.submit(alarm("raid", 10, 0.3))
+    scheduler.submit(alarm("cargo", 1, max_defer=0.1))
+    time.sleep(0.45)
+    assert scheduler.ran == ["raid"]
+
+
+def test_equal_one_shot_keeps_the_hold_and_the_queue(scheduler):
+    scheduler.submit(alarm("raid", 10, 0.2))
+    scheduler.submit(alarm("cargo", 1))
+    assert scheduler.submit(alarm("raid again", 10)) == RUN
+    assert scheduler.snapshot()["strip"] == {"active": 10, "remaining": pytest.approx(0.2, abs=0.1), "pending": 1}
+    time.sleep(0.35)
+    assert scheduler.ran == ["raid", "raid again", "cargo"]
+
+
+def test_held_alarm_resumes_under_a_deferred_one_shot(scheduler):
+    scheduler.submit(alarm("raid", 10, 1))
+    scheduler.submit(alarm("big", 20, 0.1))
+    scheduler.submit(alarm("mid", 15))
+    scheduler.submit(alarm("cargo", 1))
+    time.sleep(0.25)
+    # raid holds again with mid shown over it; cargo still waits for raid
+    assert scheduler.ran == ["raid", "big", "raid", "mid"]
+    assert scheduler.snapshot()["strip"]["active"] == 10
+    assert scheduler.snapshot()["strip"]["pending"] == 1
@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+from service import DEFAULT_ALARM_BURST, DEFAULT_ALARMS_PER_MINUTE, DEFAULT_PARALLEL_ACTIONS, read_config, \
+    tenant_limits
+
+
+def test_limits_default():
+    assert tenant_limits({}) == (DEFAULT_ALARMS_PER_MINUTE, DEFAULT_ALARM_BURST, DEFAULT_PARALLEL_ACTIONS)
+
+
+def test_negative_limits_are_clamped():
+    assert tenant_limits({"alarms_per_minute": -5, "alarm_burst": -1, "max_parallel_actions": 0}) == (0, 1, 1)
+
+
+@pytest.mark.parametrize("key, value", [("alarms_per_minute", "fast"), ("alarm_burst", None),
+                                        ("max_parallel_actions", [2]), ("alarms_per_minute", "nan")])
+def test_bad_limits_are_rejected(key, value):
+    with pytest.raises(ValueError, match=key):
+        tenant_limits({key: value})
+
+
+def test_read_config_rejects_bad_limits_and_webhook(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"alarms_per_minute": "fast"}))
+    with pytest.raises(ValueError):
+        read_config(str(path))
+    path.write_text(json.dumps({"webhook": {"port": "eighty"}}))
+    with pytest.raises(ValueError, match="webhook"):
+        read_config(str(path))
@@ -0,0 +1,138 @@
+"""
+Webhook intake: trigger alarms with an HTTP POST on the LAN
+
+For Home Assistant automations, scripts or a Rust+ bot. With a ``webhook``
+section the app serves::
+
+    "webhook": {
+        "port": 8765, "host": "0.0.0.0", "secret": "change-me",
+        "rules": [{"name": "raid", "match": "raid", "action": "effect", "effect": "38"}]
+    }
+
+    POST /event  {"rule": "raid"}                 runs the rule by name
+    POST /event  {"text": "Base is being raided"} matches the text like a Telegram message
+    POST /event  {"payload": {...}}                matches the payload's JSON text
+    GET  /health
+
+with the secret in an ``X-Webhook-Secret`` header (or ``Authorization:
+Bearer <secret>``). Without a secret the webhook only serves on a loopback
+host; on any other address it refuses to start. A matched event is handed to ``on_event`` as an
+``AlarmEvent`` and answered with ``202 Accepted`` right away; the action is
+queued like any other alarm.
+
+The server is the small JSON server in ``local_http.py``, shared with the
+control API.
+"""
+
+import json
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from app_logging import get_logger, kv, throttle
+from journal import UPDATE, journal
+from local_http import LOOPBACK, JSONServer, check_secret, parse_object
+from metrics import AlarmTrace
+from rules import AlarmEvent, Rule, match_rule, parse_rules
+
+log = get_logger("webhook")
+
+DEFAULT_PORT = 8765
+
+
+class WebhookSettings(NamedTuple):
+    host: str
+    port: int
+    secret: str
+    rules: List[Rule]
+
+    @property
+    def connection(self) -> Tuple:
+        """What a restart of the server is needed for"""
+        return self.host, self.port
+
+
+def webhook_settings(config: Dict) -> Optional[WebhookSettings]:
+    """Settings from the ``webhook`` section; None when it's missing or disabled"""
+    section = config.get("webhook")
+    if not section or not section.get("enabled", True):
+        return None
+    return WebhookSettings(section.get("host", "0.0.0.0"), int(section.get("port", DEFAULT_PORT)),
+                           str(section.get("secret", "")), parse_rules(section.get("rules")))
+
+
+class WebhookIntake(JSONServer):
+    """Serves the webhook on the current event loop until ``stop()``"""
+
+    name = "Webhook"
+    log = log
+
+    def __init__(self, config: Dict, on_event: Callable[[AlarmEvent], None],
+                 on_status: Optional[Callable[[str, str], None]] = None):
+        super().__init__()
+        self.config = config
+        self.on_event = on_event
+        self.on_status = on_status or (lambda message, color: None)
+        self.settings = webhook_settings(config)
+        self._events = 0
+
+    async def run(self):
+        """Serve until ``stop()``; returns at once without a webhook section"""
+        self._attach()
+        if not self.running or self.settings is None:
+            return
+        settings = self.settings
+        if not settings.secret and settings.host not in LOOPBACK:
+            log.error("Webhook has no secret; set one or use host 127.0.0.1", extra=kv(host=settings.host))
+            self.on_status("ERROR: Webhook needs a secret to listen on the network", "red")
+            return
+        if not await self.serve(settings.host, settings.port):
+            self.on_status(f"ERROR: Webhook port {settings.port} unavailable", "red")
+
+    def apply_config(self, config: Dict) -> bool:
+        """Swap in a new secret and rules (any thread); False when the server must restart"""
+        settings = webhook_settings(config)
+        current = self.settings
+        if (settings is None) != (current is None) or (settings and settings.connection != current.connection):
+            return False
+        self.settings = settings
+        self.config = config
+        return True
+
+    async def _handle(self, method: str, path: str, headers: Dict[str, str], body: bytes,
+                      client: str) -> Tuple[int, Dict]:
+        if path == "/health":
+            return 200, {"ok": True}
+        if path not in ("/event", "/"):
+            return 404, {"error": "not found"}
+        if method != "POST":
+            return 405, {"error": "use POST"}
+        if not check_secret(headers, self.settings.secret, "x-webhook-secret"):
+            log.warning("Webhook request with a wrong secret", extra=throttle("webhook-auth", 30, client=client))
+            return 401, {"error": "wrong secret"}
+        try:
+            event = parse_object(body)
+        except ValueError as e:
+            return 400, {"error": f"invalid JSON: {e}"}
+
+        trace = AlarmTrace()
+        rules = self.settings.rules
+        # Payload: free-form data from the sender, matched and journaled as JSON
+        text = str(event.get("text") or (json.dumps(event["payload"]) if event.get("payload") else ""))
+        if event.get("rule"):
+            rule = next((rule for rule in rules if rule.name == event["rule"]), None)
+            if rule is None:
+                return 404, {"error": f"no rule named {event['rule']!r}"}
+            text = text or rule.name
+        else:
+            rule = match_rule(rules, text)
+
+        self._events += 1
+        journal.record(UPDATE, source="webhook", bot=client, chat_id="webhook", message_id=self._events,
+                       rule=rule.name if rule else None, text=text)
+        if rule is None:
+            log.debug("No rule matched", extra=kv(client=client, text=text))
+            return 200, {"accepted": False, "rule": None}
+        trace.mark_matched()
+        log.info("✓ Webhook event", extra=kv(client=client, rule=rule.name))
+        # Queues the action (scheduler, executor); never waits for the device
+        self.on_event(AlarmEvent("webhook", client, "webhook", self._events, text, rule, trace))
+        return 202, {"accepted": True, "rule": rule.name}
@@ -0,0 +1,243 @@
+"""
+Zones: several lights changing together for one alarm
+
+A zone is a named list of devices, each given as the device settings that
+differ from the main config::
+
+    "zones": {
+        "base": [
+            {"led_type": "wled", "wled_ip": "192.168.1.50"},
+            {"led_type": "wled", "wled_mac": "a8:03:2a:11:22:33", "wled_segment": 1},
+            {"led_type": "govee", "govee_device_id": "AB:CD:...", "govee_model": "H6163", "lead_ms": "auto"}
+        ]
+    }
+
+and a rule (or the main config) with ``"zone": "base"`` runs its action on
+every member. Issued one after another the members visibly change out of
+step, so ``execute_zone`` runs each member on its own thread up to the point
+where its request is compiled and its device claimed, holds them all at a
+start gate and releases them at once.
+
+Devices that are slower to react can start early: ``lead_ms`` on a member
+launches its request that many milliseconds before the others, and
+``"auto"`` uses the device's measured time from request to answer. The
+spread of the answers (the skew) is logged and shown in the metrics tab.
+"""
+
+import copy
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app_logging import get_logger, kv
+from dispatch import ActionResult, action_plans, claim_device, execute_action
+from led_controllers import Command
+from metrics import AlarmTrace
+
+log = get_logger("zone")
+
+AUTO_LEAD = "auto"
+GATE_TIMEOUT = 1.0  # seconds the gate waits for a member still getting ready
+LATENCY_SMOOTHING = 0.3  # weight of the newest sample in a device's measured latency
+MAX_MEMBERS = 32  # threads shared by all zones; larger zones release in waves
+
+
+class StartGate:
+    """Holds members until every one of them has arrived or withdrawn.
+
+    Unlike ``threading.Barrier`` a member that can't send (not configured,
+    circuit open, dropped) withdraws instead of keeping the others waiting.
+    """
+
+    def __init__(self, parties: int, timeout: float = GATE_TIMEOUT):
+        self._waiting = parties
+        self._timeout = timeout
+        self._condition = threading.Condition()
+        self.released: Optional[float] = None  # time.monotonic() of the release
+
+    def arrive(self) -> float:
+        """Wait for the rest; returns the release time"""
+        with self._condition:
+            self._waiting -= 1
+            if self._waiting <= 0:
+                self._condition.notify_all()
+            elif not self._condition.wait_for(lambda: self._waiting <= 0, self._timeout):
+                log.warning("Zone members late, releasing without them", extra=kv(missing=self._waiting))
+                self._waiting = 0
+                self._condition.notify_all()
+            if self.released is None:
+                self.released = time.monotonic()
+            return self.released
+
+    def withdraw(self):
+        with self._condition:
+            self._waiting -= 1
+            if self._waiting <= 0:
+                self._condition.notify_all()
+
+
+class _Member:
+    """One member's place at the gate; called by dispatch right before sending"""
+
+    def __init__(self, gate: StartGate, delay: float):
+        self.gate = gate
+        self.delay = delay  # seconds after the release, to let slower members lead
+        self.arrived = False
+        self.sent: Optional[float] = None
+
+    def __call__(self):
+        self.arrived = True
+        released = self.gate.arrive()
+        if self.delay > 0:
+            time.sleep(max(0.0, released + self.delay - time.monotonic()))
+        self.sent = time.monotonic()
+
+    def leave(self):
+        if not self.arrived:
+            self.gate.withdraw()
+
+
+class MemberResult(NamedTuple):
+    device: str
+    success: bool
+    message: str
+    lead_ms: float
+    offset_ms: Optional[float]  # answer time relative to the earliest member; None if it failed
+
+
+class ZoneStats:
+    """Measured device latency (for ``lead_ms: "auto"``) and each zone's last skew"""
+
+    def __init__(self):
+        self._latency: Dict[str, float] = {}  # device key -> seconds from request to answer
+        self._last: Dict[str, Tuple[float, List[MemberResult]]] = {}  # zone -> (wall time, members)
+        self._lock = threading.Lock()
+
+    def latency(self, device: str) -> float:
+        return self._latency.get(device, 0.0)
+
+    def record(self, zone: str, members: List[MemberResult], latencies: Dict[str, float]):
+        with self._lock:
+            for device, seconds in latencies.items():
+                previous = self._latency.get(device)
+                self._latency[device] = seconds if previous is None else (
+                    previous + LATENCY_SMOOTHING * (seconds - previous))
+            self._last[zone] = (time.time(), members)
+
+    def reset(self):
+        with self._lock:
+            self._latency.clear()
+            self._last.clear()
+
+    def render_text(self) -> str:
+        with self._lock:
+            last = dict(self._last)
+            latency = dict(self._latency)
+        lines = [f"{'Zone / device':<36}{'Lead ms':>10}{'Skew ms':>10}{'Avg ms':>10}"]
+        if not last:
+            lines.append("(no zone alarms yet)")
+        for zone, (when, members) in sorted(last.items()):
+            offsets = [m.offset_ms for m in members if m.offset_ms is not None]
+            skew = f"{max(offsets):.1f}" if offsets else "-"
+            title = f"{zone} at {time.strftime('%H:%M:%S', time.localtime(when))}"
+            lines.append(f"{title:<36}{'':>10}{skew:>10}")
+            for member in members:
+                offset = f"+{member.offset_ms:.1f}" if member.offset_ms is not None else "failed"
+                average = f"{latency[member.device] * 1000:.1f}" if member.device in latency else "-"
+                lines.append(f"  {member.device:<34}{member.lead_ms:>10.0f}{offset:>10}{average:>10}")
+        return "\n".join(lines)
+
+
+zone_stats = ZoneStats()
+
+_pool = ThreadPoolExecutor(MAX_MEMBERS, thread_name_prefix="zone")
+
+
+def zone_members(config: Dict) -> List[Dict]:
+    """Full configs of the zone's members: the alarm's config with each member's settings on top"""
+    name = config["zone"]
+    members = config.get("zones", {}).get(name)
+    if not members:
+        raise ValueError(f"Zone '{name}' has no devices")
+    configs = []
+    for member in members:
+        member_config = dict(config, **member)
+        member_config.pop("zone", None)
+        configs.append(member_config)
+    return configs
+
+
+def claim_zone(config: Dict, trace: Optional[AlarmTrace] = None) -> Optional[List[Optional[Command]]]:
+    """``claim_device`` for every member; None if the zone doesn't exist"""
+    try:
+        return [claim_device(member, trace) for member in zone_members(config)]
+    except ValueError:
+        return None
+
+
+def _lead(member: Dict, device: Optional[str]) -> float:
+    """Seconds this member starts ahead of a member without lead"""
+    lead = member.get("lead_ms", 0)
+    if lead == AUTO_LEAD:
+        return zone_stats.latency(device) if device else 0.0
+    return max(0.0, float(lead or 0)) / 1000
+
+
+def execute_zone(config: Dict, trace: Optional[AlarmTrace] = None,
+                 commands: Optional[List[Optional[Command]]] = None) -> ActionResult:
+    """Run the action on every member of ``config["zone"]`` at once.
+
+    Each member gets its own copy of the trace, so the metrics and journal
+    see one result per device.
+    """
+    name = config["zone"]
+    try:
+        members = zone_members(config)
+    except ValueError as e:
+        log.warning(str(e))
+        return ActionResult(False, f"❌ Error: {e}")
+    if commands is None or len(commands) != len(members):
+        commands = [claim_device(member, trace) for member in members]
+
+    devices = []
+    for member in members:
+        controller = action_plans.get(member).controller
+        devices.append(controller.device_key if controller else member.get("led_type", "wled"))
+    leads = [_lead(member, device) for member, device in zip(members, devices)]
+    max_lead = max(leads)
+    gate = StartGate(len(members))
+    places = [_Member(gate, max_lead - lead) for lead in leads]
+
+    def run(member, command, place):
+        try:
+            result = execute_action(member, copy.copy(trace), command, release=place)
+        finally:
+            place.leave()
+        return result, time.monotonic()
+
+    futures = [_pool.submit(run, member, command, place)
+               for member, command, place in zip(members, commands, places)]
+    outcomes = [future.result() for future in futures]
+
+    answered = [acked for (result, acked), place in zip(outcomes, places) if result.success and place.sent]
+    first = min(answered) if answered else 0.0
+    results, latencies = [], {}
+    for device, lead, place, (result, acked) in zip(devices, leads, places, outcomes):
+        ok = result.success and place.sent is not None
+        if ok:
+            latencies[device] = acked - place.sent
+        results.append(MemberResult(device, result.success, result.message, lead * 1000,
+                                    (acked - first) * 1000 if ok else None))
+    zone_stats.record(name, results, latencies)
+
+    succeeded = sum(result.success for result in results)
+    skew = max((r.offset_ms for r in results if r.offset_ms is not None), default=0.0)
+    log.info("Zone %s: %d/%d devices", name, succeeded, len(results),
+             extra=kv(skew_ms=f"{skew:.1f}",
+                      offsets=" ".join(f"{r.device}=+{r.offset_ms:.1f}" if r.offset_ms is not None
+                                       else f"{r.device}=failed" for r in results)))
+    if succeeded == len(results):
+        return ActionResult(True, f"✓ Zone {name}: {succeeded} devices in sync (skew {skew:.0f} ms)")
+    failed = next(result.message for result in results if not result.success)
+    return ActionResult(False, f"❌ Zone {name}: {succeeded}/{len(results)} devices. {failed}")